@@ -1,20 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 from database import get_db, User
-from dependencies import require_admin, require_ownership
-from crud import UserCRUD, VotingSessionCRUD
+from dependencies import require_admin, require_ownership, invalidate_user
+from crud import AsyncUserCRUD, AsyncVotingSessionCRUD
+from pagination import PageParams
+from invalidation import invalidation_bus
 
 router = APIRouter(prefix="/admin", tags=["管理员API"])
 
 @router.get("/users")
 async def get_all_users(
+    role: Optional[str] = Query(None, description="按角色筛选"),
+    username_prefix: Optional[str] = Query(None, description="按用户名前缀筛选"),
+    page: PageParams = Depends(),
     current_user: User = Depends(require_admin("admin")),
     db: Session = Depends(get_db)
 ):
-    """获取所有用户列表（仅管理员）"""
-    users = UserCRUD.get_all_users(db)
+    """获取所有用户列表（仅管理员，游标分页）"""
+    users, next_cursor = await AsyncUserCRUD.get_all_users(
+        db,
+        limit=page.limit,
+        cursor=page.cursor,
+        order=page.order,
+        role=role,
+        username_prefix=username_prefix
+    )
     
     return {
         "users": [
@@ -25,7 +37,8 @@ async def get_all_users(
                 "created_at": user.created_at.isoformat() if user.created_at else None
             }
             for user in users
-        ]
+        ],
+        "next_cursor": next_cursor
     }
 
 @router.delete("/users/{user_id}")
@@ -35,7 +48,7 @@ async def delete_user(
     db: Session = Depends(get_db)
 ):
     """删除用户（仅管理员）"""
-    user_to_delete = UserCRUD.get_user_by_id(db, user_id)
+    user_to_delete = await AsyncUserCRUD.get_user_by_id(db, user_id)
     
     if not user_to_delete:
         raise HTTPException(
@@ -50,16 +63,14 @@ async def delete_user(
             detail="不能删除自己的账户"
         )
     
-    try:
-        db.delete(user_to_delete)
-        db.commit()
-        return {"message": f"用户 {user_to_delete.username} 已删除"}
-    except Exception as e:
-        db.rollback()
+    result = await AsyncUserCRUD.delete_user(db, user_to_delete)
+    invalidate_user(user_id)
+    if "error" in result:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"删除用户失败: {str(e)}"
+            detail=result["error"]
         )
+    return result
 
 @router.put("/users/{user_id}/role")
 async def update_user_role(
@@ -75,7 +86,7 @@ async def update_user_role(
             detail="无效的角色"
         )
     
-    user_to_update = UserCRUD.get_user_by_id(db, user_id)
+    user_to_update = await AsyncUserCRUD.get_user_by_id(db, user_id)
     
     if not user_to_update:
         raise HTTPException(
@@ -83,35 +94,40 @@ async def update_user_role(
             detail="用户不存在"
         )
     
-    try:
-        user_to_update.role = new_role
-        db.commit()
-        db.refresh(user_to_update)
-        
-        return {
-            "message": f"用户 {user_to_update.username} 角色已更新为 {new_role}",
-            "user": {
-                "id": user_to_update.id,
-                "username": user_to_update.username,
-                "role": user_to_update.role
-            }
-        }
-    except Exception as e:
-        db.rollback()
+    result = await AsyncUserCRUD.update_user_role(db, user_to_update, new_role)
+    invalidate_user(user_id)
+    if isinstance(result, dict) and "error" in result:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"更新用户角色失败: {str(e)}"
+            detail=result["error"]
         )
+    
+    return {
+        "message": f"用户 {user_to_update.username} 角色已更新为 {new_role}",
+        "user": {
+            "id": user_to_update.id,
+            "username": user_to_update.username,
+            "role": user_to_update.role
+        }
+    }
 
 @router.get("/sessions")
 async def get_all_sessions(
+    master_id: Optional[int] = Query(None, description="按创建者筛选"),
+    keyword: Optional[str] = Query(None, description="按标题筛选"),
+    page: PageParams = Depends(),
     current_user: User = Depends(require_admin("admin")),
     db: Session = Depends(get_db)
 ):
-    """获取所有投票会话（仅管理员）"""
-    from database import VotingSession
-    
-    sessions = db.query(VotingSession).all()
+    """获取所有投票会话（仅管理员，游标分页）"""
+    sessions, next_cursor = await AsyncVotingSessionCRUD.list_sessions(
+        db,
+        limit=page.limit,
+        cursor=page.cursor,
+        order=page.order,
+        master_id=master_id,
+        keyword=keyword
+    )
     
     return {
         "sessions": [
@@ -122,8 +138,14 @@ async def get_all_sessions(
                 "is_public": session.is_public,
                 "created_at": session.created_at.isoformat() if session.created_at else None,
                 # isoformat()：Python datetime对象的方法，将时间转换为ISO 8601标准格式
-                "anime_count": len(session.anime_list) if session.anime_list else 0
+                "anime_count": session.anime_count
             }
             for session in sessions
-        ]
-    }
\ No newline at end of file
+        ],
+        "next_cursor": next_cursor
+    }
+
+@router.get("/invalidation")
+async def get_invalidation_stats(current_user: User = Depends(require_admin("admin"))):
+    """本 worker 的缓存失效总线状态：已处理到的事件 id、各类事件数（仅管理员）"""
+    return invalidation_bus.stats()
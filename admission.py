@@ -0,0 +1,291 @@
+"""
+准入控制与限流
+
+- AdmissionGate：按路由类别限制同时处理的请求数，超出的请求在有界队列中按先后等待；
+  队列已满、按最近的处理速度预计等不到 max_wait，或等待超时时立即返回 503 + Retry-After，
+  不让突发的投票在事件循环和 SQLite 写锁上堆积，拖慢只读访问
+- RateLimiter：按用户 / IP 的令牌桶，OrderedDict 中每个键只保存 (令牌数, 更新时间)，
+  按最近使用排序；空闲到令牌已回满的桶与不存在等价，从最久未用的一端顺带淘汰
+- 作为路由依赖使用，放在最前面：在校验请求体、鉴权（可能查询用户、占用数据库连接）之前执行
+      @router.post("/...", dependencies=[Depends(vote_gate), Depends(limit_vote)])
+- 计数都在本进程内，多 worker 部署时实际上限为 worker 数倍
+- 按 IP 限流需要知道真实的客户端地址：在负载均衡后面时配置 TRUSTED_PROXIES，
+  只信任来自这些地址的 X-Forwarded-For；没有配置时默认不按 IP 限流（见 RATE_LIMIT_BY_IP）
+拒绝次数、排队深度和令牌桶键数记入 /metrics，GET /api/voting/admission 返回当前状态
+"""
+import asyncio
+import ipaddress
+import math
+import os
+import time
+from collections import Counter, OrderedDict, deque
+
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordRequestForm
+
+from database import DB_POOL_SIZE, User
+from dependencies import get_current_user
+from metrics import (admission_active, admission_queue_depth, admission_rejected,
+                     rate_limit_keys, rate_limited, registry)
+from security import PASSWORD_HASH_WORKERS
+
+# 是否启用令牌桶限流（压测时可关闭）
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+# 可信的反向代理 / 负载均衡地址（逗号分隔的 IP 或网段）。只有直接连接来自这些地址时才读取
+# X-Forwarded-For，否则任何客户端都能伪造这个头绕过按 IP 的限流
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(part.strip(), strict=False)
+    for part in os.getenv("TRUSTED_PROXIES", "").split(",") if part.strip()
+]
+# 是否按 IP 限流：默认只在配置了 TRUSTED_PROXIES 时开启。在负载均衡后面而没有配置时，所有请求的 IP
+# 都是负载均衡的地址，按 IP 的限额会变成整站（每个 worker）的上限；直接对外提供服务时设为 1
+RATE_LIMIT_BY_IP = os.getenv("RATE_LIMIT_BY_IP", "1" if TRUSTED_PROXIES else "0") == "1"
+# 每个令牌桶最多保存的键数，超过后淘汰最久未用的键（被淘汰的键下次按满桶计算）
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# 处理耗时的指数移动平均系数，用于预计排队时间
+_SERVICE_TIME_ALPHA = 0.1
+
+
+class AdmissionGate:
+    """一类路由的并发上限 + 有界等待队列；concurrency 为 0 时不限制"""
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, max_wait_ms: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait_ms / 1000
+        self.active = 0
+        self._waiters = deque()
+        self._service_time = None  # 最近请求处理耗时的移动平均（秒）
+        self.admitted = 0
+        self.rejected = Counter()
+
+    @classmethod
+    def from_env(cls, name: str, concurrency: int, max_queue: int, max_wait_ms: float):
+        """读取 ADMISSION_<NAME>_CONCURRENCY / _QUEUE / _MAX_WAIT_MS，未设置时使用给定的默认值"""
+        prefix = f"ADMISSION_{name.upper()}_"
+        return cls(
+            name,
+            int(os.getenv(prefix + "CONCURRENCY", str(concurrency))),
+            int(os.getenv(prefix + "QUEUE", str(max_queue))),
+            float(os.getenv(prefix + "MAX_WAIT_MS", str(max_wait_ms)))
+        )
+
+    def expected_wait(self) -> float:
+        """按最近的处理耗时估计新请求排到队尾需要等待的秒数"""
+        if self._service_time is None:
+            return 0.0
+        return (len(self._waiters) + 1) / self.concurrency * self._service_time
+
+    def _reject(self, reason: str, retry_after: float):
+        self.rejected[reason] += 1
+        admission_rejected.inc(self.name, reason)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="请求过多，请稍后重试",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    async def acquire(self):
+        """取得一个处理名额；无法在 max_wait 内取得时抛出 503"""
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._reject("queue_full", self.expected_wait() or self.max_wait)
+        expected = self.expected_wait()
+        if expected > self.max_wait:
+            self._reject("deadline", expected)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            self._discard(future)
+            self._reject("timeout", self.max_wait)
+        except BaseException:
+            # 请求被取消：已经分到的名额要还回去
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                self._discard(future)
+            raise
+        self.admitted += 1
+
+    def _discard(self, future):
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+    def release(self, duration: float = None):
+        """归还名额：直接交给队首仍在等待的请求，没有时名额数减一"""
+        if duration is not None:
+            self._service_time = duration if self._service_time is None else (
+                self._service_time + _SERVICE_TIME_ALPHA * (duration - self._service_time))
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    async def __call__(self):
+        """路由依赖：请求处理完（响应发送后）才归还名额"""
+        if self.concurrency <= 0:
+            yield
+            return
+        await self.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queued": len(self._waiters),
+            "max_queue": self.max_queue,
+            "max_wait_ms": self.max_wait * 1000,
+            "service_time_ms": round(self._service_time * 1000, 2) if self._service_time is not None else None,
+            "expected_wait_ms": round(self.expected_wait() * 1000, 2) if self.concurrency > 0 else 0,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected)
+        }
+
+
+class RateLimiter:
+    """令牌桶：每秒补充 rate 个令牌，最多攒 burst 个；rate 为 0 时不限制"""
+
+    def __init__(self, name: str, rate: float, burst: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # 空闲这么久之后令牌已回满，桶可以丢弃
+        self.idle_seconds = burst / rate if rate > 0 else 0
+        self._buckets = OrderedDict()  # key -> (令牌数, 更新时间)，最久未用的在前
+        self.limited = 0
+
+    @classmethod
+    def from_env(cls, name: str, rate: float, burst: float, enabled: bool = True):
+        """读取 RATE_LIMIT_<NAME>="每秒令牌数,桶容量"，未设置时使用给定的默认值；enabled 为 False 时不限制"""
+        value = os.getenv(f"RATE_LIMIT_{name.upper()}")
+        if value:
+            rate, burst = (float(part) for part in value.split(","))
+        return cls(name, rate if RATE_LIMIT_ENABLED and enabled else 0, burst)
+
+    def hit(self, key) -> float:
+        """消耗一个令牌：返回 0 表示放行，否则为令牌补上还需等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        buckets = self._buckets
+        item = buckets.pop(key, None)
+        tokens = self.burst if item is None else min(self.burst, item[0] + (now - item[1]) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / self.rate
+        buckets[key] = (tokens, now)
+        self._evict(now)
+        return wait
+
+    def _evict(self, now: float):
+        """从最久未用的一端淘汰已回满的桶，以及超出 max_keys 的桶"""
+        buckets = self._buckets
+        while buckets:
+            key, (_, updated_at) = next(iter(buckets.items()))
+            if now - updated_at < self.idle_seconds and len(buckets) <= self.max_keys:
+                break
+            del buckets[key]
+
+    def check(self, key):
+        """超出限额时抛出 429"""
+        wait = self.hit(key)
+        if wait:
+            self.limited += 1
+            rate_limited.inc(self.name)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="请求过于频繁，请稍后重试",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))}
+            )
+
+    def stats(self) -> dict:
+        return {"rate": self.rate, "burst": self.burst, "keys": len(self._buckets), "limited": self.limited}
+
+
+# 路由类别：
+# - 投票（单张与批量导入）：默认并发数等于连接池大小，溢出连接留给只读请求
+# - 登录注册：默认并发数为哈希线程数的两倍，线程池始终有活干，排队留在这里而不是占着数据库连接
+vote_gate = AdmissionGate.from_env("vote", concurrency=DB_POOL_SIZE, max_queue=256, max_wait_ms=2000)
+auth_gate = AdmissionGate.from_env("auth", concurrency=PASSWORD_HASH_WORKERS * 2, max_queue=256, max_wait_ms=3000)
+GATES = [vote_gate, auth_gate]
+
+# 投票：每个用户每秒 1 张、最多连续 5 张；同一 IP（可能是 NAT 后的多人）每秒 20 张
+vote_user_limiter = RateLimiter.from_env("vote_user", rate=1, burst=5)
+vote_ip_limiter = RateLimiter.from_env("vote_ip", rate=20, burst=100, enabled=RATE_LIMIT_BY_IP)
+# 登录：同一用户名每 5 秒 1 次、最多连续 5 次（防止猜密码）；同一 IP 每秒 2 次
+login_user_limiter = RateLimiter.from_env("login_user", rate=0.2, burst=5)
+login_ip_limiter = RateLimiter.from_env("login_ip", rate=2, burst=20, enabled=RATE_LIMIT_BY_IP)
+LIMITERS = [vote_user_limiter, vote_ip_limiter, login_user_limiter, login_ip_limiter]
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_ip(request: Request) -> str:
+    """
+    客户端 IP：直接连接来自可信代理时，从 X-Forwarded-For 的右端（离本服务最近的一跳）向左
+    跳过可信代理，取第一个不可信的地址；左边的部分由客户端填写，不可信
+    """
+    peer = request.client.host if request.client else "unknown"
+    if not _is_trusted_proxy(peer):
+        return peer
+    hops = [hop.strip() for header in request.headers.getlist("x-forwarded-for") for hop in header.split(",")]
+    hops = [hop for hop in hops if hop]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else peer
+
+
+async def limit_vote(request: Request, current_user: User = Depends(get_current_user)):
+    """投票限流：按用户和 IP"""
+    vote_user_limiter.check(current_user.id)
+    vote_ip_limiter.check(client_ip(request))
+
+
+async def limit_login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    """登录限流：按 IP 和尝试的用户名"""
+    login_ip_limiter.check(client_ip(request))
+    login_user_limiter.check(form_data.username)
+
+
+def admission_stats() -> dict:
+    return {
+        "gates": {gate.name: gate.stats() for gate in GATES},
+        "rate_limits": {limiter.name: limiter.stats() for limiter in LIMITERS}
+    }
+
+
+def _collect():
+    for gate in GATES:
+        admission_queue_depth.set(gate.name, value=len(gate._waiters))
+        admission_active.set(gate.name, value=gate.active)
+    for limiter in LIMITERS:
+        rate_limit_keys.set(limiter.name, value=len(limiter._buckets))
+
+
+registry.collectors.append(_collect)
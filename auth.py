@@ -4,20 +4,29 @@ from sqlalchemy.orm import Session
 from datetime import timedelta
 
 from database import get_db
-from security import PasswordUtils
-from crud import UserCRUD
+from security import PasswordUtils, PasswordHashBusy
+from crud import AsyncUserCRUD
 from database import UserRegister, Token, User
 from dependencies import get_current_user
+from admission import auth_gate, limit_login
 from fastapi.responses import JSONResponse
 
 router= APIRouter(prefix = "/auth",tags = ["认证"])
+
+def hash_busy_error():
+    """密码哈希队列已满时返回 503，让客户端稍后重试"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="服务繁忙，请稍后重试",
+        headers={"Retry-After": "1"}
+    )
 # prefix="/auth"
 # 路径前缀：所有在这个 router 中定义的路由都会自动添加这个前缀
 # 例如：/login 会变成 /auth/login
 # tags=["认证"]
 # API 文档标签：在 Swagger UI 文档中将这些路由分组显示
 # 提高文档的可读性和组织性
-@router.post("/register", response_model=dict)
+@router.post("/register", response_model=dict, dependencies=[Depends(auth_gate)])
 # response_model=dict
 # 响应模型：指定接口返回的数据结构
 
@@ -30,7 +39,10 @@ router= APIRouter(prefix = "/auth",tags = ["认证"])
 # 自动过滤返回字段
 async def register(user_data: UserRegister, db: Session = Depends(get_db)):
     """用户注册"""
-    result = UserCRUD.register_user(db, user_data)
+    try:
+        result = await AsyncUserCRUD.register_user(db, user_data)
+    except PasswordHashBusy:
+        raise hash_busy_error()
     try:  
         if result is None:
                 return JSONResponse(
@@ -51,7 +63,7 @@ async def register(user_data: UserRegister, db: Session = Depends(get_db)):
             status_code=500
         )
 
-@router.post("/login", response_model=Token)
+@router.post("/login", response_model=Token, dependencies=[Depends(auth_gate), Depends(limit_login)])
 async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
 #     OAuth2PasswordRequestForm 是一个 FastAPI 内置的类，专门用于处理 OAuth2 密码授权模式的登录请求。它会自动从请求的 form-data 中提取以下字段：
 
@@ -65,7 +77,10 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
 
 # client_secret (可选): 客户端密钥
     """用户登录"""
-    user = UserCRUD.authenticate_user(db, form_data.username, form_data.password)
+    try:
+        user = await AsyncUserCRUD.authenticate_user(db, form_data.username, form_data.password)
+    except PasswordHashBusy:
+        raise hash_busy_error()
     
     if user is None:
                 return JSONResponse(
@@ -98,7 +113,10 @@ async def change_password(
     db:Session=Depends(get_db)
 ):
     """修改密码"""
-    result = UserCRUD.change_password(db,current_user.id,old_password,new_password)
+    try:
+        result = await AsyncUserCRUD.change_password(db,current_user.id,old_password,new_password)
+    except PasswordHashBusy:
+        raise hash_busy_error()
     if "error" in result:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -0,0 +1,100 @@
+"""
+数据库访问并发压测：验证请求中的数据库操作不会阻塞事件循环
+
+用法：
+    python benchmarks/async_db_load.py            # 同步 Session + 线程池
+    USE_ASYNC_DB=1 python benchmarks/async_db_load.py   # AsyncSession（需要 aiosqlite）
+
+在临时目录中建库并写入一个有大量选票的会话，然后以不同的并发数请求结果接口，
+同时测量 /health 的延迟。数据库调用阻塞事件循环时，所有请求都会串行执行，
+/health 的延迟会随并发数一起上升；不阻塞时 /health 保持平稳，
+吞吐量则随并发数增长，直到数据库或 CPU 成为瓶颈。
+依赖 httpx（仅压测需要）。
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 数据库文件使用相对路径，先切换到临时目录再导入应用
+os.chdir(tempfile.mkdtemp(prefix="anime_voting_bench_"))
+
+import httpx
+
+from main import app
+from database import SessionLocal, VOTE_LEVELS
+from crud import VotingSessionCRUD, VoteCRUD
+
+VOTERS = int(os.getenv("BENCH_VOTERS", "2000"))
+ANIME = int(os.getenv("BENCH_ANIME", "50"))
+REQUESTS = int(os.getenv("BENCH_REQUESTS", "400"))
+CONCURRENCY = [1, 4, 16, 64]
+
+
+def seed():
+    """写入一个会话及其选票"""
+    db = SessionLocal()
+    try:
+        session = VotingSessionCRUD.create_session(db, title="bench", master_id=1)
+        VotingSessionCRUD.update_session_anime(db, session.id, add=range(1, ANIME + 1))
+        levels = list(VOTE_LEVELS)
+        for user_id in range(1, VOTERS + 1):
+            ballot = [
+                {"anime_id": anime_id, "vote_level": levels[(user_id + anime_id) % len(levels)]}
+                for anime_id in range(1, ANIME + 1)
+                if (user_id * anime_id) % 3
+            ]
+            VoteCRUD.cast_vote(db, session.id, user_id, ballot)
+        return session.id
+    finally:
+        db.close()
+
+
+async def run_level(client, session_id, concurrency):
+    """以给定并发数请求结果接口，返回 (吞吐量, /health 平均延迟毫秒)"""
+    queue = asyncio.Queue()
+    for _ in range(REQUESTS):
+        queue.put_nowait(None)
+    done = asyncio.Event()
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            response = await client.get(f"/api/voting/sessions/{session_id}/results")
+            assert response.status_code == 200, response.text
+
+    async def probe(latencies):
+        while not done.is_set():
+            start = time.perf_counter()
+            await client.get("/health")
+            latencies.append((time.perf_counter() - start) * 1000)
+            await asyncio.sleep(0.01)
+
+    latencies = []
+    probe_task = asyncio.create_task(probe(latencies))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await probe_task
+    return REQUESTS / elapsed, sum(latencies) / max(len(latencies), 1)
+
+
+async def main():
+    session_id = seed()
+    mode = "AsyncSession" if os.getenv("USE_ASYNC_DB", "0") == "1" else "Session + 线程池"
+    print(f"模式: {mode}，选票 {VOTERS} 张，动漫 {ANIME} 部，每档请求 {REQUESTS} 次")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        baseline = None
+        for concurrency in CONCURRENCY:
+            throughput, health_ms = await run_level(client, session_id, concurrency)
+            baseline = baseline or throughput
+            print(f"并发 {concurrency:>3}: {throughput:8.1f} req/s "
+                  f"(x{throughput / baseline:.2f})  /health 平均 {health_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""
+认证开销压测：对比启用令牌/用户缓存前后，每个请求在 get_current_user 上花费的时间和SQL数
+
+用法：
+    python benchmarks/auth_overhead.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="anime_voting_bench_"))
+
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy import event
+
+from database import SessionLocal, UserRegister, create_tables, engine
+from crud import UserCRUD
+from security import PasswordUtils
+import dependencies
+
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "5000"))
+
+queries = 0
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def count_query(*args):
+    global queries
+    queries += 1
+
+
+async def measure(label, credentials):
+    """模拟 ROUNDS 个请求：每个请求新建会话并解析当前用户"""
+    global queries
+    queries = 0
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        db = SessionLocal()
+        try:
+            await dependencies.get_current_user(credentials, db)
+        finally:
+            db.close()
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {elapsed / ROUNDS * 1e6:8.1f} µs/请求, {queries / ROUNDS:.2f} 条SQL/请求")
+
+
+async def main():
+    create_tables()
+    db = SessionLocal()
+    user = UserCRUD.register_user(db, UserRegister(username="bench", password="bench", role="user"))
+    db.close()
+    token = PasswordUtils.create_access_token({"sub": user.username, "user_id": user.id})
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    # maxsize=0 时缓存写入后立即被淘汰，相当于关闭缓存
+    token_size, user_size = dependencies.token_cache.maxsize, dependencies.user_cache.maxsize
+    dependencies.token_cache.maxsize = dependencies.user_cache.maxsize = 0
+    await measure("无缓存  ", credentials)
+
+    dependencies.token_cache.maxsize, dependencies.user_cache.maxsize = token_size, user_size
+    await measure("启用缓存", credentials)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,203 @@
+"""
+原始选票统计压测：对比逐条累加嵌套字典的旧算法与 stats_engine 的分块向量化累加
+
+用法：
+    python benchmarks/ballot_stats.py
+    BENCH_BALLOTS=3000000 BENCH_ANIME=2000 python benchmarks/ballot_stats.py
+    BENCH_DB=0 python benchmarks/ballot_stats.py     # 只测内存中的计算
+
+第一部分在内存中生成选票，两种算法分别计算并核对结果一致；
+第二部分把选票写入临时 SQLite，比较 VoteCRUD.calculate_session_stats_from_ballots（流式读取）
+与一次性载入全部 Vote 对象再逐条累加的耗时和峰值内存（各自在独立子进程中运行）。
+"""
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 子进程通过环境变量沿用同一个临时目录
+WORKDIR = os.environ.setdefault("BENCH_WORKDIR", tempfile.mkdtemp(prefix="anime_voting_bench_"))
+os.chdir(WORKDIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{WORKDIR}/bench.db"
+
+from sqlalchemy import insert
+
+from database import SessionLocal, User, Vote, VotingSession, VOTE_LEVELS, create_tables
+from crud import VoteCRUD
+from stats_engine import STATS_CHUNK_SIZE, StatsAccumulator
+
+BALLOTS = int(os.getenv("BENCH_BALLOTS", "1000000"))
+ANIME = int(os.getenv("BENCH_ANIME", "500"))
+MAX_PICKS = int(os.getenv("BENCH_MAX_PICKS", "3"))
+RUN_DB = os.getenv("BENCH_DB", "1") == "1"
+
+
+def generate(rng):
+    """生成选票：动漫热度和等级都是偏斜的"""
+    anime = list(range(1, ANIME + 1))
+    popularity = [1 / rank for rank in range(1, ANIME + 1)]
+    levels = list(VOTE_LEVELS)
+    level_weights = [5, 10, 25, 30, 20, 10]
+    return [
+        [
+            {"anime_id": anime_id, "vote_level": level}
+            for anime_id, level in zip(
+                set(rng.choices(anime, popularity, k=rng.randint(1, MAX_PICKS))),
+                rng.choices(levels, level_weights, k=MAX_PICKS)
+            )
+        ]
+        for _ in range(BALLOTS)
+    ]
+
+
+def baseline_stats(ballots):
+    """改造前 calculate_session_stats 的算法：逐条选票、逐个动漫累加嵌套字典"""
+    stats = {
+        "total_voters": len(ballots),
+        "anime_stats": {},
+        "overall_stats": {
+            "total_votes": 0,
+            "average_score": 0,
+            "vote_distribution": {level: 0 for level in VOTE_LEVELS}
+        }
+    }
+    for voted_anime in ballots:
+        for anime_vote in voted_anime:
+            bangumi_id = anime_vote["anime_id"]
+            vote_level = anime_vote["vote_level"]
+            score = VOTE_LEVELS[vote_level]["score"]
+            if bangumi_id not in stats["anime_stats"]:
+                stats["anime_stats"][bangumi_id] = {
+                    "total_votes": 0,
+                    "total_score": 0,
+                    "vote_distribution": {level: 0 for level in VOTE_LEVELS},
+                    "average_score": 0
+                }
+            stats["anime_stats"][bangumi_id]["total_votes"] += 1
+            stats["anime_stats"][bangumi_id]["total_score"] += score
+            stats["anime_stats"][bangumi_id]["vote_distribution"][vote_level] += 1
+            stats["overall_stats"]["total_votes"] += 1
+            stats["overall_stats"]["vote_distribution"][vote_level] += 1
+    for anime_stat in stats["anime_stats"].values():
+        if anime_stat["total_votes"] > 0:
+            anime_stat["average_score"] = round(anime_stat["total_score"] / anime_stat["total_votes"], 2)
+    return stats
+
+
+def engine_stats(ballots, detailed=False):
+    accumulator = StatsAccumulator()
+    for start in range(0, len(ballots), STATS_CHUNK_SIZE):
+        accumulator.add_ballots(ballots[start:start + STATS_CHUNK_SIZE])
+    return accumulator.stats(detailed=detailed)
+
+
+def check(expected, actual):
+    """核对两种算法的计数、总分、平均分和分布"""
+    assert expected["total_voters"] == actual["total_voters"]
+    assert expected["overall_stats"]["vote_distribution"] == actual["overall_stats"]["vote_distribution"]
+    assert expected["anime_stats"].keys() == actual["anime_stats"].keys()
+    for anime_id, stat in expected["anime_stats"].items():
+        assert stat == {key: actual["anime_stats"][anime_id][key] for key in stat}, anime_id
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def write_ballots(ballots):
+    """直接写入 __votes__（不经过计数表），一个会话、每张选票一个用户"""
+    create_tables()
+    db = SessionLocal()
+    try:
+        db.execute(insert(User), [{"username": f"u{i}", "password_hash": "-", "role": "user"}
+                                  for i in range(1, len(ballots) + 1)])
+        session = VotingSession(title="bench", master_id=1)
+        db.add(session)
+        db.commit()
+        for start in range(0, len(ballots), 50000):
+            db.execute(insert(Vote), [
+                {"session_id": session.id, "user_id": start + i + 1, "voted_anime": voted_anime}
+                for i, voted_anime in enumerate(ballots[start:start + 50000])
+            ])
+        db.commit()
+        return session.id
+    finally:
+        db.close()
+
+
+def peak_memory_kb():
+    """
+    本进程的峰值常驻内存。Linux 上读取 VmHWM：exec 后重新计数；
+    ru_maxrss 会继承 fork 出子进程时父进程的峰值（父进程持有全部内存中的选票）
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_streaming(session_id):
+    db = SessionLocal()
+    try:
+        stats, elapsed = timed(VoteCRUD.calculate_session_stats_from_ballots, db, session_id)
+    finally:
+        db.close()
+    return elapsed, peak_memory_kb(), stats["total_voters"]
+
+
+def run_orm(session_id):
+    def load_and_count(db):
+        # 改造前的做法：一次性载入全部 Vote 对象
+        return baseline_stats([vote.voted_anime for vote in db.query(Vote).filter(Vote.session_id == session_id).all()])
+
+    db = SessionLocal()
+    try:
+        stats, elapsed = timed(load_and_count, db)
+    finally:
+        db.close()
+    return elapsed, peak_memory_kb(), stats["total_voters"]
+
+
+def in_subprocess(fn, *args):
+    """在新进程中运行，峰值内存互不影响"""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def main():
+    rng = random.Random(42)
+    ballots, elapsed = timed(generate, rng)
+    items = sum(map(len, ballots))
+    print(f"选票 {BALLOTS}（{items} 条明细，{ANIME} 个动漫），生成耗时 {elapsed:.1f}s，块大小 {STATS_CHUNK_SIZE}")
+
+    expected, baseline_time = timed(baseline_stats, ballots)
+    actual, engine_time = timed(engine_stats, ballots)
+    check(expected, actual)
+    _, detailed_time = timed(engine_stats, ballots, detailed=True)
+    print("\n[内存中计算] 结果一致")
+    print(f"  旧算法（嵌套字典逐条累加）   {baseline_time:6.2f}s")
+    print(f"  stats_engine                  {engine_time:6.2f}s  ({baseline_time / engine_time:.1f}x)")
+    print(f"  stats_engine + 中位数/标准差/百分位 {detailed_time:6.2f}s")
+
+    if RUN_DB:
+        session_id, elapsed = timed(write_ballots, ballots)
+        del ballots, expected, actual
+        print(f"\n[从数据库计算] 写入 {BALLOTS} 张选票耗时 {elapsed:.1f}s")
+        for name, fn in (("流式读取 + stats_engine", run_streaming), ("载入全部 Vote 对象 + 旧算法", run_orm)):
+            elapsed, peak_kb, voters = in_subprocess(fn, session_id)
+            assert voters == BALLOTS
+            print(f"  {name:<28}{elapsed:6.2f}s  峰值内存 {peak_kb / 1024:6.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+选票校验压测：1000 项的选票，对比改造前的 Python 逐项检查与 pydantic-core 中的类型化校验，
+以及会话成员检查使用缓存的 frozenset 与每次查询 __session_anime__ 的耗时
+最后检查非法选票都被拒绝，且批量导入中格式错误的行只让这一行失败，不合法时以非零状态退出
+
+用法：
+    python benchmarks/ballot_validation.py
+    BENCH_ITEMS=5000 BENCH_ROUNDS=500 python benchmarks/ballot_validation.py
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+WORKDIR = tempfile.mkdtemp(prefix="anime_voting_bench_")
+os.chdir(WORKDIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{WORKDIR}/bench.db"
+
+from pydantic import BaseModel, ValidationError
+
+from database import BulkVotes, CastVote, SessionLocal, User, VOTE_LEVELS, create_tables
+from crud import VoteCRUD, VotingSessionCRUD, session_anime_cache
+
+ITEMS = int(os.getenv("BENCH_ITEMS", "1000"))
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "2000"))
+
+
+class UntypedCastVote(BaseModel):
+    """改造前的请求模型"""
+    session_id: int
+    voted_anime: list
+
+
+def baseline_validate(session, voted_anime):
+    """改造前 VoteCRUD._validate_ballot 的逐项检查（不检查重复和会话成员）"""
+    if not isinstance(voted_anime, list):
+        return "投票数据格式错误"
+    if not session.allow_multiple_votes and len(voted_anime) > 1:
+        return "此会话不允许多选"
+    if len(voted_anime) > session.max_votes_per_user:
+        return f"最多只能投{session.max_votes_per_user}票"
+    for vote in voted_anime:
+        if not isinstance(vote, dict) or "anime_id" not in vote or "vote_level" not in vote:
+            return "投票数据格式错误"
+        if vote["vote_level"] not in VOTE_LEVELS:
+            return "无效的投票等级"
+        try:
+            int(vote["anime_id"])
+        except (TypeError, ValueError):
+            return "投票数据格式错误"
+    return None
+
+
+def handwritten_validate(session, voted_anime, allowed):
+    """同样的检查（格式、等级、重复、会话成员）用 Python 逐项实现"""
+    error = baseline_validate(session, voted_anime)
+    if error:
+        return error
+    seen = set()
+    for vote in voted_anime:
+        anime_id = vote["anime_id"]
+        if type(anime_id) is not int:
+            return "投票数据格式错误"
+        if anime_id in seen:
+            return "同一张选票中重复的动漫"
+        if anime_id not in allowed:
+            return f"动漫 {anime_id} 不在此会话中"
+        seen.add(anime_id)
+    return None
+
+
+def timed(label, fn, rounds=ROUNDS):
+    """执行 rounds 次，打印每次的平均耗时"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    elapsed = (time.perf_counter() - start) / rounds * 1e6
+    print(f"  {label:<44} {elapsed:9.1f} µs")
+    return elapsed
+
+
+def main():
+    rng = random.Random(0)
+    create_tables()
+    db = SessionLocal()
+    db.add(User(username="bench", password_hash="-", role="admin"))
+    db.commit()
+    session = VotingSessionCRUD.create_session(db, title="bench", master_id=1, max_votes_per_user=ITEMS)
+    anime = rng.sample(range(1, ITEMS * 10), ITEMS)
+    VotingSessionCRUD.update_session_anime(db, session.id, add=anime)
+
+    payload = {
+        "session_id": session.id,
+        "voted_anime": [{"anime_id": anime_id, "vote_level": rng.choice(list(VOTE_LEVELS))} for anime_id in anime]
+    }
+    body = json.dumps(payload)
+    print(f"{ITEMS} 项的选票，{ROUNDS} 次取平均")
+
+    # FastAPI 先把请求体解析为 dict，再以 Python 模式校验
+    old = timed("改造前：list + Python 逐项检查（不含重复与成员）",
+                lambda: baseline_validate(session, UntypedCastVote.model_validate(payload).voted_anime))
+    allowed = VotingSessionCRUD.get_allowed_anime(db, session.id)
+    timed("Python 逐项实现同样的检查",
+          lambda: handwritten_validate(session, UntypedCastVote.model_validate(payload).voted_anime, allowed))
+    new = timed("类型化校验 + 成员检查（缓存命中）",
+                lambda: VoteCRUD._validate_ballot(session, CastVote.model_validate(payload).voted_anime, allowed))
+    timed("其中：CastVote.model_validate（含重复检查）", lambda: CastVote.model_validate(payload))
+    timed("其中：CastVote.model_validate_json", lambda: CastVote.model_validate_json(body))
+
+    def uncached():
+        session_anime_cache.pop(session.id)
+        VotingSessionCRUD.get_allowed_anime(db, session.id)
+    timed("成员集合未命中缓存（查询 __session_anime__）", uncached, rounds=max(1, ROUNDS // 10))
+    print(f"  类型化校验相对改造前：{new / old:.2f} 倍")
+
+    # 非法选票应在 pydantic 中被拒绝，或在成员检查中返回错误
+    for label, items in [
+        ("anime_id 为字符串", [{"anime_id": str(anime[0]), "vote_level": "good"}]),
+        ("无效等级", [{"anime_id": anime[0], "vote_level": "meh"}]),
+        ("重复动漫", [{"anime_id": anime[0], "vote_level": "good"}, {"anime_id": anime[0], "vote_level": "bad"}]),
+    ]:
+        try:
+            CastVote.model_validate({"session_id": session.id, "voted_anime": items})
+            raise AssertionError(f"未拒绝：{label}")
+        except ValidationError:
+            pass
+    outsider = CastVote.model_validate({"session_id": session.id, "voted_anime": [{"anime_id": 0, "vote_level": "good"}]})
+    assert VoteCRUD._validate_ballot(session, outsider.voted_anime, allowed) is not None
+    print("✅ 非法选票均被拒绝")
+
+    # 批量导入：缺少字段的行与请求体一样经过 BulkVotes，只让这一行失败，其他行照常写入
+    db.add_all([User(username=f"bulk{i}", password_hash="-", role="user") for i in range(2)])
+    db.commit()
+    good = [{"anime_id": anime[0], "vote_level": "good"}]
+    request = BulkVotes.model_validate({"ballots": [
+        {"user_id": 2, "voted_anime": good},
+        {"voted_anime": good},
+        {"user_id": 3},
+        {},
+    ]})
+    rows = [ballot.model_dump() for ballot in request.ballots]
+    # 直接调用 CRUD 时缺少 user_id 的 dict 和不是对象的行
+    rows += [{"voted_anime": good}, "not a ballot", {"user_id": 3, "voted_anime": good}]
+    result = VoteCRUD.bulk_cast_votes(db, session.id, rows)
+    statuses = [row["status"] for row in result["results"]]
+    assert statuses == ["created", "error", "error", "error", "error", "error", "created"], result
+    assert VoteCRUD.count_session_votes(db, session.id) == 2, result
+    print("✅ 批量导入中格式错误的行只让这一行失败")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+本地模拟的 Bangumi API：压测时把 BANGUMI_API 指向这里，避免请求真实服务
+
+用法：
+    python benchmarks/bangumi_stub.py            # 监听 127.0.0.1:8901
+    BANGUMI_API=http://127.0.0.1:8901/v0 uvicorn main:app
+
+响应格式与搜索接口 POST /v0/search/subjects、条目接口 GET /v0/subjects/{id} 一致，
+每个请求固定延迟 BENCH_STUB_LATENCY_MS 毫秒，模拟真实网络往返。
+"""
+import asyncio
+import os
+import threading
+import zlib
+
+from aiohttp import web
+
+STUB_HOST = os.getenv("BENCH_STUB_HOST", "127.0.0.1")
+STUB_PORT = int(os.getenv("BENCH_STUB_PORT", "8901"))
+STUB_LATENCY_MS = float(os.getenv("BENCH_STUB_LATENCY_MS", "50"))
+
+
+def _subject(bangumi_id: int):
+    return {
+        "id": bangumi_id,
+        "type": 2,
+        "name": f"Anime {bangumi_id}",
+        "name_cn": f"动画 {bangumi_id}",
+        "images": {"large": f"https://lain.bgm.tv/pic/cover/l/{bangumi_id}.jpg"},
+        "rating": {"score": round(5 + bangumi_id % 50 / 10, 1)},
+        "score": round(5 + bangumi_id % 50 / 10, 1)
+    }
+
+
+async def search_subjects(request):
+    await asyncio.sleep(STUB_LATENCY_MS / 1000)
+    payload = await request.json()
+    # 同一个关键词总是返回同样的结果
+    base = zlib.crc32(payload.get("keyword", "").encode()) % 100000
+    limit = int(payload.get("limit", 10))
+    return web.json_response({"data": [_subject(base + i) for i in range(limit)], "total": limit})
+
+
+async def get_subject(request):
+    await asyncio.sleep(STUB_LATENCY_MS / 1000)
+    return web.json_response(_subject(int(request.match_info["bangumi_id"])))
+
+
+def make_app():
+    app = web.Application()
+    app.router.add_post("/v0/search/subjects", search_subjects)
+    app.router.add_get("/v0/subjects/{bangumi_id}", get_subject)
+    return app
+
+
+def start_in_thread(host: str = STUB_HOST, port: int = STUB_PORT) -> str:
+    """在后台线程中启动模拟服务，返回可以直接赋给 BANGUMI_API 的地址"""
+    started = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(make_app(), access_log=None)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, host, port).start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return f"http://{host}:{port}/v0"
+
+
+if __name__ == "__main__":
+    web.run_app(make_app(), host=STUB_HOST, port=STUB_PORT, access_log=None)
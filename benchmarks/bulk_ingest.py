@@ -0,0 +1,69 @@
+"""
+批量导入选票压测：VoteCRUD.bulk_cast_votes 在 SQLite 上每秒可写入的选票数
+
+用法：
+    python benchmarks/bulk_ingest.py
+    BENCH_BALLOTS=100000 BENCH_ANIME_PER_BALLOT=5 python benchmarks/bulk_ingest.py
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="anime_voting_bench_"))
+
+from sqlalchemy import insert
+
+from database import SessionLocal, User, VOTE_LEVELS, create_tables
+from crud import VotingSessionCRUD, VoteCRUD
+
+BALLOTS = int(os.getenv("BENCH_BALLOTS", "50000"))
+ANIME = int(os.getenv("BENCH_ANIME", "60"))
+PER_BALLOT = int(os.getenv("BENCH_ANIME_PER_BALLOT", "5"))
+
+
+def main():
+    create_tables()
+    db = SessionLocal()
+    try:
+        db.execute(insert(User), [
+            {"username": f"user{i}", "password_hash": "-", "role": "user"}
+            for i in range(1, BALLOTS + 1)
+        ])
+        db.commit()
+        session = VotingSessionCRUD.create_session(db, title="bench", master_id=1)
+        VotingSessionCRUD.update_session_anime(db, session.id, add=range(1, ANIME + 1))
+
+        rng = random.Random(42)
+        levels = list(VOTE_LEVELS)
+
+        def make_ballots():
+            return [
+                {
+                    "user_id": user_id,
+                    "voted_anime": [
+                        {"anime_id": anime_id, "vote_level": rng.choice(levels)}
+                        for anime_id in rng.sample(range(1, ANIME + 1), PER_BALLOT)
+                    ]
+                }
+                for user_id in range(1, BALLOTS + 1)
+            ]
+
+        for label in ("首次导入", "重复导入（全部改票）"):
+            ballots = make_ballots()
+            start = time.perf_counter()
+            result = VoteCRUD.bulk_cast_votes(db, session.id, ballots)
+            elapsed = time.perf_counter() - start
+            print(f"{label}: {BALLOTS} 张选票 {elapsed:.2f}s, {BALLOTS / elapsed:,.0f} 张/秒 "
+                  f"(新增 {result['created']}, 更新 {result['updated']}, 失败 {result['failed']})")
+
+        check = VoteCRUD.rebuild_vote_tallies(db, session.id, verify_only=True)
+        print(f"计数表校验：不一致条目 {len(check['mismatches'])} 个")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
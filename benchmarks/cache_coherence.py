@@ -0,0 +1,182 @@
+"""
+跨进程缓存一致性测试：多个"worker"进程各自缓存用户和会话可投的动漫，
+主进程不断修改它们，测量每个 worker 从写入到丢弃旧条目、重新读到新值的时间
+
+用法：
+    python benchmarks/cache_coherence.py
+    BENCH_WORKERS=8 BENCH_ROUNDS=100 INVALIDATION_POLL_MS=100 python benchmarks/cache_coherence.py
+
+第一轮各 worker 运行失效总线，所有 worker 的旧数据时长都必须不超过
+INVALIDATION_POLL_MS + BENCH_SLACK_MS，且重新读到的必须是新值，否则以非零状态退出；
+第二轮（对照）不启动失效总线，旧条目只能等 TTL 过期。
+"""
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 子进程通过环境变量沿用同一个临时目录
+WORKDIR = os.environ.setdefault("BENCH_WORKDIR", tempfile.mkdtemp(prefix="anime_voting_bench_"))
+os.chdir(WORKDIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{WORKDIR}/bench.db"
+
+WORKERS = int(os.getenv("BENCH_WORKERS", "4"))
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "40"))
+CONTROL_ROUNDS = int(os.getenv("BENCH_CONTROL_ROUNDS", "3"))
+SLACK_MS = float(os.getenv("BENCH_SLACK_MS", "100"))
+# 检查缓存条目是否还在的间隔（秒）
+CHECK_INTERVAL = 0.002
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+
+def seed():
+    from crud import VotingSessionCRUD
+    from database import SessionLocal, User, VotingSession, create_tables
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        user = User(username="watched", password_hash="-", role="user")
+        db.add(user)
+        db.commit()
+        session = VotingSession(title="bench", master_id=user.id)
+        db.add(session)
+        db.commit()
+        VotingSessionCRUD.update_session_anime(db, session.id, add=[1])
+        return user.id, session.id
+    finally:
+        db.close()
+
+
+def worker(worker_id, user_id, session_id, use_bus, ready, reports, stop):
+    """缓存两个条目，发现被清除后立即重新读取，把 (种类, 读到的值, 时间) 报告给主进程"""
+    from crud import UserCRUD, VotingSessionCRUD, session_anime_cache
+    from database import SessionLocal
+    from dependencies import user_cache
+    from invalidation import invalidation_bus
+
+    def load(kind):
+        db = SessionLocal()
+        try:
+            if kind == "user":
+                user = UserCRUD.get_user_by_id(db, user_id)
+                user_cache.set(user_id, UserCRUD.to_cache(user))
+                return user.role
+            return len(VotingSessionCRUD.get_allowed_anime(db, session_id))
+        finally:
+            db.close()
+
+    def cached(kind):
+        if kind == "user":
+            return user_cache.get(user_id) is not None
+        return session_anime_cache.get(session_id) is not None
+
+    async def watch():
+        if use_bus:
+            invalidation_bus.start()
+        for kind in ("user", "session_anime"):
+            load(kind)
+        ready.put(worker_id)
+        while not stop.is_set():
+            for kind in ("user", "session_anime"):
+                if not cached(kind):
+                    seen_at = time.time()
+                    reports.put((worker_id, kind, load(kind), seen_at))
+            await asyncio.sleep(CHECK_INTERVAL)
+        invalidation_bus.stop()
+
+    asyncio.run(watch())
+
+
+def write(kind, round_no, user_id, session_id):
+    """在主进程中修改用户角色或会话动漫，返回 worker 应读到的新值"""
+    from crud import UserCRUD, VotingSessionCRUD
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        if kind == "user":
+            role = "guest" if round_no % 2 else "user"
+            UserCRUD.update_user_role(db, UserCRUD.get_user_by_id(db, user_id), role)
+            return role
+        result = VotingSessionCRUD.update_session_anime(db, session_id, add=[round_no + 2])
+        return result["anime_count"]
+    finally:
+        db.close()
+
+
+def run(use_bus, rounds, timeout, user_id, session_id, first_round):
+    context = multiprocessing.get_context("spawn")
+    ready, reports, stop = context.Queue(), context.Queue(), context.Event()
+    processes = [
+        context.Process(target=worker, args=(i, user_id, session_id, use_bus, ready, reports, stop))
+        for i in range(WORKERS)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get(timeout=60)
+
+    rng = random.Random(first_round)
+    lags, stale, wrong = [], 0, 0
+    for round_no in range(first_round, first_round + rounds):
+        # 随机错开写入与各 worker 轮询的相位
+        time.sleep(rng.uniform(0, 0.3))
+        kind = rng.choice(("user", "session_anime"))
+        # 从开始写入算起（而不是提交之后），测得的旧数据时长只会偏大
+        written_at = time.time()
+        expected = write(kind, round_no, user_id, session_id)
+        pending = set(range(WORKERS))
+        deadline = time.monotonic() + timeout
+        while pending and time.monotonic() < deadline:
+            try:
+                worker_id, seen_kind, value, seen_at = reports.get(timeout=max(0.0, deadline - time.monotonic()))
+            except Exception:
+                break
+            if seen_kind != kind:
+                continue
+            pending.discard(worker_id)
+            lags.append((seen_at - written_at) * 1000)
+            wrong += value != expected
+        stale += len(pending)
+
+    stop.set()
+    for process in processes:
+        process.join(timeout=10)
+    return lags, stale, wrong
+
+
+def main():
+    from invalidation import INVALIDATION_POLL_MS
+
+    user_id, session_id = seed()
+    bound = INVALIDATION_POLL_MS + SLACK_MS
+    print(f"{WORKERS} 个 worker 进程，失效总线轮询间隔 {INVALIDATION_POLL_MS} ms，允许的旧数据时长 {bound:.0f} ms")
+
+    lags, stale, wrong = run(True, ROUNDS, timeout=5, user_id=user_id, session_id=session_id, first_round=0)
+    print(f"\n失效总线：{ROUNDS} 次写入 × {WORKERS} 个 worker")
+    if lags:
+        print(f"  旧数据时长 p50 {percentile(lags, 50):.0f} ms / p99 {percentile(lags, 99):.0f} ms / 最大 {max(lags):.0f} ms")
+    print(f"  超时未失效 {stale} 次，重新读到旧值 {wrong} 次")
+
+    control_lags, control_stale, _ = run(False, CONTROL_ROUNDS, timeout=1, user_id=user_id,
+                                         session_id=session_id, first_round=ROUNDS)
+    print(f"\n对照（不启动失效总线）：{CONTROL_ROUNDS} 次写入 × {WORKERS} 个 worker")
+    print(f"  1 秒内失效 {len(control_lags)} 次，仍在使用旧条目 {control_stale} 次")
+
+    if stale or wrong or not lags or max(lags) > bound:
+        print(f"\n失败：旧数据时长超过 {bound:.0f} ms 或读到旧值")
+        sys.exit(1)
+    print("\n通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+条件请求压测：公开读接口带 If-None-Match 时返回 304 与完整响应的耗时对比，并检查条件请求的语义
+
+用法：
+    python benchmarks/conditional_get.py
+    BENCH_BALLOTS=50000 BENCH_REPEAT=500 python benchmarks/conditional_get.py
+
+进程内通过 TestClient 请求投票结果接口。检查项：ETag 命中返回 304、投票后旧 ETag 不再命中、
+If-None-Match: * 只对存在的资源返回 304（不存在的会话仍是 404，不公开的会话仍是 403），不满足时以非零状态退出。
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+WORKDIR = tempfile.mkdtemp(prefix="anime_voting_bench_")
+os.chdir(WORKDIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{WORKDIR}/bench.db"
+os.environ.setdefault("SQL_SLOW_QUERY_MS", "0")
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+from database import SessionLocal, User, VOTE_LEVELS
+from crud import VoteCRUD, VotingSessionCRUD
+from main import app
+
+ANIME = int(os.getenv("BENCH_ANIME", "200"))
+BALLOTS = int(os.getenv("BENCH_BALLOTS", "10000"))
+REPEAT = int(os.getenv("BENCH_REPEAT", "200"))
+
+
+def seed():
+    """一个公开会话（有选票）和一个不公开的会话，返回两者的 ID"""
+    rng = random.Random(0)
+    db = SessionLocal()
+    try:
+        db.execute(insert(User), [{"username": f"u{i}", "password_hash": "-", "role": "user"}
+                                  for i in range(1, BALLOTS + 1)])
+        db.commit()
+        public = VotingSessionCRUD.create_session(db, title="public", master_id=1).id
+        private = VotingSessionCRUD.create_session(db, title="private", master_id=1, is_public=False).id
+        VotingSessionCRUD.update_session_anime(db, public, add=range(1, ANIME + 1))
+        levels = list(VOTE_LEVELS)
+        VoteCRUD.bulk_cast_votes(db, public, [
+            {"user_id": user_id, "voted_anime": [
+                {"anime_id": anime_id, "vote_level": rng.choice(levels)}
+                for anime_id in rng.sample(range(1, ANIME + 1), 5)
+            ]}
+            for user_id in range(1, BALLOTS + 1)
+        ])
+        return public, private
+    finally:
+        db.close()
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn()
+    elapsed = (time.perf_counter() - start) / REPEAT * 1000
+    print(f"  {label:<24} {elapsed:7.2f} ms")
+
+
+def main():
+    with TestClient(app) as client:
+        public, private = seed()
+        results = f"/api/voting/sessions/{public}/results"
+        response = client.get(results)
+        etag = response.headers["ETag"]
+        print(f"投票结果：{ANIME} 个动漫、{BALLOTS} 张选票，响应 {len(response.content)} 字节，{REPEAT} 次取平均")
+        timed("完整响应（缓存的响应体）", lambda: client.get(results))
+        timed("If-None-Match 命中 304", lambda: client.get(results, headers={"If-None-Match": etag}))
+
+        failures = []
+
+        def expect(label, url, status, headers=None):
+            actual = client.get(url, headers=headers or {}).status_code
+            if actual != status:
+                failures.append(f"{label}：期望 {status}，实际 {actual}")
+
+        expect("ETag 命中", results, 304, {"If-None-Match": etag})
+        expect("弱比较 W/ 前缀", results, 304, {"If-None-Match": f"W/{etag}"})
+        expect("If-None-Match: * 存在的会话", results, 304, {"If-None-Match": "*"})
+        expect("If-None-Match: * 存在的会话详情", f"/api/voting/sessions/{public}", 304, {"If-None-Match": "*"})
+        missing = private + 1000
+        expect("If-None-Match: * 不存在的会话结果", f"/api/voting/sessions/{missing}/results", 404,
+               {"If-None-Match": "*"})
+        expect("If-None-Match: * 不存在的会话详情", f"/api/voting/sessions/{missing}", 404, {"If-None-Match": "*"})
+        expect("If-None-Match: * 不公开的会话详情", f"/api/voting/sessions/{private}", 403, {"If-None-Match": "*"})
+        expect("If-None-Match: * 没有排名的动漫", f"/api/voting/leaderboard/{ANIME + 1000}", 404,
+               {"If-None-Match": "*"})
+
+        db = SessionLocal()
+        try:
+            VoteCRUD.cast_vote(db, public, 1, [{"anime_id": 1, "vote_level": "god"}])
+        finally:
+            db.close()
+        expect("投票后旧 ETag", results, 200, {"If-None-Match": etag})
+
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print("✅ 条件请求语义正确")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+压测数据生成：按配置批量写入用户、会话和选票，票数分布是偏斜的（少数会话、少数动漫拿到大部分选票）
+
+用法（写入 DATABASE_URL 指向的数据库）：
+    python benchmarks/datagen.py
+    BENCH_USERS=50000 BENCH_SESSIONS=500 BENCH_BALLOTS=1000000 python benchmarks/datagen.py
+
+所有用户的密码都是 BENCH_PASSWORD（只计算一次哈希，所有用户共用）。
+"""
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, select
+
+from database import SessionLocal, SessionAnime, User, VotingSession, create_tables
+from crud import VoteCRUD
+from security import PasswordUtils
+
+USERS = int(os.getenv("BENCH_USERS", "2000"))
+SESSIONS = int(os.getenv("BENCH_SESSIONS", "50"))
+ANIME_PER_SESSION = int(os.getenv("BENCH_ANIME_PER_SESSION", "24"))
+BALLOTS = int(os.getenv("BENCH_BALLOTS", "20000"))
+MAX_PICKS = int(os.getenv("BENCH_MAX_PICKS", "5"))
+# Zipf 分布的指数，越大越集中在头部
+ZIPF = float(os.getenv("BENCH_ZIPF", "1.1"))
+PASSWORD = os.getenv("BENCH_PASSWORD", "bench-password")
+SEED = int(os.getenv("BENCH_SEED", "42"))
+
+# 基础的等级分布：中间等级最多，两端较少
+LEVEL_WEIGHTS = {"bad": 5, "poor": 10, "justsoso": 25, "good": 30, "great": 20, "god": 10}
+
+
+def zipf_weights(n: int, exponent: float = ZIPF):
+    """第 k 名的权重为 1 / k^exponent"""
+    return [1 / (rank ** exponent) for rank in range(1, n + 1)]
+
+
+def level_weights(quality: float):
+    """按动漫的"质量"（-1 到 1）把等级分布整体往好评或差评方向偏移"""
+    levels = list(LEVEL_WEIGHTS)
+    middle = (len(levels) - 1) / 2
+    return levels, [
+        LEVEL_WEIGHTS[level] * math.exp(quality * (index - middle) / 2)
+        for index, level in enumerate(levels)
+    ]
+
+
+def seed(users: int = USERS, sessions: int = SESSIONS, anime_per_session: int = ANIME_PER_SESSION,
+         ballots: int = BALLOTS, seed_value: int = SEED):
+    """
+    写入数据集，返回 {"users": 用户数, "sessions": {会话ID: 动漫ID列表}, "public_sessions": [...], "ballots": 写入的选票数}
+    用户和会话直接批量插入；选票走 VoteCRUD.bulk_cast_votes，计数表、明细表和排行榜同时生成
+    """
+    create_tables()
+    rng = random.Random(seed_value)
+    password_hash = PasswordUtils.hash_password(PASSWORD)
+    db = SessionLocal()
+    try:
+        first_user = (db.execute(select(User.id).order_by(User.id.desc()).limit(1)).scalar() or 0) + 1
+        db.execute(insert(User), [
+            {"username": f"bench{first_user + i}", "password_hash": password_hash, "role": "user"}
+            for i in range(users)
+        ])
+        user_ids = list(range(first_user, first_user + users))
+
+        # 动漫池是会话数的若干倍，不同会话之间部分重叠（全站排行榜才有意义）
+        anime_pool = list(range(1, max(anime_per_session * 4, sessions * anime_per_session // 3) + 1))
+        quality = {anime_id: rng.uniform(-1, 1) for anime_id in anime_pool}
+        anime_count = min(anime_per_session, len(anime_pool))
+        db.execute(insert(VotingSession), [
+            {
+                "title": f"bench session {n}",
+                "description": "generated by benchmarks/datagen.py",
+                "master_id": rng.choice(user_ids),
+                "is_public": rng.random() < 0.8,
+                "allow_multiple_votes": True,
+                "max_votes_per_user": MAX_PICKS,
+                "anime_count": anime_count
+            }
+            for n in range(sessions)
+        ])
+        rows = db.execute(
+            select(VotingSession.id, VotingSession.is_public)
+            .order_by(VotingSession.id.desc()).limit(sessions)
+        ).all()
+        session_anime = {session_id: rng.sample(anime_pool, anime_count) for session_id, _ in rows}
+        public_sessions = [session_id for session_id, is_public in rows if is_public]
+        db.execute(insert(SessionAnime), [
+            {"session_id": session_id, "bangumi_id": bangumi_id, "position": position}
+            for session_id, anime_list in session_anime.items()
+            for position, bangumi_id in enumerate(anime_list, 1)
+        ])
+        db.commit()
+
+        # 每个会话的参与人数服从 Zipf 分布，同一会话中每人最多一张选票
+        session_ids = list(session_anime)
+        weights = zipf_weights(len(session_ids))
+        total = sum(weights)
+        written = 0
+        for session_id, weight in zip(session_ids, weights):
+            voters = rng.sample(user_ids, min(len(user_ids), round(ballots * weight / total)))
+            anime_list = session_anime[session_id]
+            popularity = zipf_weights(len(anime_list))
+            batch = []
+            for user_id in voters:
+                picks = set()
+                for _ in range(rng.randint(1, MAX_PICKS)):
+                    picks.add(rng.choices(anime_list, popularity)[0])
+                batch.append({
+                    "user_id": user_id,
+                    "voted_anime": [
+                        {"anime_id": anime_id, "vote_level": rng.choices(*level_weights(quality[anime_id]))[0]}
+                        for anime_id in picks
+                    ]
+                })
+            if batch:
+                written += VoteCRUD.bulk_cast_votes(db, session_id, batch)["created"]
+        return {
+            "users": users,
+            "user_ids": user_ids,
+            "sessions": session_anime,
+            "public_sessions": public_sessions,
+            "ballots": written
+        }
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    dataset = seed()
+    print(f"用户 {dataset['users']}，会话 {len(dataset['sessions'])}（公开 {len(dataset['public_sessions'])}），"
+          f"选票 {dataset['ballots']}，耗时 {time.perf_counter() - start:.1f}s")
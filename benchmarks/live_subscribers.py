@@ -0,0 +1,173 @@
+"""
+实时结果推送压测：启动真实的 uvicorn 进程，通过 HTTP 挂上大量 SSE 订阅者，持续投票，
+观察推送、慢消费者处理，以及订阅连接是否占用数据库连接池
+
+用法：
+    python benchmarks/live_subscribers.py
+    BENCH_SUBSCRIBERS=3000 BENCH_SECONDS=10 LIVE_TICK_MS=200 python benchmarks/live_subscribers.py
+
+订阅者通过 GET /api/voting/sessions/{id}/live 订阅，其中 BENCH_SLOW_RATIO 比例的订阅者每 2 秒才读一次，
+用来验证慢消费者会被降级为只接收最新快照，而不会拖慢其他订阅者或让内存无限增长。
+订阅期间同时有访客读取公开会话列表：订阅者数远超连接池大小（DB_POOL_SIZE + DB_MAX_OVERFLOW），
+只要有订阅连接一直占着数据库连接，这些请求就会等到连接池超时后失败，此时以非零状态退出。
+"""
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+WORKDIR = tempfile.mkdtemp(prefix="anime_voting_bench_")
+os.chdir(WORKDIR)
+# uvicorn 子进程与本进程使用同一个数据库文件
+os.environ["DATABASE_URL"] = f"sqlite:///{WORKDIR}/bench.db"
+
+from sqlalchemy import insert
+
+from database import SessionLocal, User, VOTE_LEVELS, create_tables, run_db_task
+from crud import VotingSessionCRUD, VoteCRUD
+from security import PasswordUtils
+
+SUBSCRIBERS = int(os.getenv("BENCH_SUBSCRIBERS", "1000"))
+SECONDS = float(os.getenv("BENCH_SECONDS", "5"))
+SLOW_RATIO = float(os.getenv("BENCH_SLOW_RATIO", "0.05"))
+VOTERS = int(os.getenv("BENCH_VOTERS", "2000"))
+ANIME = int(os.getenv("BENCH_ANIME", "30"))
+PORT = int(os.getenv("BENCH_PORT", "8903"))
+
+
+def setup():
+    create_tables()
+    db = SessionLocal()
+    try:
+        db.execute(insert(User), [
+            {"username": f"user{i}", "password_hash": "-", "role": "user"}
+            for i in range(1, VOTERS + 1)
+        ])
+        db.commit()
+        session_id = VotingSessionCRUD.create_session(db, title="bench", master_id=1).id
+        VotingSessionCRUD.update_session_anime(db, session_id, add=range(1, ANIME + 1))
+        return session_id
+    finally:
+        db.close()
+
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0
+
+
+async def main():
+    import httpx
+
+    session_id = setup()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(PORT),
+         "--log-level", "warning"],
+        cwd=ROOT, env=os.environ.copy()
+    )
+    base_url = f"http://127.0.0.1:{PORT}"
+    received = Counter()
+    stop = asyncio.Event()
+    connected = 0
+
+    async def consumer(client, slow):
+        nonlocal connected
+        async with client.stream("GET", f"/api/voting/sessions/{session_id}/live") as response:
+            received[f"status {response.status_code}"] += 1
+            connected += 1
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    received[line[7:]] += 1
+                if stop.is_set():
+                    break
+                if slow:
+                    await asyncio.sleep(2)
+
+    read_statuses, read_latencies = Counter(), []
+
+    async def reader(client):
+        while not stop.is_set():
+            begin = time.perf_counter()
+            try:
+                status = (await client.get("/api/voting/sessions/public")).status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            read_latencies.append((time.perf_counter() - begin) * 1000)
+            read_statuses[str(status)] += 1
+            await asyncio.sleep(0.1)
+
+    votes = 0
+
+    async def voter():
+        nonlocal votes
+        rng = random.Random(1)
+        levels = list(VOTE_LEVELS)
+        deadline = time.perf_counter() + SECONDS
+        while time.perf_counter() < deadline:
+            ballot = [{"anime_id": rng.randint(1, ANIME), "vote_level": rng.choice(levels)}]
+            await run_db_task(VoteCRUD.cast_vote, session_id, rng.randint(1, VOTERS), ballot)
+            votes += 1
+
+    try:
+        limits = httpx.Limits(max_connections=SUBSCRIBERS + 10, max_keepalive_connections=SUBSCRIBERS + 10)
+        async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+            for _ in range(300):
+                try:
+                    if (await client.get("/health")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn 未能在 30 秒内启动")
+
+            start = time.perf_counter()
+            slow_count = int(SUBSCRIBERS * SLOW_RATIO)
+            consumers = [asyncio.create_task(consumer(client, index < slow_count)) for index in range(SUBSCRIBERS)]
+            while connected < SUBSCRIBERS and time.perf_counter() - start < 60:
+                await asyncio.sleep(0.05)
+            print(f"{connected} 个订阅连接建立耗时 {time.perf_counter() - start:.2f}s")
+
+            readers = [asyncio.create_task(reader(client)) for _ in range(5)]
+            await voter()
+            await asyncio.sleep(1)
+            token = PasswordUtils.create_access_token({"sub": "user1", "user_id": 1})
+            response = await client.get("/api/voting/live/stats", headers={"Authorization": f"Bearer {token}"})
+            stats = None
+            if response.status_code == 200:
+                stats = response.json()["sessions"][str(session_id)]
+            else:
+                read_statuses[str(response.status_code)] += 1
+            memory = rss_mb(server.pid)
+            stop.set()
+            for task in consumers + readers:
+                task.cancel()
+            await asyncio.gather(*consumers, *readers, return_exceptions=True)
+    finally:
+        server.terminate()
+        server.wait()
+
+    if stats is None or set(read_statuses) != {"200"}:
+        print(f"失败：订阅期间的普通请求出错（订阅连接可能占用了数据库连接池），状态码 {dict(read_statuses)}")
+        sys.exit(1)
+    read_latencies.sort()
+    print(f"{SECONDS:.0f}s 内投票 {votes} 次，订阅者 {stats['subscribers']} 个")
+    print(f"统计计算 {stats['computations']} 次，推送 {stats['messages']} 条 delta（与订阅数无关）")
+    print(f"订阅者收到 delta {received['delta']} 条、snapshot {received['snapshot']} 条，"
+          f"慢消费者（{slow_count} 个）丢弃积压 {stats['dropped']} 条")
+    print(f"同时读取公开会话列表 {len(read_latencies)} 次，状态码 {dict(read_statuses)}，"
+          f"p50 {read_latencies[len(read_latencies) // 2]:.1f} ms / p99 {read_latencies[int(len(read_latencies) * 0.99)]:.1f} ms")
+    print(f"服务进程内存 {memory:.0f} MB")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
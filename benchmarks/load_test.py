@@ -0,0 +1,294 @@
+"""
+端到端压测：生成数据集后，用混合负载（登录、投票、轮询结果、会话列表、搜索）请求 main.py 中的 app，
+分别在进程内（ASGI 直连，不经过网络）和真实的 uvicorn 进程上运行，输出每个路由的吞吐量与 p50/p95/p99，
+结果保存为 JSON，方便比较不同提交之间的差异
+
+用法：
+    python benchmarks/load_test.py
+    BENCH_MODE=uvicorn BENCH_CONCURRENCY=64 BENCH_DURATION=30 python benchmarks/load_test.py
+    BENCH_MIX=vote:50,results:50 python benchmarks/load_test.py
+    python benchmarks/load_test.py --compare benchmarks/results/old.json benchmarks/results/new.json
+
+数据集规模见 benchmarks/datagen.py 中的 BENCH_* 变量；搜索请求发往本地的 Bangumi 模拟服务（benchmarks/bangumi_stub.py）。
+默认使用临时目录中的 SQLite 文件，BENCH_DATABASE_URL 可以指定其他数据库（会写入压测数据）。
+登录的耗时主要取决于 BCRYPT_ROUNDS。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+MODE = os.getenv("BENCH_MODE", "both")  # inprocess / uvicorn / both
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "32"))
+DURATION = float(os.getenv("BENCH_DURATION", "15"))
+MIX = os.getenv("BENCH_MIX", "login:5,vote:25,results:40,listing:20,search:10")
+SEARCH_KEYWORDS = int(os.getenv("BENCH_SEARCH_KEYWORDS", "200"))
+UVICORN_PORT = int(os.getenv("BENCH_PORT", "8902"))
+UVICORN_WORKERS = int(os.getenv("BENCH_UVICORN_WORKERS", "1"))
+OUTPUT_DIR = os.getenv("BENCH_OUTPUT_DIR", os.path.join(BENCH_DIR, "results"))
+
+PERCENTILES = (50, 95, 99)
+
+
+class Recorder:
+    """按路由记录每个请求的耗时和状态码"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def record(self, route: str, elapsed: float, status):
+        self.latencies[route].append(elapsed * 1000)
+        self.statuses[route][str(status)] += 1
+
+    def summary(self, duration: float):
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            statuses = self.statuses[route]
+            routes[route] = {
+                "requests": len(latencies),
+                "rps": round(len(latencies) / duration, 1),
+                "mean_ms": round(sum(latencies) / len(latencies), 2),
+                **{
+                    f"p{p}_ms": round(latencies[min(len(latencies) - 1, round(p / 100 * (len(latencies) - 1)))], 2)
+                    for p in PERCENTILES
+                },
+                "errors": sum(n for status, n in statuses.items() if not status.startswith(("2", "3"))),
+                "statuses": dict(statuses)
+            }
+        total = sum(route["requests"] for route in routes.values())
+        return {"duration_s": round(duration, 2), "requests": total,
+                "rps": round(total / duration, 1), "routes": routes}
+
+
+def parse_mix(mix: str):
+    operations, weights = [], []
+    for part in mix.split(","):
+        name, weight = part.split(":")
+        operations.append(name.strip())
+        weights.append(float(weight))
+    return operations, weights
+
+
+def zipf_choice(rng, items, exponent: float = 1.1):
+    """按 Zipf 分布挑选：排在前面的被选中的概率更高（热门会话、热门关键词）"""
+    index = min(int(rng.paretovariate(exponent)) - 1, len(items) - 1)
+    return items[index]
+
+
+async def virtual_user(client, dataset, recorder, deadline, seed):
+    """一个虚拟用户：先登录，然后按负载比例随机发请求，直到时间结束"""
+    from datagen import PASSWORD
+
+    rng = random.Random(seed)
+    operations, weights = parse_mix(MIX)
+    sessions = dataset["public_sessions"]
+    username = f"bench{rng.choice(dataset['user_ids'])}"
+    etags = {}
+
+    async def request(route, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            status = response.status_code
+        except Exception as e:
+            response, status = None, type(e).__name__
+        recorder.record(route, time.perf_counter() - start, status)
+        return response
+
+    async def login():
+        # 登录被准入控制拒绝（503）时像真实客户端一样按 Retry-After 等待后重试
+        while time.perf_counter() < deadline:
+            response = await request("POST /auth/login", "POST", "/auth/login",
+                                     data={"username": username, "password": PASSWORD})
+            if response is not None and response.status_code == 200:
+                return {"Authorization": f"Bearer {response.json()['access_token']}"}
+            if response is None or response.status_code != 503:
+                break
+            await asyncio.sleep(float(response.headers.get("retry-after", "1")))
+        return {}
+
+    headers = await login()
+    while time.perf_counter() < deadline:
+        operation = rng.choices(operations, weights)[0]
+        if operation == "login":
+            headers = await login() or headers
+        elif operation == "vote":
+            session_id = zipf_choice(rng, sessions)
+            picks = rng.sample(dataset["sessions"][session_id], rng.randint(1, 3))
+            await request("POST /api/voting/sessions/{id}/vote", "POST",
+                          f"/api/voting/sessions/{session_id}/vote", headers=headers, json={
+                              "session_id": session_id,
+                              "voted_anime": [
+                                  {"anime_id": anime_id, "vote_level": rng.choice(["justsoso", "good", "great", "god"])}
+                                  for anime_id in picks
+                              ]
+                          })
+        elif operation == "results":
+            # 像前端轮询一样带上上次的 ETag
+            url = f"/api/voting/sessions/{zipf_choice(rng, sessions)}/results"
+            response = await request("GET /api/voting/sessions/{id}/results", "GET", url,
+                                     headers={"If-None-Match": etags[url]} if url in etags else {})
+            if response is not None and response.headers.get("etag"):
+                etags[url] = response.headers["etag"]
+        elif operation == "listing":
+            await request("GET /api/voting/sessions/public", "GET", "/api/voting/sessions/public?limit=20")
+        elif operation == "search":
+            keyword = zipf_choice(rng, [f"keyword {n}" for n in range(SEARCH_KEYWORDS)])
+            await request("GET /search/anime", "GET", "/search/anime", params={"keyword": keyword})
+
+
+async def drive(client, dataset):
+    recorder = Recorder()
+    start = time.perf_counter()
+    deadline = start + DURATION
+    await asyncio.gather(*(
+        virtual_user(client, dataset, recorder, deadline, seed) for seed in range(CONCURRENCY)
+    ))
+    return recorder.summary(time.perf_counter() - start)
+
+
+async def run_inprocess(dataset):
+    """通过 ASGI 直接调用 app，测的是应用本身的开销（不含网络和 HTTP 解析）"""
+    import httpx
+    from main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        result = await drive(client, dataset)
+    for handler in app.router.on_shutdown:
+        await handler()
+    return result
+
+
+async def run_uvicorn(dataset):
+    """启动真实的 uvicorn 进程，通过本地 TCP 连接压测"""
+    import httpx
+
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "127.0.0.1", "--port", str(UVICORN_PORT),
+        "--workers", str(UVICORN_WORKERS), "--log-level", "warning"
+    ]
+    server = subprocess.Popen(command, cwd=ROOT, env=os.environ.copy())
+    base_url = f"http://127.0.0.1:{UVICORN_PORT}"
+    try:
+        limits = httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY)
+        async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+            for _ in range(300):
+                try:
+                    if (await client.get("/health")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn 未能在 30 秒内启动")
+            return await drive(client, dataset)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def print_run(mode, result):
+    print(f"\n[{mode}] {result['requests']} 个请求 / {result['duration_s']}s = {result['rps']} req/s")
+    print(f"{'路由':<42}{'请求数':>8}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'错误':>7}")
+    for route, stats in result["routes"].items():
+        print(f"{route:<44}{stats['requests']:>8}{stats['rps']:>9}{stats['p50_ms']:>9}"
+              f"{stats['p95_ms']:>9}{stats['p99_ms']:>9}{stats['errors']:>7}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(old_path, new_path):
+    """逐个路由比较两次压测结果"""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['revision']} -> {new['revision']}")
+
+    def change(before, after):
+        return f"{before:>9} -> {after:<9} ({(after - before) / before * 100:+.1f}%)" if before else f"{after}"
+
+    for mode, run in new["runs"].items():
+        if mode not in old["runs"]:
+            continue
+        print(f"\n[{mode}] 总吞吐 {change(old['runs'][mode]['rps'], run['rps'])}")
+        for route, stats in run["routes"].items():
+            before = old["runs"][mode]["routes"].get(route)
+            if before:
+                print(f"  {route}\n    req/s {change(before['rps'], stats['rps'])}"
+                      f"   p99 {change(before['p99_ms'], stats['p99_ms'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端压测")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="比较两次压测结果")
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # 环境变量必须在导入应用之前设置
+    workdir = tempfile.mkdtemp(prefix="anime_voting_load_")
+    os.environ["DATABASE_URL"] = os.getenv("BENCH_DATABASE_URL", f"sqlite:///{workdir}/bench.db")
+    # 所有虚拟用户都来自同一个 IP、反复登录，按用户 / IP 的限流会把压测变成测 429
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+    from bangumi_stub import start_in_thread
+    os.environ["BANGUMI_API"] = start_in_thread()
+    import datagen
+
+    start = time.perf_counter()
+    dataset = datagen.seed()
+    print(f"数据集：用户 {dataset['users']}，会话 {len(dataset['sessions'])}（公开 {len(dataset['public_sessions'])}），"
+          f"选票 {dataset['ballots']}，生成耗时 {time.perf_counter() - start:.1f}s")
+    print(f"并发 {CONCURRENCY}，每轮 {DURATION}s，负载比例 {MIX}")
+
+    runs = {}
+    if MODE in ("inprocess", "both"):
+        runs["inprocess"] = asyncio.run(run_inprocess(dataset))
+        print_run("inprocess", runs["inprocess"])
+    if MODE in ("uvicorn", "both"):
+        runs["uvicorn"] = asyncio.run(run_uvicorn(dataset))
+        print_run(f"uvicorn x{UVICORN_WORKERS}", runs["uvicorn"])
+
+    revision = git_revision()
+    report = {
+        "revision": revision,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "concurrency": CONCURRENCY, "duration_s": DURATION, "mix": MIX,
+            "uvicorn_workers": UVICORN_WORKERS, "database": os.environ["DATABASE_URL"].split("://")[0],
+            "users": datagen.USERS, "sessions": datagen.SESSIONS,
+            "anime_per_session": datagen.ANIME_PER_SESSION, "ballots": dataset["ballots"]
+        },
+        "runs": runs
+    }
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    path = os.path.join(OUTPUT_DIR, f"load-{revision}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {path}")
+
+
+if __name__ == "__main__":
+    main()
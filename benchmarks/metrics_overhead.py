@@ -0,0 +1,73 @@
+"""
+指标中间件开销压测：同一个最简单的 FastAPI 路由，直接以 ASGI 方式调用，
+对比加上 MetricsMiddleware 前后每个请求的耗时，以及生成一次 /metrics 文本的耗时
+
+用法：
+    python benchmarks/metrics_overhead.py
+    BENCH_ROUNDS=200000 BENCH_ROUTES=50 python benchmarks/metrics_overhead.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI
+
+from metrics import MetricsMiddleware, collect_snapshots, merge_snapshots, render
+
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "20000"))
+ROUTES = int(os.getenv("BENCH_ROUTES", "20"))
+REPEAT = int(os.getenv("BENCH_REPEAT", "5"))
+
+
+def build_app(with_metrics: bool):
+    app = FastAPI()
+    for index in range(ROUTES):
+        @app.get(f"/items{index}/{{item_id}}")
+        async def get_item(item_id: int):
+            return {"item_id": item_id}
+    if with_metrics:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+async def measure(app):
+    """ROUNDS 个请求轮流访问各个路由，返回每个请求的平均耗时（微秒）"""
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    scopes = [
+        {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+         "scheme": "http", "path": f"/items{index % ROUTES}/{index}", "raw_path": b"", "root_path": "",
+         "query_string": b"", "headers": [], "client": ("127.0.0.1", 1), "server": ("testserver", 80)}
+        for index in range(ROUNDS)
+    ]
+    start = time.perf_counter()
+    for scope in scopes:
+        await app(scope, receive, send)
+    return (time.perf_counter() - start) / ROUNDS * 1e6
+
+
+async def main():
+    # 交替测量 REPEAT 轮，各取最快的一轮，减少抖动的影响
+    plain, instrumented = build_app(False), build_app(True)
+    plain_us = instrumented_us = float("inf")
+    for _ in range(REPEAT):
+        plain_us = min(plain_us, await measure(plain))
+        instrumented_us = min(instrumented_us, await measure(instrumented))
+    print(f"{ROUNDS} 个请求，{ROUTES} 个路由")
+    print(f"  无指标中间件   {plain_us:7.1f} µs/请求")
+    print(f"  MetricsMiddleware {instrumented_us:7.1f} µs/请求（+{instrumented_us - plain_us:.1f} µs）")
+
+    start = time.perf_counter()
+    text = render(merge_snapshots(collect_snapshots()))
+    print(f"  生成 /metrics 文本 {(time.perf_counter() - start) * 1000:.1f} ms（{len(text.splitlines())} 行）")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
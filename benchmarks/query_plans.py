@@ -0,0 +1,235 @@
+"""
+查询计划检查：在预先填充的大数据集上请求每个路由，记录执行的每条 SQL，
+用 EXPLAIN QUERY PLAN 检查是否有全表扫描；同时通过 X-SQL-* 调试响应头检查每个请求的语句数，
+同一语句在一个请求中重复执行 SQL_N_PLUS_ONE_THRESHOLD 次（这里默认 3 次）视为 N+1。
+发现全表扫描、N+1 或有路由未覆盖时以非零状态退出
+
+用法：
+    python benchmarks/query_plans.py
+    BENCH_USERS=20000 BENCH_SESSIONS=2000 python benchmarks/query_plans.py
+
+只支持 SQLite（EXPLAIN QUERY PLAN 的输出格式）。新增路由后需要在 requests() 中补上对应的请求。
+"""
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="anime_voting_bench_"))
+os.environ.setdefault("SQL_DEBUG_HEADERS", "1")
+os.environ.setdefault("SQL_N_PLUS_ONE_THRESHOLD", "3")
+# 后台重算排行榜分数时会读取整张排行榜表求全站平均分（表大小为动漫数、每个间隔一次），不在请求路径上，
+# 不能让它混进正在检查的路由
+os.environ.setdefault("LEADERBOARD_REFRESH_SECONDS", "3600")
+
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from sqlalchemy import event, insert
+
+from database import Base, SessionLocal, User, VOTE_LEVELS, engine
+from crud import VotingSessionCRUD, VoteCRUD
+from live import _poll_session
+from main import app
+
+USERS = int(os.getenv("BENCH_USERS", "5000"))
+SESSIONS = int(os.getenv("BENCH_SESSIONS", "500"))
+BALLOTS_PER_SESSION = int(os.getenv("BENCH_BALLOTS_PER_SESSION", "40"))
+ANIME = int(os.getenv("BENCH_ANIME", "200"))
+
+# 允许全表扫描的表及原因
+ALLOWED_SCANS = {}
+
+# 不需要检查的路由及原因
+SKIPPED_ROUTES = {
+    ("GET", "/search/anime"): "只请求 Bangumi，不访问数据库",
+    ("GET", "/api/voting/sessions/{session_id}/live"): "持续推送的 SSE 连接，数据库查询由下面的 live 推送任务覆盖",
+}
+
+FULL_SCAN = re.compile(r"^SCAN (TABLE )?(?P<table>[^\s(]\S*)( AS \S+)?$")
+
+
+def seed():
+    """填充用户、会话和选票（奇数 ID 的会话公开）"""
+    db = SessionLocal()
+    try:
+        db.execute(insert(User), [
+            {"username": f"user{i}", "password_hash": "-", "role": "user"}
+            for i in range(1, USERS + 1)
+        ])
+        db.commit()
+        rng = random.Random(42)
+        levels = list(VOTE_LEVELS)
+        for n in range(SESSIONS):
+            session = VotingSessionCRUD.create_session(
+                db, title=f"session {n}", master_id=rng.randint(1, USERS), is_public=n % 2 == 0
+            )
+            anime_list = rng.sample(range(1, ANIME + 1), 10)
+            VotingSessionCRUD.update_session_anime(db, session.id, add=anime_list)
+            VoteCRUD.bulk_cast_votes(db, session.id, [
+                {
+                    "user_id": user_id,
+                    "voted_anime": [
+                        {"anime_id": anime_id, "vote_level": rng.choice(levels)}
+                        for anime_id in rng.sample(anime_list, 3)
+                    ]
+                }
+                for user_id in rng.sample(range(1, USERS + 1), BALLOTS_PER_SESSION)
+            ])
+    finally:
+        db.close()
+
+
+def give_votes(username, count):
+    """让用户在前 count 个会话中各有一张选票，用户投票记录才能暴露逐条查询会话的 N+1"""
+    db = SessionLocal()
+    try:
+        user_id = db.query(User.id).filter(User.username == username).scalar()
+        for session_id in range(1, count + 1):
+            anime_id = VotingSessionCRUD.get_session_anime_ids(db, session_id)[0]
+            VoteCRUD.bulk_cast_votes(db, session_id, [
+                {"user_id": user_id, "voted_anime": [{"anime_id": anime_id, "vote_level": "good"}]}
+            ])
+    finally:
+        db.close()
+
+
+def requests(admin, user):
+    """(方法, 路由模板, 地址, 请求参数)，破坏性的请求放在最后"""
+    return [
+        ("GET", "/", "/", {}),
+        ("GET", "/health", "/health", {}),
+        ("GET", "/metrics", "/metrics", {}),
+        ("GET", "/openapi.json", "/openapi.json", {}),
+        ("GET", "/docs", "/docs", {}),
+        ("GET", "/docs/oauth2-redirect", "/docs/oauth2-redirect", {}),
+        ("GET", "/redoc", "/redoc", {}),
+        ("POST", "/auth/register", "/auth/register", {"json": {"username": "plan_guest", "password": "p"}}),
+        ("POST", "/auth/login", "/auth/login", {"data": {"username": "plan_user", "password": "p"}}),
+        ("GET", "/auth/me", "/auth/me", user),
+        ("GET", "/api/voting/sessions/public", "/api/voting/sessions/public", {}),
+        ("GET", "/api/voting/sessions/public", "/api/voting/sessions/public?keyword=session%201&limit=50", {}),
+        ("GET", "/api/voting/sessions/{session_id}", "/api/voting/sessions/1", {}),
+        ("GET", "/api/voting/sessions/{session_id}", "/api/voting/sessions/1?anime_limit=3&anime_cursor=WzMsIDNd", {}),
+        ("GET", "/api/voting/sessions/{session_id}/results", "/api/voting/sessions/1/results?sort_by=average_score&top_n=5", {}),
+        ("GET", "/api/voting/leaderboard", "/api/voting/leaderboard?limit=10&offset=10", {}),
+        ("GET", "/api/voting/leaderboard/{anime_id}", "/api/voting/leaderboard/5", {}),
+        ("GET", "/api/voting/live/stats", "/api/voting/live/stats", user),
+        ("GET", "/api/voting/write-buffer", "/api/voting/write-buffer", user),
+        ("GET", "/api/voting/admission", "/api/voting/admission", user),
+        ("POST", "/api/voting/sessions", "/api/voting/sessions", {
+            **admin, "json": {"title": "plan", "description": "d", "is_public": True,
+                              "allow_multiple_votes": True, "max_votes_per_user": 10}}),
+        ("POST", "/api/voting/sessions/{session_id}/anime", f"/api/voting/sessions/{SESSIONS + 1}/anime", {
+            **admin, "json": {"session_id": SESSIONS + 1, "bangumi_id": 1}}),
+        ("POST", "/api/voting/sessions/{session_id}/anime/bulk", f"/api/voting/sessions/{SESSIONS + 1}/anime/bulk", {
+            **admin, "json": {"add": list(range(2, 40)), "remove": [39]}}),
+        ("POST", "/api/voting/sessions/{session_id}/vote", f"/api/voting/sessions/{SESSIONS + 1}/vote", {
+            **user, "json": {"session_id": SESSIONS + 1, "voted_anime": [{"anime_id": 1, "vote_level": "god"}]}}),
+        ("POST", "/api/voting/sessions/{session_id}/votes/bulk", f"/api/voting/sessions/{SESSIONS + 1}/votes/bulk", {
+            **admin, "json": {"ballots": [{"user_id": 3, "voted_anime": [{"anime_id": 1, "vote_level": "good"}]}]}}),
+        ("GET", "/api/voting/sessions/{session_id}/export", "/api/voting/sessions/1/export?format=ndjson", admin),
+        ("GET", "/api/voting/my-sessions", "/api/voting/my-sessions", admin),
+        ("GET", "/admin/users", "/admin/users?role=user&limit=50", admin),
+        ("GET", "/admin/users", "/admin/users?username_prefix=user1", admin),
+        ("GET", "/admin/sessions", "/admin/sessions?master_id=7", admin),
+        ("GET", "/admin/invalidation", "/admin/invalidation", admin),
+        ("GET", "/user/profile", "/user/profile", user),
+        ("GET", "/user/votes", "/user/votes?limit=50", user),
+        ("GET", "/user/votes", "/user/votes?session_id=1", user),
+        ("GET", "/user/sessions", "/user/sessions", user),
+        ("GET", "/user/stats", "/user/stats", user),
+        ("GET", "/search/cache/stats", "/search/cache/stats", {}),
+        ("PUT", "/user/profile", "/user/profile", {**user, "json": {"username": "plan_user2"}}),
+        ("PUT", "/admin/users/{user_id}/role", "/admin/users/5/role?new_role=admin", admin),
+        ("DELETE", "/admin/users/{user_id}", "/admin/users/6", admin),
+        ("POST", "/auth/change_password", "/auth/change_password?old_password=p&new_password=q", admin),
+    ]
+
+
+def main():
+    start = time.perf_counter()
+    client = TestClient(app).__enter__()
+    seed()
+    print(f"数据集：用户 {USERS}，会话 {SESSIONS}，选票 {SESSIONS * BALLOTS_PER_SESSION}，"
+          f"填充耗时 {time.perf_counter() - start:.1f}s")
+
+    captured = defaultdict(dict)  # 路由 -> {SQL: 参数}
+    current = [None]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if current[0] and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH")):
+            captured[current[0]].setdefault(statement, parameters[0] if executemany else parameters)
+
+    def tokens(username, role):
+        current[0] = ("POST", "/auth/register")
+        client.post("/auth/register", json={"username": username, "password": "p", "role": role})
+        token = client.post("/auth/login", data={"username": username, "password": "p"}).json()["access_token"]
+        return {"headers": {"Authorization": f"Bearer {token}"}}
+
+    admin, user = tokens("plan_admin", "admin"), tokens("plan_user", "user")
+    give_votes("plan_user", 5)
+    query_counts = defaultdict(int)  # 路由 -> 单个请求最多执行的语句数
+    repeated = []
+    for method, template, url, kwargs in requests(admin, user):
+        current[0] = (method, template)
+        response = client.request(method, url, **kwargs)
+        if response.status_code >= 400:
+            print(f"⚠️  {method} {url} 返回 {response.status_code}：{response.text[:200]}")
+        query_counts[(method, template)] = max(query_counts[(method, template)],
+                                               int(response.headers.get("x-sql-queries", 0)))
+        if int(response.headers.get("x-sql-repeated", 0)):
+            repeated.append((method, url))
+
+    current[0] = ("TASK", "live 推送任务")
+    db = SessionLocal()
+    _poll_session(db, 1, None)
+    db.close()
+    current[0] = None
+    client.__exit__(None, None, None)
+
+    failures = 0
+    with engine.connect() as connection:
+        for route, statements in sorted(captured.items()):
+            problems = []
+            for statement, parameters in statements.items():
+                plan = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+                for *_, detail in plan:
+                    match = FULL_SCAN.match(detail)
+                    # 只检查真实的表，子查询的临时结果（anon_1 等）不算
+                    table = match and match.group("table")
+                    if table in Base.metadata.tables and table not in ALLOWED_SCANS:
+                        problems.append((detail, " ".join(statement.split())))
+            failures += len(problems)
+            count = f"每次请求最多 {query_counts[route]} 条，" if route in query_counts else ""
+            print(f"{'❌' if problems else '✅'} {route[0]:6} {route[1]}（{count}{len(statements)} 种语句）")
+            for detail, statement in problems:
+                print(f"     {detail}\n     {statement[:300]}")
+
+    declared = {
+        (method, route.path)
+        for route in app.routes if isinstance(route, APIRoute)
+        for method in route.methods
+    }
+    exercised = {(method, template) for method, template, _, _ in requests(admin, user)}
+    uncovered = sorted(declared - exercised - set(SKIPPED_ROUTES))
+    for method, path in uncovered:
+        print(f"❌ {method:6} {path} 没有被检查，请在 requests() 中补充请求")
+
+    for method, url in repeated:
+        print(f"❌ {method:6} {url} 中有语句重复执行，疑似 N+1（语句见上方的警告）")
+
+    for table, reason in ALLOWED_SCANS.items():
+        print(f"ℹ️  允许全表扫描 {table}：{reason}")
+    if failures or uncovered or repeated:
+        print(f"❌ 全表扫描 {failures} 处，疑似 N+1 {len(repeated)} 处，未覆盖路由 {len(uncovered)} 个")
+        sys.exit(1)
+    print("✅ 没有发现全表扫描和 N+1")
+
+
+if __name__ == "__main__":
+    main()
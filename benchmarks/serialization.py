@@ -0,0 +1,161 @@
+"""
+响应序列化压测：在真实结构的响应上对比改造前的 jsonable_encoder + 标准库 json、orjson 和 msgpack
+
+用法：
+    python benchmarks/serialization.py
+    BENCH_ANIME=5000 BENCH_BALLOTS=100000 python benchmarks/serialization.py
+
+响应由 VoteCRUD.calculate_session_stats 在临时 SQLite 上生成（投票结果、带百分位的详细结果），
+另外构造会话列表一页、附带条目信息的结果，以及导出接口每块选票的 NDJSON / msgpack 编码。
+每种编码都核对解码后的内容与改造前一致。
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+WORKDIR = tempfile.mkdtemp(prefix="anime_voting_bench_")
+os.chdir(WORKDIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{WORKDIR}/bench.db"
+# 写入压测数据时的大批量 INSERT 不打印慢查询
+os.environ.setdefault("SQL_SLOW_QUERY_MS", "0")
+
+import msgpack
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import insert
+
+from database import SessionLocal, User, VOTE_LEVELS, create_tables
+from crud import VoteCRUD, VotingSessionCRUD
+from export import EXPORT_CHUNK_SIZE, _msgpack_chunks, _ndjson_chunks
+from serialization import dumps_json, dumps_msgpack
+
+ANIME = int(os.getenv("BENCH_ANIME", "2000"))
+BALLOTS = int(os.getenv("BENCH_BALLOTS", "20000"))
+PER_BALLOT = int(os.getenv("BENCH_ANIME_PER_BALLOT", "10"))
+REPEAT = int(os.getenv("BENCH_REPEAT", "20"))
+
+
+def seed(rng):
+    """一个会话，ANIME 个动漫，BALLOTS 张选票"""
+    create_tables()
+    db = SessionLocal()
+    try:
+        db.execute(insert(User), [{"username": f"u{i}", "password_hash": "-", "role": "user"}
+                                  for i in range(1, BALLOTS + 1)])
+        db.commit()
+        session = VotingSessionCRUD.create_session(db, title="bench", master_id=1)
+        VotingSessionCRUD.update_session_anime(db, session.id, add=range(1, ANIME + 1))
+        levels = list(VOTE_LEVELS)
+        VoteCRUD.bulk_cast_votes(db, session.id, [
+            {"user_id": user_id, "voted_anime": [
+                {"anime_id": anime_id, "vote_level": rng.choice(levels)}
+                for anime_id in rng.sample(range(1, ANIME + 1), PER_BALLOT)
+            ]}
+            for user_id in range(1, BALLOTS + 1)
+        ])
+        return session.id
+    finally:
+        db.close()
+
+
+def payloads(session_id, rng):
+    """(名称, 响应内容)"""
+    db = SessionLocal()
+    try:
+        stats = VoteCRUD.calculate_session_stats(db, session_id)
+        detailed = VoteCRUD.calculate_session_stats(db, session_id, detailed=True)
+        ballots = list(VoteCRUD.iter_session_ballots(db, session_id, EXPORT_CHUNK_SIZE))[:EXPORT_CHUNK_SIZE]
+    finally:
+        db.close()
+    # 与 subjects.subject_to_dict 相同的结构
+    anime = {
+        anime_id: {"bangumi_id": anime_id, "title": f"Anime {anime_id}", "title_cn": f"动画 {anime_id}",
+                   "image": f"https://lain.bgm.tv/pic/cover/l/{anime_id}.jpg", "score": round(rng.uniform(5, 9), 1)}
+        for anime_id in range(1, ANIME + 1)
+    }
+    listing = {
+        "sessions": [
+            {"id": n, "title": f"第 {n} 届动漫投票", "description": "年度新番投票" * 5, "is_public": True,
+             "anime_count": ANIME, "created_at": "2026-10-01T12:00:00.000000"}
+            for n in range(100)
+        ],
+        "next_cursor": "WyIyMDI2LTEwLTAxVDEyOjAwOjAwIiwgMTAwXQ=="
+    }
+    return [
+        ("投票结果", {"session_id": session_id, "stats": stats}),
+        ("投票结果 detailed", {"session_id": session_id, "stats": detailed}),
+        ("投票结果 enrich", {"session_id": session_id, "stats": stats, "anime": anime}),
+        ("会话列表（100 条）", listing),
+    ], ballots
+
+
+def old_json(content):
+    """改造前 conditional_json 的序列化"""
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def old_ndjson(ballots):
+    """改造前导出接口的 NDJSON 编码"""
+    return ("\n".join(json.dumps({
+        "vote_id": vote_id, "user_id": user_id, "voted_anime": voted_anime,
+        "created_at": created_at.isoformat() if created_at else None
+    }, ensure_ascii=False) for vote_id, user_id, voted_anime, created_at in ballots) + "\n").encode()
+
+
+def best_of(fn, *args):
+    """重复 REPEAT 次取最快一次（毫秒），并返回结果"""
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def report(name, old_ms, old_size, rows):
+    print(f"{name}")
+    print(f"  {'改造前 json':<22} {old_ms:8.2f} ms {old_size / 1024:9.1f} KB")
+    for label, ms, size in rows:
+        print(f"  {label:<22} {ms:8.2f} ms {size / 1024:9.1f} KB  ({old_ms / ms:.1f}x)")
+
+
+def main():
+    rng = random.Random(0)
+    start = time.perf_counter()
+    session_id = seed(rng)
+    items, ballots = payloads(session_id, rng)
+    print(f"{ANIME} 个动漫，{BALLOTS} 张选票，生成数据 {time.perf_counter() - start:.1f}s，各取 {REPEAT} 次中最快一次\n")
+
+    for name, content in items:
+        old_ms, old_body = best_of(old_json, content)
+        json_ms, json_body = best_of(dumps_json, content)
+        msgpack_ms, msgpack_body = best_of(dumps_msgpack, content)
+        expected = json.loads(old_body)
+        assert json.loads(json_body) == expected, name
+        # msgpack 保留整数键，按 JSON 的规则转成字符串后比较
+        assert json.loads(json.dumps(msgpack.unpackb(msgpack_body, strict_map_key=False))) == expected, name
+        report(name, old_ms, len(old_body), [
+            ("orjson", json_ms, len(json_body)),
+            ("msgpack", msgpack_ms, len(msgpack_body)),
+        ])
+
+    old_ms, old_body = best_of(old_ndjson, ballots)
+    ndjson_ms, ndjson_body = best_of(lambda: b"".join(_ndjson_chunks(ballots)))
+    msgpack_ms, msgpack_body = best_of(lambda: b"".join(_msgpack_chunks(ballots)))
+    assert [json.loads(line) for line in ndjson_body.splitlines()] == [json.loads(line) for line in old_body.splitlines()]
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(msgpack_body)
+    assert list(unpacker) == [json.loads(line) for line in old_body.splitlines()]
+    report(f"导出 {len(ballots)} 张选票（一块）", old_ms, len(old_body), [
+        ("orjson NDJSON", ndjson_ms, len(ndjson_body)),
+        ("msgpack", msgpack_ms, len(msgpack_body)),
+    ])
+    print("\n✅ 各编码解码后与改造前一致")
+
+
+if __name__ == "__main__":
+    main()
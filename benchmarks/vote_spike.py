@@ -0,0 +1,128 @@
+"""
+投票突发压测：大量用户同时投票时，对比不做准入控制与默认准入控制下
+投票的吞吐、被拒绝（503）的比例，以及同时在读会话列表的访客的延迟
+
+用法：
+    python benchmarks/vote_spike.py
+    BENCH_VOTERS=500 BENCH_READERS=20 BENCH_DURATION=20 python benchmarks/vote_spike.py
+    ADMISSION_VOTE_CONCURRENCY=8 python benchmarks/vote_spike.py   # 调整"准入控制"一轮的参数
+
+每种配置在独立的子进程中运行（准入参数在导入时读取），进程内通过 ASGI 直接调用 app。
+投票者收到 503 后按 Retry-After 等待再重试；限流（429）在本压测中关闭，所有请求都来自同一个 IP。
+"""
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+VOTERS = int(os.getenv("BENCH_VOTERS", "300"))
+READERS = int(os.getenv("BENCH_READERS", "10"))
+DURATION = float(os.getenv("BENCH_DURATION", "10"))
+
+CONFIGS = [
+    ("不做准入控制", {"ADMISSION_VOTE_CONCURRENCY": "0"}),
+    ("准入控制", {}),
+]
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))], 1)
+
+
+async def spike(dataset):
+    import httpx
+    from main import app
+    from security import PasswordUtils
+
+    session_ids = dataset["public_sessions"]
+    statuses, read_statuses = Counter(), Counter()
+    vote_latencies, read_latencies = [], []
+    deadline = time.perf_counter() + DURATION
+
+    async def voter(client, user_id):
+        rng = random.Random(user_id)
+        token = PasswordUtils.create_access_token({"sub": f"bench{user_id}", "user_id": user_id})
+        headers = {"Authorization": f"Bearer {token}"}
+        while time.perf_counter() < deadline:
+            session_id = rng.choice(session_ids)
+            picks = rng.sample(dataset["sessions"][session_id], 3)
+            start = time.perf_counter()
+            response = await client.post(f"/api/voting/sessions/{session_id}/vote", headers=headers, json={
+                "session_id": session_id,
+                "voted_anime": [{"anime_id": anime_id, "vote_level": "good"} for anime_id in picks]
+            })
+            statuses[response.status_code] += 1
+            if response.status_code == 200:
+                vote_latencies.append((time.perf_counter() - start) * 1000)
+            elif "retry-after" in response.headers:
+                await asyncio.sleep(float(response.headers["retry-after"]))
+
+    async def reader(client):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.get("/api/voting/sessions/public?limit=20")
+            read_statuses[response.status_code] += 1
+            read_latencies.append((time.perf_counter() - start) * 1000)
+
+    # 连接池等待超时等异常记为 500，而不是中断压测
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(voter(client, user_id) for user_id in dataset["user_ids"][:VOTERS]),
+            *(reader(client) for _ in range(READERS))
+        )
+        elapsed = time.perf_counter() - start
+    for handler in app.router.on_shutdown:
+        await handler()
+    return {
+        "votes_per_second": round(statuses[200] / elapsed, 1),
+        "statuses": dict(statuses),
+        "vote_p50_ms": percentile(vote_latencies, 50),
+        "vote_p99_ms": percentile(vote_latencies, 99),
+        "read_p50_ms": percentile(read_latencies, 50),
+        "read_p99_ms": percentile(read_latencies, 99),
+        "reads": len(read_latencies),
+        "read_statuses": dict(read_statuses)
+    }
+
+
+def child():
+    """子进程：生成数据集并运行一轮突发，最后一行输出 JSON 结果"""
+    workdir = tempfile.mkdtemp(prefix="anime_voting_spike_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    import datagen
+
+    dataset = datagen.seed(users=VOTERS, sessions=10, ballots=VOTERS)
+    print(json.dumps(asyncio.run(spike(dataset))))
+
+
+def main():
+    print(f"{VOTERS} 个用户同时投票，{READERS} 个访客读会话列表，每轮 {DURATION:.0f}s")
+    for label, overrides in CONFIGS:
+        env = {**os.environ, **overrides, "BENCH_SPIKE_CHILD": "1",
+               "RATE_LIMIT_ENABLED": "0", "SQL_SLOW_QUERY_MS": "0"}
+        output = subprocess.run([sys.executable, __file__], env=env, cwd=BENCH_DIR,
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"\n{label}")
+        print(f"  投票 {result['votes_per_second']} 张/秒，状态码 {result['statuses']}，"
+              f"成功投票 p50 {result['vote_p50_ms']} ms / p99 {result['vote_p99_ms']} ms")
+        print(f"  读会话列表 {result['reads']} 次，状态码 {result['read_statuses']}，"
+              f"p50 {result['read_p50_ms']} ms / p99 {result['read_p99_ms']} ms")
+
+
+if __name__ == "__main__":
+    child() if os.getenv("BENCH_SPIKE_CHILD") == "1" else main()
@@ -0,0 +1,93 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    进程内的 TTL + LRU 缓存
+    - 条目超过 ttl 秒后过期；过期后的 stale_ttl 秒内仍可作为"旧数据"返回（配合后台刷新使用）
+    - 条目数超过 maxsize 时淘汰最久未使用的条目
+    - 记录命中/未命中次数
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300, stale_ttl: float = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get_entry(self, key):
+        """返回 (value, is_fresh)；不存在或已超过旧数据期限时返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if now >= expires_at + self.stale_ttl:
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            if now < expires_at:
+                self.hits += 1
+                return value, True
+            self.stale_hits += 1
+            return value, False
+
+    def get(self, key, default=None):
+        """只返回未过期的值"""
+        entry = self.get_entry(key)
+        if entry is None or not entry[1]:
+            return default
+        return entry[0]
+
+    def set(self, key, value, ttl: float = None):
+        """写入缓存，ttl 为空时使用默认 TTL"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """删除并返回条目"""
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[0]
+
+    def discard_if(self, predicate):
+        """删除值满足 predicate(value) 的所有条目，返回删除数量"""
+        with self._lock:
+            keys = [key for key, (value, _) in self._data.items() if predicate(value)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """缓存统计信息"""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0
+        }
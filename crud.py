@@ -1,7 +1,20 @@
 from sqlalchemy.orm import Session
-from database import VotingSession,User,Vote,VOTE_LEVELS
+from sqlalchemy import func, case, bindparam, cast, Float, select
+from sqlalchemy.dialects import postgresql, sqlite
+from database import VotingSession,SessionAnime,User,Vote,VoteTally,VoteItem,AnimeSubject,LeaderboardEntry,DataVersion,VOTE_LEVELS,run_db,bulk_ballot_adapter
+from pydantic import ValidationError
 from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.orm import make_transient_to_detached
 from datetime import datetime, timezone
+from collections import Counter, defaultdict
+from pagination import keyset_page, position_page, DEFAULT_PAGE_SIZE
+from stats_engine import StatsAccumulator, STATS_CHUNK_SIZE, describe_distributions
+from cache import TTLCache
+from metrics import register_cache
+from invalidation import invalidation_bus
+from operator import itemgetter
+import os
+import time
 
         
 # class VotingSessionCRUD:
@@ -82,12 +95,19 @@ from datetime import datetime, timezone
 from security import PasswordUtils
 from database import User, UserRegister, UserLogin
 
+
+def upsert_statement(db: Session, table):
+    """按当前数据库生成支持 ON CONFLICT 的 INSERT 语句（PostgreSQL / SQLite）"""
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+
 class UserCRUD:
     """用户相关数据库操作 - 扩展认证功能"""
     
     @staticmethod
-    def register_user(db: Session, user_data: UserRegister):
-        """用户注册"""
+    def register_user(db: Session, user_data: UserRegister, hashed_password: str = None):
+        """用户注册（hashed_password 为已计算好的密码哈希，为空时在此计算）"""
         try:
             # 检查用户名是否已存在
             existing_user = UserCRUD.get_user_by_username(db, user_data.username)
@@ -95,7 +115,8 @@ class UserCRUD:
                 return None
             
             # 加密密码
-            hashed_password = PasswordUtils.hash_password(user_data.password)
+            if hashed_password is None:
+                hashed_password = PasswordUtils.hash_password(user_data.password)
             
             # 创建用户
             user = User(
@@ -123,10 +144,28 @@ class UserCRUD:
         if not user:
             return None
         
-        if not PasswordUtils.verify_password(password, user.password_hash):
+        valid, new_hash = PasswordUtils.verify_and_update(password, user.password_hash)
+        if not valid:
             return None
         
+        # 哈希参数已过时（如调高了成本因子），登录时顺便重新计算
+        if new_hash:
+            UserCRUD.set_password_hash(db, user, new_hash)
+        
         return user
+
+    @staticmethod
+    def set_password_hash(db: Session, user: User, password_hash: str):
+        """保存新的密码哈希"""
+        try:
+            user.password_hash = password_hash
+            invalidation_bus.publish(db, invalidation_bus.USER, user.id)
+            db.commit()
+            return True
+        except Exception as e:
+            db.rollback()
+            print(f"❌ 密码哈希更新失败: {e}")
+            return False
     
     @staticmethod
     def change_password(db: Session, user_id: int, old_password: str, new_password: str):
@@ -142,6 +181,7 @@ class UserCRUD:
             
             # 更新密码
             user.password_hash = PasswordUtils.hash_password(new_password)
+            invalidation_bus.publish(db, invalidation_bus.USER, user.id)
             db.commit()
             
             print(f"✅ 用户 {user.username} 密码修改成功")
@@ -185,10 +225,99 @@ class UserCRUD:
         return db.query(User).filter(User.id == user_id).first()
     
     @staticmethod
-    def get_all_users(db: Session, skip: int = 0):
-        """获取所有用户"""
-        return db.query(User).offset(skip).all()
+    def to_cache(user: User) -> dict:
+        """把用户行转换成可缓存的字典"""
+        return {column.key: getattr(user, column.key) for column in User.__table__.columns}
+
+    @staticmethod
+    def attach_cached_user(db: Session, data: dict):
+        """把缓存中的用户数据挂到当前会话上（不查询数据库），之后可以像查询结果一样修改和提交"""
+        user = User(**data)
+        make_transient_to_detached(user)
+        return db.merge(user, load=False)
+
+    @staticmethod
+    def get_all_users(db: Session, limit: int = DEFAULT_PAGE_SIZE, cursor=None, order: str = "desc",
+                      role: str = None, username_prefix: str = None):
+        """分页获取用户，返回 (用户列表, 下一页游标)"""
+        query = db.query(User)
+        if role:
+            query = query.filter(User.role == role)
+        if username_prefix:
+            query = query.filter(User.username.startswith(username_prefix, autoescape=True))
+        return keyset_page(query, User, limit, cursor, order)
+
+    @staticmethod
+    def update_username(db: Session, user: User, username: str):
+        """修改用户名"""
+        try:
+            user.username = username
+            invalidation_bus.publish(db, invalidation_bus.USER, user.id)
+            db.commit()
+            db.refresh(user)
+            return user
+        except Exception as e:
+            db.rollback()
+            print(f"❌ 用户名修改失败: {e}")
+            return {"error": f"更新资料失败: {str(e)}"}
+
+    @staticmethod
+    def update_user_role(db: Session, user: User, new_role: str):
+        """更新用户角色"""
+        try:
+            user.role = new_role
+            invalidation_bus.publish(db, invalidation_bus.USER, user.id)
+            db.commit()
+            db.refresh(user)
+            return user
+        except Exception as e:
+            db.rollback()
+            print(f"❌ 角色更新失败: {e}")
+            return {"error": f"更新用户角色失败: {str(e)}"}
+
+    @staticmethod
+    def delete_user(db: Session, user: User):
+        """删除用户"""
+        try:
+            invalidation_bus.publish(db, invalidation_bus.USER, user.id)
+            db.delete(user)
+            db.commit()
+            return {"message": f"用户 {user.username} 已删除"}
+        except Exception as e:
+            db.rollback()
+            print(f"❌ 删除用户失败: {e}")
+            return {"error": f"删除用户失败: {str(e)}"}
+
+    @staticmethod
+    def get_user_stats(db: Session, user_id: int):
+        """获取用户统计信息"""
+        return {
+            # 用户创建的会话数量
+            "created_sessions": db.query(VotingSession).filter(VotingSession.master_id == user_id).count(),
+            # 用户投票次数
+            "total_votes": db.query(Vote).filter(Vote.user_id == user_id).count(),
+            # 用户参与的会话数量（去重）
+            "participated_sessions": db.query(Vote.session_id).filter(Vote.user_id == user_id).distinct().count()
+        }
     
+# 会话可投的动漫：session_id -> frozenset(Bangumi ID)，投票校验时省去每次查询 __session_anime__
+# 本进程修改会话动漫后立即失效；其他进程的修改经失效总线在一个轮询间隔内生效
+session_anime_cache = TTLCache(
+    maxsize=int(os.getenv("SESSION_ANIME_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("SESSION_ANIME_CACHE_TTL", "60"))
+)
+register_cache("session_anime", session_anime_cache)
+
+
+def _invalidate_session_anime(key):
+    if key is None:
+        session_anime_cache.clear()
+    else:
+        session_anime_cache.pop(int(key))
+
+
+invalidation_bus.subscribe(invalidation_bus.SESSION_ANIME, _invalidate_session_anime)
+
 class VotingSessionCRUD:
     """投票会话相关操作"""
     
@@ -203,10 +332,10 @@ class VotingSessionCRUD:
                 description=description,
                 is_public=is_public,
                 allow_multiple_votes=allow_multiple_votes,
-                max_votes_per_user=max_votes_per_user,
-                anime_list=[]
+                max_votes_per_user=max_votes_per_user
             )
             db.add(session)
+            VersionCRUD.bump(db, VersionCRUD.LISTING)
             db.commit()
             db.refresh(session)
             return session
@@ -217,35 +346,139 @@ class VotingSessionCRUD:
     
     @staticmethod
     def add_anime_to_session(db: Session, session_id: int, anime_data: dict):
+        """向会话添加一个动漫"""
+        bangumi_id = anime_data.get("bangumi_id")
+        if not bangumi_id:
+            return {"error": "缺少 bangumi_id"}
+        result = VotingSessionCRUD.update_session_anime(db, session_id, add=[bangumi_id])
+        if "error" in result:
+            return result
+        if not result["added"]:
+            return {"error": "该动漫已在会话中存在"}
+        return result
+
+    # 向 __session_anime__ 插入时每条多行 INSERT 语句的行数
+    SESSION_ANIME_CHUNK_SIZE = 150
+
+    @staticmethod
+    def update_session_anime(db: Session, session_id: int, add: list = (), remove: list = ()):
+        """
+        在一个事务中向会话添加、移除一批动漫，返回 {"added": [...], "removed": [...], "anime_count": n}
+        - 已在会话中的动漫跳过，不在会话中的动漫移除时忽略；同一个ID同时出现在 add 和 remove 中时先移除再添加
+        - 新动漫按传入顺序排在末尾；唯一约束保证并发添加同一动漫时只有一行
+        - anime_count 按实际插入/删除的行数原子地增减
+        """
         try:
-            session = db.query(VotingSession).filter(VotingSession.id == session_id).first()
-            if not session:
+            if not db.query(VotingSession.id).filter(VotingSession.id == session_id).first():
                 return {"error": "投票会话不存在"}
-            
-            # 仅提取并验证 bangumi_id
-            bangumi_id = anime_data.get("bangumi_id")
-            if not bangumi_id:
-                return {"error": "缺少 bangumi_id"}
-            
-            # 检查是否已存在相同Bangumi ID的动漫
-            # 现在anime_list中仅存储ID，简化检查逻辑
-            for existing in session.anime_list:
-                if existing == bangumi_id:
-                    return {"error": "该动漫已在会话中存在"}
-           # 仅将bangumi_id添加到列表（不存储完整信息）
-            session.anime_list = session.anime_list + [bangumi_id]
+            table = SessionAnime.__table__
+            add = list(dict.fromkeys(int(bangumi_id) for bangumi_id in add))
+            remove = list(dict.fromkeys(int(bangumi_id) for bangumi_id in remove))
+
+            removed = []
+            if remove:
+                removed = [bangumi_id for (bangumi_id,) in db.query(SessionAnime.bangumi_id).filter(
+                    SessionAnime.session_id == session_id,
+                    SessionAnime.bangumi_id.in_(remove)
+                )]
+                db.execute(table.delete().where(
+                    table.c.session_id == session_id,
+                    table.c.bangumi_id.in_(removed)
+                ))
+
+            added = []
+            if add:
+                existing = {bangumi_id for (bangumi_id,) in db.query(SessionAnime.bangumi_id).filter(
+                    SessionAnime.session_id == session_id,
+                    SessionAnime.bangumi_id.in_(add)
+                )}
+                candidates = [bangumi_id for bangumi_id in add if bangumi_id not in existing]
+                next_position = (db.query(func.max(SessionAnime.position)).filter(
+                    SessionAnime.session_id == session_id
+                ).scalar() or 0) + 1
+                now = datetime.now(timezone.utc)
+                # 并发事务抢先添加的动漫由唯一约束跳过，RETURNING 只返回本事务实际插入的行
+                statement = upsert_statement(db, table).on_conflict_do_nothing(
+                    index_elements=[table.c.session_id, table.c.bangumi_id]
+                ).returning(table.c.bangumi_id)
+                for start in range(0, len(candidates), VotingSessionCRUD.SESSION_ANIME_CHUNK_SIZE):
+                    chunk = candidates[start:start + VotingSessionCRUD.SESSION_ANIME_CHUNK_SIZE]
+                    inserted = set(db.execute(statement.values([
+                        {"session_id": session_id, "bangumi_id": bangumi_id,
+                         "position": next_position + start + offset, "added_at": now}
+                        for offset, bangumi_id in enumerate(chunk)
+                    ])).scalars())
+                    added.extend(bangumi_id for bangumi_id in chunk if bangumi_id in inserted)
+
+            delta = len(added) - len(removed)
+            if added or removed:
+                db.execute(
+                    VotingSession.__table__.update()
+                    .where(VotingSession.id == session_id)
+                    .values(anime_count=VotingSession.anime_count + delta)
+                )
+                VersionCRUD.bump(db, VersionCRUD.session_key(session_id), VersionCRUD.LISTING)
+                invalidation_bus.publish(db, invalidation_bus.SESSION_ANIME, session_id)
             db.commit()
-            db.refresh(session)
-            return session
+            if added or removed:
+                session_anime_cache.pop(session_id)
+            anime_count = db.query(VotingSession.anime_count).filter(VotingSession.id == session_id).scalar()
+            return {"added": added, "removed": removed, "anime_count": anime_count}
         except Exception as e:
             print(f"错误：{e}")
             db.rollback()
-            return None
+            return {"error": "更新会话动漫失败"}
+
+    @staticmethod
+    def get_session_anime(db: Session, session_id: int, limit: int = DEFAULT_PAGE_SIZE, cursor=None):
+        """按添加顺序分页获取会话中的动漫ID，返回 (Bangumi ID 列表, 下一页游标)"""
+        query = db.query(SessionAnime).filter(SessionAnime.session_id == session_id)
+        rows, next_cursor = position_page(query, SessionAnime, limit, cursor)
+        return [row.bangumi_id for row in rows], next_cursor
+
+    @staticmethod
+    def get_session_anime_ids(db: Session, session_id: int) -> list:
+        """会话中全部动漫的ID（按添加顺序）"""
+        return [bangumi_id for (bangumi_id,) in db.query(SessionAnime.bangumi_id).filter(
+            SessionAnime.session_id == session_id
+        ).order_by(SessionAnime.position, SessionAnime.id)]
+
+    @staticmethod
+    def get_allowed_anime(db: Session, session_id: int) -> frozenset:
+        """会话中全部动漫的ID集合（带缓存），用于校验选票"""
+        allowed = session_anime_cache.get(session_id)
+        if allowed is None:
+            allowed = frozenset(bangumi_id for (bangumi_id,) in db.query(SessionAnime.bangumi_id).filter(
+                SessionAnime.session_id == session_id
+            ))
+            session_anime_cache.set(session_id, allowed)
+        return allowed
         
     @staticmethod
     def get_session_by_id(db: Session, session_id: int):
         return db.query(VotingSession).filter(VotingSession.id == session_id).first()
 
+    @staticmethod
+    def list_sessions(db: Session, public_only: bool = False, limit: int = DEFAULT_PAGE_SIZE,
+                      cursor=None, order: str = "desc", master_id: int = None, keyword: str = None):
+        """分页获取投票会话列表，返回 (会话列表, 下一页游标)"""
+        query = db.query(VotingSession)
+        if public_only:
+            query = query.filter(VotingSession.is_public == True)
+        if master_id is not None:
+            query = query.filter(VotingSession.master_id == master_id)
+        if keyword:
+            query = query.filter(VotingSession.title.contains(keyword, autoescape=True))
+        return keyset_page(query, VotingSession, limit, cursor, order)
+
+    @staticmethod
+    def get_sessions_by_master(db: Session, master_id: int, limit: int = DEFAULT_PAGE_SIZE,
+                               cursor=None, order: str = "desc", keyword: str = None):
+        """分页获取某个用户创建的投票会话"""
+        return VotingSessionCRUD.list_sessions(
+            db, limit=limit, cursor=cursor, order=order, master_id=master_id, keyword=keyword
+        )
+
 class VoteCRUD:
     """投票相关操作"""
     
@@ -257,19 +490,12 @@ class VoteCRUD:
             if not session:
                 return {"error": "投票会话不存在"}
             
-            # 检查投票数量限制
-            if not session.allow_multiple_votes and len(voted_anime) > 1:
-                return {"error": "此会话不允许多选"}
-            
-            if len(voted_anime) > session.max_votes_per_user:
-                return {"error": f"最多只能投{session.max_votes_per_user}票"}
-            
-            # 验证投票数据格式
-            for vote in voted_anime:
-                if "anime_id" not in vote or "vote_level" not in vote:
-                    return {"error": "投票数据格式错误"}
-                if vote["vote_level"] not in VOTE_LEVELS:
-                    return {"error": "无效的投票等级"}
+            # 检查投票数量限制和动漫是否属于会话
+            error = VoteCRUD._validate_ballot(
+                session, voted_anime, VotingSessionCRUD.get_allowed_anime(db, session_id)
+            )
+            if error:
+                return {"error": error}
             
             # 检查是否已投过票
             existing_vote = db.query(Vote).filter(
@@ -278,10 +504,19 @@ class VoteCRUD:
             ).first()
             
             if existing_vote:
-                # 修改现有投票
+                # 修改现有投票：计数表只应用新旧选票之间的差值
+                VoteCRUD._apply_tally_delta(
+                    db, session_id,
+                    VoteCRUD._count_ballot(existing_vote.voted_anime),
+                    VoteCRUD._count_ballot(voted_anime),
+                    is_public=session.is_public
+                )
+                VoteCRUD._replace_vote_items(db, session_id, user_id, voted_anime)
                 existing_vote.voted_anime = voted_anime
                 existing_vote.voted_at = datetime.now(timezone.utc)
+                VersionCRUD.bump(db, VersionCRUD.session_key(session_id))
                 db.commit()
+                db.refresh(existing_vote)
                 return existing_vote
             else:
                 # 创建新投票
@@ -291,6 +526,10 @@ class VoteCRUD:
                     voted_anime=voted_anime
                 )
                 db.add(vote)
+                VoteCRUD._apply_tally_delta(db, session_id, Counter(), VoteCRUD._count_ballot(voted_anime),
+                                            is_public=session.is_public)
+                VoteCRUD._replace_vote_items(db, session_id, user_id, voted_anime)
+                VersionCRUD.bump(db, VersionCRUD.session_key(session_id))
                 db.commit()
                 db.refresh(vote)
                 return vote
@@ -299,6 +538,378 @@ class VoteCRUD:
             print(f"错误：{e}")
             db.rollback()
             return {"error": "投票失败"}
+
+    @staticmethod
+    def _validate_ballot(session: VotingSession, voted_anime: list, allowed: frozenset = None):
+        """
+        按会话规则校验一张选票，返回错误信息，合法时返回 None
+        voted_anime 的格式、投票等级和重复项已由 database.Ballot 校验；allowed 为会话中的动漫ID集合
+        """
+        # 检查投票数量限制
+        if not session.allow_multiple_votes and len(voted_anime) > 1:
+            return "此会话不允许多选"
+        
+        if len(voted_anime) > session.max_votes_per_user:
+            return f"最多只能投{session.max_votes_per_user}票"
+        
+        # 检查动漫是否属于会话
+        if allowed is not None and not allowed.issuperset(map(itemgetter("anime_id"), voted_anime)):
+            anime_id = next(item["anime_id"] for item in voted_anime if item["anime_id"] not in allowed)
+            return f"动漫 {anime_id} 不在此会话中"
+        return None
+
+    @staticmethod
+    def _format_error(error: ValidationError) -> str:
+        """把 pydantic 校验错误压缩成一行，如 "voted_anime.0.vote_level: Input should be ..." """
+        detail = error.errors()[0]
+        if not detail["loc"]:
+            # 整行不是对象
+            return f"选票格式错误：{detail['msg']}"
+        location = ".".join(map(str, detail["loc"]))
+        return f"选票格式错误：{location}: {detail['msg']}"
+
+    # 批量导入时每个事务写入的选票数
+    BULK_CHUNK_SIZE = int(os.getenv("BULK_VOTE_CHUNK_SIZE", "5000"))
+
+    @staticmethod
+    def bulk_cast_votes(db: Session, session_id: int, ballots: list):
+        """
+        批量导入选票（线下/纸质投票），ballots 为 [{"user_id": ..., "voted_anime": [...]}]
+        逐行校验格式（database.BulkBallotRow）和会话规则，再按块用 executemany 写入，每块一个事务
+        返回每一行的处理结果：created / updated / error，格式错误的行不影响其他行
+        """
+        session = db.query(VotingSession).filter(VotingSession.id == session_id).first()
+        if not session:
+            return {"error": "投票会话不存在"}
+
+        results = [None] * len(ballots)
+        accepted = {}  # user_id -> 行号
+        allowed = VotingSessionCRUD.get_allowed_anime(db, session_id)
+        ballots = list(ballots)
+        for index, ballot in enumerate(ballots):
+            # 缺少 user_id 或整行不是对象的行同样只让这一行失败
+            user_id = ballot.get("user_id") if isinstance(ballot, dict) else None
+            try:
+                ballots[index] = ballot = bulk_ballot_adapter.validate_python(ballot)
+                error = VoteCRUD._validate_ballot(session, ballot["voted_anime"], allowed)
+            except ValidationError as e:
+                error = VoteCRUD._format_error(e)
+            if error is None and user_id in accepted:
+                error = "同一批次中重复的用户"
+            if error:
+                results[index] = {"index": index, "user_id": user_id, "status": "error", "error": error}
+            else:
+                accepted[user_id] = index
+
+        indexes = list(accepted.values())
+        for start in range(0, len(indexes), VoteCRUD.BULK_CHUNK_SIZE):
+            chunk = indexes[start:start + VoteCRUD.BULK_CHUNK_SIZE]
+            try:
+                VoteCRUD._ingest_chunk(db, session_id, [(index, ballots[index]) for index in chunk], results,
+                                       is_public=session.is_public)
+                db.commit()
+            except Exception as e:
+                print(f"错误：{e}")
+                db.rollback()
+                for index in chunk:
+                    results[index] = {"index": index, "user_id": ballots[index]["user_id"],
+                                      "status": "error", "error": "写入失败"}
+
+        summary = Counter(result["status"] for result in results)
+        return {
+            "created": summary["created"],
+            "updated": summary["updated"],
+            "failed": summary["error"],
+            "results": results
+        }
+
+    @staticmethod
+    def write_ballot_batch(db: Session, ballots: list):
+        """
+        写缓冲使用：在一个事务中写入一批已校验的选票，ballots 为 [(session_id, user_id, voted_anime)]
+        同一用户在同一会话中重复提交时以最后一张为准，返回与输入一一对应的结果（含写入的 vote_id）
+        整批提交失败时逐张重试（见 _write_ballots_one_by_one），只有出错的选票返回错误
+        """
+        results = [None] * len(ballots)
+        latest = {}  # (session_id, user_id) -> 行号
+        for index, (session_id, user_id, _) in enumerate(ballots):
+            latest[(session_id, user_id)] = index
+
+        by_session = defaultdict(list)
+        for (session_id, user_id), index in latest.items():
+            by_session[session_id].append((index, {"user_id": user_id, "voted_anime": ballots[index][2]}))
+
+        try:
+            for session_id, chunk in by_session.items():
+                VoteCRUD._ingest_chunk(db, session_id, chunk, results)
+            db.commit()
+        except Exception as e:
+            print(f"错误：批量写入选票失败，逐张重试：{e}")
+            db.rollback()
+            results = VoteCRUD._write_ballots_one_by_one(db, by_session, len(ballots))
+
+        # 被同批次后提交的选票覆盖的请求，沿用最终那张选票的结果
+        for index, (session_id, user_id, _) in enumerate(ballots):
+            if results[index] is None:
+                results[index] = dict(results[latest[(session_id, user_id)]], index=index)
+        return results
+
+    @staticmethod
+    def _write_ballots_one_by_one(db: Session, by_session: dict, size: int):
+        """
+        整批写入失败后的重试：每张选票一个 SAVEPOINT，出错的选票（如与其他 worker 的唯一约束冲突、
+        用户刚被删除）只回滚自己并返回错误，其余选票仍在一个事务中提交
+        """
+        results = [None] * size
+        for session_id, chunk in by_session.items():
+            for index, ballot in chunk:
+                try:
+                    with db.begin_nested():
+                        VoteCRUD._ingest_chunk(db, session_id, [(index, ballot)], results)
+                except Exception as e:
+                    print(f"错误：写入选票失败（会话{session_id} 用户{ballot['user_id']}）：{e}")
+                    results[index] = {"index": index, "user_id": ballot["user_id"], "status": "error", "error": "投票失败"}
+        try:
+            db.commit()
+        except Exception as e:
+            print(f"错误：{e}")
+            db.rollback()
+            return [{"index": index, "status": "error", "error": "投票失败"} for index in range(size)]
+        return results
+
+    @staticmethod
+    def _ingest_chunk(db: Session, session_id: int, chunk: list, results: list, is_public: bool = None):
+        """
+        写入一块已校验的选票（不提交）：新票批量插入，已有的票批量更新，计数表和明细表一并维护
+        每行结果带上选票的 vote_id；块中每个用户只能出现一次
+        is_public 为会话是否公开，调用方已经查过会话时传入，省去一次查询
+        """
+        user_ids = [ballot["user_id"] for _, ballot in chunk]
+        known_users = {user_id for (user_id,) in db.query(User.id).filter(User.id.in_(user_ids))}
+        existing = {
+            user_id: (vote_id, voted_anime)
+            for vote_id, user_id, voted_anime in db.query(Vote.id, Vote.user_id, Vote.voted_anime).filter(
+                Vote.session_id == session_id,
+                Vote.user_id.in_(user_ids)
+            )
+        }
+
+        now = datetime.now(timezone.utc)
+        inserts, updates, items = [], [], []
+        old_counts, new_counts = Counter(), Counter()
+        for index, ballot in chunk:
+            user_id, voted_anime = ballot["user_id"], ballot["voted_anime"]
+            if user_id not in known_users:
+                results[index] = {"index": index, "user_id": user_id, "status": "error", "error": "用户不存在"}
+                continue
+
+            new_counts.update(VoteCRUD._count_ballot(voted_anime))
+            if user_id in existing:
+                vote_id, previous = existing[user_id]
+                old_counts.update(VoteCRUD._count_ballot(previous))
+                updates.append({"id": vote_id, "voted_anime": voted_anime})
+                results[index] = {"index": index, "user_id": user_id, "status": "updated", "vote_id": vote_id}
+            else:
+                inserts.append({"session_id": session_id, "user_id": user_id,
+                                "voted_anime": voted_anime, "created_at": now})
+                results[index] = {"index": index, "user_id": user_id, "status": "created", "vote_id": None}
+            items.extend(
+                {"session_id": session_id, "user_id": user_id,
+                 "anime_id": int(item["anime_id"]), "vote_level": item["vote_level"]}
+                for item in voted_anime
+            )
+
+        # 直接用 Core 语句 executemany，跳过 ORM 的逐行持久化开销
+        votes_table, items_table = Vote.__table__, VoteItem.__table__
+        if inserts:
+            # RETURNING 取回新选票的 id（SQLAlchemy 把 executemany 改写成多行 INSERT ... RETURNING）
+            created = dict(db.execute(
+                votes_table.insert().returning(votes_table.c.user_id, votes_table.c.id), inserts
+            ).all())
+            for index, ballot in chunk:
+                result = results[index]
+                if result["status"] == "created":
+                    result["vote_id"] = created[ballot["user_id"]]
+        if updates:
+            db.execute(
+                votes_table.update()
+                .where(votes_table.c.id == bindparam("vote_id"))
+                .values(voted_anime=bindparam("new_voted_anime")),
+                [{"vote_id": row["id"], "new_voted_anime": row["voted_anime"]} for row in updates]
+            )
+        VoteCRUD._apply_tally_delta(db, session_id, old_counts, new_counts, is_public=is_public)
+        if inserts or updates:
+            VersionCRUD.bump(db, VersionCRUD.session_key(session_id))
+        if updates:
+            # 只有改票的用户才有旧明细需要删除
+            db.execute(items_table.delete().where(
+                items_table.c.session_id == session_id,
+                items_table.c.user_id.in_([user_id for user_id in user_ids if user_id in existing])
+            ))
+        if items:
+            db.execute(items_table.insert(), items)
+
+    @staticmethod
+    def _count_ballot(voted_anime: list) -> Counter:
+        """把一张选票折算成 (anime_id, vote_level) -> 票数"""
+        return Counter(
+            (int(item["anime_id"]), item["vote_level"])
+            for item in (voted_anime or [])
+        )
+
+    @staticmethod
+    def _apply_tally_delta(db: Session, session_id: int, old: Counter, new: Counter, is_public: bool = None):
+        """
+        把新旧选票的差值写入计数表（不提交，由调用方统一提交）
+        is_public 为空时才查询会话是否公开
+        """
+        delta = Counter(new)
+        delta.subtract(old)
+        delta = {key: n for key, n in delta.items() if n != 0}
+        if not delta:
+            return
+
+        # INSERT ... ON CONFLICT DO UPDATE SET count = count + excluded.count
+        # 由数据库原子地累加，PostgreSQL 上多个连接并发投票也不会丢失更新
+        table = VoteTally.__table__
+        statement = upsert_statement(db, table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.session_id, table.c.anime_id, table.c.vote_level],
+            set_={"count": table.c.count + statement.excluded["count"]}
+        )
+        db.execute(statement, [
+            {"session_id": session_id, "anime_id": anime_id, "vote_level": vote_level, "count": n}
+            for (anime_id, vote_level), n in delta.items()
+        ])
+
+        # 公开会话的票数同时计入全站排行榜
+        if is_public is None:
+            is_public = db.query(VotingSession.is_public).filter(VotingSession.id == session_id).scalar()
+        if is_public:
+            LeaderboardCRUD.apply_delta(db, delta)
+
+    @staticmethod
+    def _replace_vote_items(db: Session, session_id: int, user_id: int, voted_anime: list):
+        """用新选票替换该用户在会话中的选票明细（不提交）"""
+        db.query(VoteItem).filter(
+            VoteItem.session_id == session_id,
+            VoteItem.user_id == user_id
+        ).delete(synchronize_session=False)
+        db.add_all([
+            VoteItem(
+                session_id=session_id,
+                user_id=user_id,
+                anime_id=int(item["anime_id"]),
+                vote_level=item["vote_level"]
+            )
+            for item in voted_anime
+        ])
+
+    @staticmethod
+    def rebuild_vote_tallies(db: Session, session_id: int = None, verify_only: bool = False):
+        """根据 __votes__ 原始选票重算计数表和选票明细表
+        verify_only=True 时只比较不写入，返回不一致的条目，用于校验计数表是否正确
+        """
+        try:
+            votes = db.query(Vote.session_id, Vote.user_id, Vote.voted_anime)
+            tallies = db.query(VoteTally)
+            items = db.query(VoteItem)
+            if session_id is not None:
+                votes = votes.filter(Vote.session_id == session_id)
+                tallies = tallies.filter(VoteTally.session_id == session_id)
+                items = items.filter(VoteItem.session_id == session_id)
+
+            expected = Counter()
+            expected_items = []
+            for vote_session_id, vote_user_id, voted_anime in votes.yield_per(1000):
+                for (anime_id, vote_level), n in VoteCRUD._count_ballot(voted_anime).items():
+                    expected[(vote_session_id, anime_id, vote_level)] += n
+                if not verify_only:
+                    expected_items.extend(
+                        {"session_id": vote_session_id, "user_id": vote_user_id,
+                         "anime_id": int(item["anime_id"]), "vote_level": item["vote_level"]}
+                        for item in voted_anime
+                    )
+
+            stored = {
+                (row.session_id, row.anime_id, row.vote_level): row.count
+                for row in tallies
+            }
+            mismatches = [
+                {
+                    "session_id": key[0],
+                    "anime_id": key[1],
+                    "vote_level": key[2],
+                    "stored": stored.get(key, 0),
+                    "expected": expected.get(key, 0)
+                }
+                for key in sorted(set(expected) | set(stored))
+                if stored.get(key, 0) != expected.get(key, 0)
+            ]
+
+            if not verify_only:
+                # 选票明细总是按原始选票重新生成
+                items.delete(synchronize_session=False)
+                if expected_items:
+                    db.bulk_insert_mappings(VoteItem, expected_items)
+                if mismatches:
+                    tallies.delete(synchronize_session=False)
+                    db.add_all([
+                        VoteTally(session_id=key[0], anime_id=key[1], vote_level=key[2], count=n)
+                        for key, n in expected.items() if n
+                    ])
+                    VersionCRUD.bump(db, *{VersionCRUD.session_key(item["session_id"]) for item in mismatches})
+                db.commit()
+
+            return {"mismatches": mismatches, "rebuilt": not verify_only and bool(mismatches)}
+        except Exception as e:
+            print(f"错误：{e}")
+            db.rollback()
+            return {"error": "重建计数表失败"}
+
+    @staticmethod
+    def get_user_vote_history(db: Session, user_id: int, limit: int = DEFAULT_PAGE_SIZE,
+                              cursor=None, order: str = "desc", session_id: int = None):
+        """分页获取用户的投票记录（附带会话标题），返回 (记录列表, 下一页游标)"""
+        query = db.query(Vote).filter(Vote.user_id == user_id)
+        if session_id is not None:
+            query = query.filter(Vote.session_id == session_id)
+        votes, next_cursor = keyset_page(query, Vote, limit, cursor, order)
+
+        # 一次查出本页涉及的所有会话标题，而不是每张选票查一次会话
+        session_ids = {vote.session_id for vote in votes}
+        titles = dict(
+            db.query(VotingSession.id, VotingSession.title).filter(VotingSession.id.in_(session_ids)).all()
+        ) if session_ids else {}
+
+        vote_history = [
+            {
+                "vote_id": vote.id,
+                "session_id": vote.session_id,
+                "session_title": titles.get(vote.session_id, "未知会话"),
+                "voted_anime": vote.voted_anime,
+                "created_at": vote.created_at.isoformat() if vote.created_at else None
+            }
+            for vote in votes
+        ]
+        return vote_history, next_cursor
+
+    @staticmethod
+    def iter_session_ballots(db: Session, session_id: int, chunk_size: int = 1000):
+        """按块流式读取会话的选票，逐条产出 (vote_id, user_id, voted_anime, created_at)"""
+        query = db.query(Vote.id, Vote.user_id, Vote.voted_anime, Vote.created_at).filter(
+            Vote.session_id == session_id
+        ).order_by(Vote.id)
+        # yield_per 会启用服务端游标，按块取回而不是一次性载入
+        yield from query.yield_per(chunk_size)
+
+    @staticmethod
+    def count_session_votes(db: Session, session_id: int, per_item: bool = False):
+        """统计会话的选票数；per_item=True 时统计选票明细（每个动漫一条）的条数"""
+        if per_item:
+            return db.query(func.count(VoteItem.id)).filter(VoteItem.session_id == session_id).scalar()
+        return db.query(func.count(Vote.id)).filter(Vote.session_id == session_id).scalar()
+
     @staticmethod
     def get_session_votes(db:Session,session_id:int):
         try:
@@ -311,18 +922,56 @@ class VoteCRUD:
             print(f"错误：{e}")
             db.rollback()
             return {"error": "获取投票失败"}
+    # 结果允许的排序字段
+    STATS_SORT_FIELDS = ("total_votes", "total_score", "average_score")
+
     @staticmethod
-    def calculate_session_stats(db: Session, session_id: int):
-        """计算投票会话的详细统计"""
+    def calculate_session_stats(db: Session, session_id: int, top_n: int = None,
+                                min_votes: int = 0, sort_by: str = None, order: str = "desc",
+                                detailed: bool = False):
+        """计算投票会话的详细统计
+        计数由数据库 GROUP BY 完成；top_n / min_votes / sort_by 都下推到 SQL
+        detailed=True 时按等级分布额外计算中位数、标准差和百分位
+        """
         try:
             session = db.query(VotingSession).filter(VotingSession.id == session_id).first()
             if not session:
                 return {"error": "投票会话不存在"}
+            if sort_by is not None and sort_by not in VoteCRUD.STATS_SORT_FIELDS:
+                return {"error": "无效的排序字段"}
             
-            votes = VoteCRUD.get_session_votes(db, session_id)
-            
+            total_voters = db.query(func.count(Vote.id)).filter(Vote.session_id == session_id).scalar()
+
+            # 等级 -> 分数 的 CASE 表达式，让数据库直接算总分
+            level_score = case(
+                {level: info["score"] for level, info in VOTE_LEVELS.items()},
+                value=VoteTally.vote_level,
+                else_=0
+            )
+            total_votes = func.sum(VoteTally.count).label("total_votes")
+            total_score = func.sum(VoteTally.count * level_score).label("total_score")
+            average_score = (cast(func.sum(VoteTally.count * level_score), Float) / func.sum(VoteTally.count)).label("average_score")
+
+            # 每个动漫一行的汇总
+            per_anime = db.query(
+                VoteTally.anime_id, total_votes, total_score, average_score
+            ).filter(
+                VoteTally.session_id == session_id
+            ).group_by(VoteTally.anime_id).having(
+                func.sum(VoteTally.count) > 0
+            )
+            if min_votes:
+                per_anime = per_anime.having(func.sum(VoteTally.count) >= min_votes)
+            if sort_by:
+                column = {"total_votes": total_votes, "total_score": total_score, "average_score": average_score}[sort_by]
+                per_anime = per_anime.order_by(column.asc() if order == "asc" else column.desc(), VoteTally.anime_id)
+            else:
+                per_anime = per_anime.order_by(VoteTally.anime_id)
+            if top_n:
+                per_anime = per_anime.limit(top_n)
+
             stats = {
-                "total_voters": len(votes),
+                "total_voters": total_voters,
                 "anime_stats": {},
                 "overall_stats": {
                     "total_votes": 0,
@@ -330,36 +979,45 @@ class VoteCRUD:
                     "vote_distribution": {level: 0 for level in VOTE_LEVELS}
                 }
             }
-            
-            # 统计计算逻辑
-            for vote in votes:
-                for anime_vote in vote.voted_anime:
-                    bangumi_id = anime_vote["anime_id"]
-                    vote_level = anime_vote["vote_level"]
-                    score = VOTE_LEVELS[vote_level]["score"]
-                    
-                    if bangumi_id not in stats["anime_stats"]:
-                        stats["anime_stats"][bangumi_id] = {
-                            "total_votes": 0,
-                            "total_score": 0,
-                            "vote_distribution": {level: 0 for level in VOTE_LEVELS},
-                            "average_score": 0
-                        }
-                    
-                    stats["anime_stats"][bangumi_id]["total_votes"] += 1
-                    stats["anime_stats"][bangumi_id]["total_score"] += score
-                    stats["anime_stats"][bangumi_id]["vote_distribution"][vote_level] += 1
-                    
-                    stats["overall_stats"]["total_votes"] += 1
-                    stats["overall_stats"]["vote_distribution"][vote_level] += 1
-            
-            # 计算平均分
-            for bangumi_id in stats["anime_stats"]:
-                anime_stat = stats["anime_stats"][bangumi_id]
-                if anime_stat["total_votes"] > 0:
-                    anime_stat["average_score"] = round(
-                        anime_stat["total_score"] / anime_stat["total_votes"], 2
-                    )
+
+            for anime_id, anime_votes, anime_score, anime_average in per_anime.all():
+                stats["anime_stats"][anime_id] = {
+                    "total_votes": anime_votes,
+                    "total_score": anime_score,
+                    "vote_distribution": {level: 0 for level in VOTE_LEVELS},
+                    "average_score": round(anime_average, 2) if anime_votes else 0
+                }
+
+            # 选中动漫的等级分布
+            if stats["anime_stats"]:
+                distribution = db.query(VoteTally.anime_id, VoteTally.vote_level, VoteTally.count).filter(
+                    VoteTally.session_id == session_id,
+                    VoteTally.anime_id.in_(list(stats["anime_stats"]))
+                )
+                for anime_id, vote_level, count in distribution:
+                    if vote_level in VOTE_LEVELS:
+                        stats["anime_stats"][anime_id]["vote_distribution"][vote_level] = count
+
+            # 整个会话的等级分布
+            overall = db.query(VoteTally.vote_level, func.sum(VoteTally.count)).filter(
+                VoteTally.session_id == session_id
+            ).group_by(VoteTally.vote_level)
+            for vote_level, count in overall:
+                if vote_level in VOTE_LEVELS and count:
+                    stats["overall_stats"]["total_votes"] += count
+                    stats["overall_stats"]["vote_distribution"][vote_level] = count
+            overall_votes = stats["overall_stats"]["total_votes"]
+            if overall_votes:
+                overall_score = sum(
+                    VOTE_LEVELS[level]["score"] * count
+                    for level, count in stats["overall_stats"]["vote_distribution"].items()
+                )
+                stats["overall_stats"]["average_score"] = round(overall_score / overall_votes, 2)
+
+            if detailed:
+                entries = list(stats["anime_stats"].values()) + [stats["overall_stats"]]
+                for entry, extra in zip(entries, describe_distributions([e["vote_distribution"] for e in entries])):
+                    entry.update(extra)
             
             return stats
             
@@ -367,6 +1025,370 @@ class VoteCRUD:
             print(f"错误：{e}")
             return {"error": "统计计算失败"}
 
+    @staticmethod
+    def calculate_session_stats_from_ballots(db: Session, session_id: int, top_n: int = None,
+                                             min_votes: int = 0, sort_by: str = None, order: str = "desc",
+                                             detailed: bool = True, chunk_size: int = STATS_CHUNK_SIZE):
+        """直接从 __votes__ 原始选票计算统计（不依赖计数表），结果结构与 calculate_session_stats 相同
+        选票按块流式读取，交给 StatsAccumulator 向量化累加，内存只与动漫数和块大小有关
+        """
+        try:
+            if not db.query(VotingSession.id).filter(VotingSession.id == session_id).first():
+                return {"error": "投票会话不存在"}
+            if sort_by is not None and sort_by not in VoteCRUD.STATS_SORT_FIELDS:
+                return {"error": "无效的排序字段"}
+
+            accumulator = StatsAccumulator()
+            ballots = db.execute(
+                select(Vote.voted_anime).where(Vote.session_id == session_id)
+                .execution_options(yield_per=chunk_size)
+            ).scalars()
+            for chunk in ballots.partitions():
+                accumulator.add_ballots(chunk)
+            return accumulator.stats(top_n=top_n, min_votes=min_votes, sort_by=sort_by,
+                                     order=order, detailed=detailed)
+        except Exception as e:
+            print(f"错误：{e}")
+            return {"error": "统计计算失败"}
+
+class SubjectCRUD:
+    """Bangumi 条目信息缓存表的操作"""
+
+    @staticmethod
+    def get_subjects(db: Session, bangumi_ids: list):
+        """批量读取条目信息，返回 {bangumi_id: AnimeSubject}"""
+        if not bangumi_ids:
+            return {}
+        rows = db.query(AnimeSubject).filter(AnimeSubject.bangumi_id.in_(list(bangumi_ids))).all()
+        return {row.bangumi_id: row for row in rows}
+
+    @staticmethod
+    def upsert_subjects(db: Session, subjects: list):
+        """写入或更新条目信息，subjects 为 Bangumi 返回并整理后的字典列表"""
+        if not subjects:
+            return 0
+        try:
+            existing = SubjectCRUD.get_subjects(db, [item["bangumi_id"] for item in subjects])
+            now = datetime.now(timezone.utc)
+            for item in subjects:
+                row = existing.get(item["bangumi_id"])
+                if row is None:
+                    row = AnimeSubject(bangumi_id=item["bangumi_id"])
+                    db.add(row)
+                    existing[item["bangumi_id"]] = row
+                row.title = item.get("title")
+                row.title_cn = item.get("title_cn")
+                row.image = item.get("image")
+                row.score = item.get("score")
+                row.fetched_at = now
+            VersionCRUD.bump(db, VersionCRUD.SUBJECTS)
+            db.commit()
+            return len(subjects)
+        except Exception as e:
+            print(f"错误：{e}")
+            db.rollback()
+            return 0
+
+
+class LeaderboardCRUD:
+    """
+    全站动漫排行榜：__anime_leaderboard__ 保存每个动漫在公开会话中的累计票数与总分
+    排名使用贝叶斯平均 (C * m + 总分) / (C + 票数)，m 为全站平均分，C 为先验票数，
+    票数很少的动漫会被拉向全站平均分，不会因为一两张高分票排到前面
+    - 分数存在 bayesian_score 列（有索引）：投票时按存下的 m 随票数一起更新，
+      排行榜分页和名次查询都只读索引区间，与动漫数无关
+    - m 记在 __data_versions__ 中（全站票数和总分两行），投票不更新它（否则所有投票都要争同一行）；
+      后台每 REFRESH_SECONDS 秒算一次实际的全站平均分，与存下的 m 相差超过 PRIOR_DRIFT 时重算全部分数
+    """
+    # 先验票数 C：票数远少于 C 的动漫排名主要取决于全站平均分
+    PRIOR_VOTES = float(os.getenv("LEADERBOARD_PRIOR_VOTES", "10"))
+    # 全站平均分变化超过这个值才重算全部动漫的分数
+    PRIOR_DRIFT = float(os.getenv("LEADERBOARD_PRIOR_DRIFT", "0.01"))
+    # 后台检查全站平均分的间隔（秒）
+    REFRESH_SECONDS = float(os.getenv("LEADERBOARD_REFRESH_SECONDS", "60"))
+    # 计算分数所用的全站票数和总分，存在 __data_versions__ 中
+    PRIOR_VOTES_KEY = "leaderboard:prior_votes"
+    PRIOR_SCORE_KEY = "leaderboard:prior_score"
+    # 排行榜 ETag 的时间片（秒）：投票不递增全站共用的 leaderboard 版本号（那一行会让所有会话的投票事务
+    # 在行锁上串行），排行榜的 ETag 由版本号和时间片组成，投票最多这么久之后出现在排行榜中
+    ETAG_SECONDS = float(os.getenv("LEADERBOARD_ETAG_SECONDS", "2"))
+
+    @staticmethod
+    def etag_epoch() -> int:
+        """当前时间片的序号，各 worker 相同"""
+        return int(time.time() // LeaderboardCRUD.ETAG_SECONDS)
+
+    @staticmethod
+    def apply_delta(db: Session, delta: dict):
+        """
+        把 {(anime_id, vote_level): 票数变化} 计入排行榜（不提交），按存下的全站平均分同时更新分数
+        不递增版本号，见 ETAG_SECONDS
+        """
+        votes, scores = Counter(), Counter()
+        for (anime_id, vote_level), n in delta.items():
+            votes[anime_id] += n
+            scores[anime_id] += n * VOTE_LEVELS.get(vote_level, {}).get("score", 0)
+        mean = LeaderboardCRUD._prior_mean(db)
+        table = LeaderboardEntry.__table__
+        statement = upsert_statement(db, table)
+        total_votes = table.c.total_votes + statement.excluded["total_votes"]
+        total_score = table.c.total_score + statement.excluded["total_score"]
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.anime_id],
+            set_={
+                "total_votes": total_votes,
+                "total_score": total_score,
+                "bayesian_score": LeaderboardCRUD._score_expression(mean, total_votes, total_score)
+            }
+        )
+        db.execute(statement, [
+            {"anime_id": anime_id, "total_votes": votes[anime_id], "total_score": scores[anime_id],
+             "bayesian_score": LeaderboardCRUD._score(mean, votes[anime_id], scores[anime_id])}
+            for anime_id in votes
+        ])
+
+    @staticmethod
+    def _score(mean: float, votes: int, score: int):
+        """一个动漫的贝叶斯平均分，没有票数时为 None"""
+        if votes <= 0:
+            return None
+        prior = LeaderboardCRUD.PRIOR_VOTES
+        return (prior * mean + score) / (prior + votes)
+
+    @staticmethod
+    def _score_expression(mean: float, votes, score):
+        """与 _score 相同的 SQL 表达式，votes、score 为列或列的表达式"""
+        prior = LeaderboardCRUD.PRIOR_VOTES
+        return case((votes > 0, (prior * mean + cast(score, Float)) / (prior + votes)), else_=None)
+
+    @staticmethod
+    def _prior_mean(db: Session) -> float:
+        """计算分数所用的全站平均分 m"""
+        votes, score = VersionCRUD.get_versions(db, LeaderboardCRUD.PRIOR_VOTES_KEY, LeaderboardCRUD.PRIOR_SCORE_KEY)
+        return score / votes if votes else 0.0
+
+    @staticmethod
+    def _prior(mean: float):
+        return {"mean": round(mean, 4), "votes": LeaderboardCRUD.PRIOR_VOTES}
+
+    @staticmethod
+    def _entry(row, rank: int):
+        return {
+            "rank": rank,
+            "anime_id": row.anime_id,
+            "total_votes": row.total_votes,
+            "total_score": row.total_score,
+            "average_score": round(row.total_score / row.total_votes, 2),
+            "bayesian_score": round(row.bayesian_score, 4)
+        }
+
+    @staticmethod
+    def get_leaderboard(db: Session, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0):
+        """按贝叶斯平均分排序的排行榜，offset 为从第几名之后开始；按 ix_anime_leaderboard_score_id 的顺序读取"""
+        ranked = LeaderboardEntry.bayesian_score.is_not(None)
+        total = db.query(func.count(LeaderboardEntry.anime_id)).filter(ranked).scalar()
+        rows = db.query(LeaderboardEntry).filter(ranked).order_by(
+            LeaderboardEntry.bayesian_score.desc(), LeaderboardEntry.anime_id
+        ).offset(offset).limit(limit).all()
+        return {
+            "prior": LeaderboardCRUD._prior(LeaderboardCRUD._prior_mean(db)),
+            "total": total,
+            "entries": [LeaderboardCRUD._entry(row, offset + index + 1) for index, row in enumerate(rows)]
+        }
+
+    @staticmethod
+    def get_anime_rank(db: Session, anime_id: int):
+        """查询单个动漫的排名：名次 = 分数更高的动漫数 + 同分时 ID 更小的动漫数 + 1，两次索引区间计数"""
+        row = db.query(LeaderboardEntry).filter(
+            LeaderboardEntry.anime_id == anime_id,
+            LeaderboardEntry.bayesian_score.is_not(None)
+        ).first()
+        if row is None:
+            return {"error": "该动漫暂无排名"}
+        higher = db.query(func.count(LeaderboardEntry.anime_id)).filter(
+            LeaderboardEntry.bayesian_score > row.bayesian_score
+        ).scalar()
+        tied = db.query(func.count(LeaderboardEntry.anime_id)).filter(
+            LeaderboardEntry.bayesian_score == row.bayesian_score,
+            LeaderboardEntry.anime_id < anime_id
+        ).scalar()
+        return {"prior": LeaderboardCRUD._prior(LeaderboardCRUD._prior_mean(db)),
+                **LeaderboardCRUD._entry(row, higher + tied + 1)}
+
+    @staticmethod
+    def _recompute_scores(db: Session, votes: int, score: int):
+        """按全站票数和总分重算全部分数并存下（不提交）"""
+        mean = score / votes if votes else 0.0
+        table = LeaderboardEntry.__table__
+        db.execute(table.update().values(
+            bayesian_score=LeaderboardCRUD._score_expression(mean, table.c.total_votes, table.c.total_score)
+        ))
+        VersionCRUD.set(db, {LeaderboardCRUD.PRIOR_VOTES_KEY: votes, LeaderboardCRUD.PRIOR_SCORE_KEY: score})
+        VersionCRUD.bump(db, VersionCRUD.LEADERBOARD)
+
+    @staticmethod
+    def refresh_scores(db: Session, force: bool = False):
+        """
+        后台定期调用：实际的全站平均分与存下的相差超过 PRIOR_DRIFT（或 force）时重算全部分数
+        返回是否重算，失败时返回 None；这里是排行榜唯一读取整张表的地方，表大小为动漫数
+        """
+        try:
+            votes, score = db.query(
+                func.sum(LeaderboardEntry.total_votes), func.sum(LeaderboardEntry.total_score)
+            ).filter(LeaderboardEntry.total_votes > 0).one()
+            votes, score = votes or 0, score or 0
+            mean = score / votes if votes else 0.0
+            if not force and abs(mean - LeaderboardCRUD._prior_mean(db)) < LeaderboardCRUD.PRIOR_DRIFT:
+                return False
+            LeaderboardCRUD._recompute_scores(db, votes, score)
+            db.commit()
+            return True
+        except Exception as e:
+            print(f"错误：{e}")
+            db.rollback()
+            return None
+
+    @staticmethod
+    def rebuild_leaderboard(db: Session):
+        """根据公开会话的计数表重算排行榜，返回写入的动漫数"""
+        try:
+            level_score = case(
+                {level: info["score"] for level, info in VOTE_LEVELS.items()},
+                value=VoteTally.vote_level,
+                else_=0
+            )
+            rows = db.query(
+                VoteTally.anime_id, func.sum(VoteTally.count), func.sum(VoteTally.count * level_score)
+            ).join(VotingSession, VotingSession.id == VoteTally.session_id).filter(
+                VotingSession.is_public == True
+            ).group_by(VoteTally.anime_id).all()
+            entries = [
+                {"anime_id": anime_id, "total_votes": votes, "total_score": score}
+                for anime_id, votes, score in rows if votes
+            ]
+            db.query(LeaderboardEntry).delete(synchronize_session=False)
+            if entries:
+                db.execute(LeaderboardEntry.__table__.insert(), entries)
+            LeaderboardCRUD._recompute_scores(
+                db, sum(entry["total_votes"] for entry in entries), sum(entry["total_score"] for entry in entries)
+            )
+            db.commit()
+            return len(entries)
+        except Exception as e:
+            print(f"错误：{e}")
+            db.rollback()
+            return None
+
+
+class VersionCRUD:
+    """
+    数据版本号：写操作调用 bump 在同一事务内递增（不提交），读接口用 get_versions 生成 ETag
+    版本号存放在数据库中，多个 worker 进程看到的是同一个值
+    """
+    LISTING = "sessions"    # 会话列表（创建会话、添加动漫）
+    SUBJECTS = "subjects"   # Bangumi 条目信息
+    LEADERBOARD = "leaderboard"  # 全站排行榜（只在重建和重算分数时递增，投票见 LeaderboardCRUD.ETAG_SECONDS）
+
+    @staticmethod
+    def session_key(session_id: int) -> str:
+        """单个会话（详情、投票结果）的版本号名称"""
+        return f"session:{session_id}"
+
+    @staticmethod
+    def bump(db: Session, *names: str):
+        """把这些版本号各加一，不存在时从 1 开始"""
+        if not names:
+            return
+        table = DataVersion.__table__
+        statement = upsert_statement(db, table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.name],
+            set_={"version": table.c.version + 1}
+        )
+        db.execute(statement, [{"name": name, "version": 1} for name in names])
+
+    @staticmethod
+    def set(db: Session, values: dict):
+        """直接写入 {名称: 整数值}（不提交），用于存放不是版本号的全局计数，如排行榜的全站平均分"""
+        table = DataVersion.__table__
+        statement = upsert_statement(db, table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.name],
+            set_={"version": statement.excluded["version"]}
+        )
+        db.execute(statement, [{"name": name, "version": value} for name, value in values.items()])
+
+    @staticmethod
+    def get_versions(db: Session, *names: str) -> tuple:
+        """按参数顺序返回版本号，从未写入过的为 0"""
+        rows = dict(db.query(DataVersion.name, DataVersion.version).filter(DataVersion.name.in_(names)))
+        return tuple(rows.get(name, 0) for name in names)
+
+
+class AsyncCRUD:
+    """
+    CRUD 类的异步版本：AsyncVoteCRUD.cast_vote(db, ...) 与 VoteCRUD.cast_vote(db, ...) 参数相同，
+    通过 database.run_db 执行，db 既可以是 AsyncSession 也可以是 Session，都不会阻塞事件循环
+    """
+
+    def __init__(self, crud):
+        self._crud = crud
+
+    def __getattr__(self, name):
+        fn = getattr(self._crud, name)
+
+        async def method(db, *args, **kwargs):
+            return await run_db(db, fn, *args, **kwargs)
+
+        method.__name__ = name
+        method.__doc__ = fn.__doc__
+        return method
+
+
+class _AsyncUserCRUD(AsyncCRUD):
+    """
+    UserCRUD 的异步版本：bcrypt 计算放到 security 的哈希线程池中，
+    数据库操作仍通过 run_db 执行，两者都不占用事件循环
+    哈希队列已满时抛出 PasswordHashBusy
+    """
+
+    async def register_user(self, db, user_data: UserRegister):
+        if await self.get_user_by_username(db, user_data.username):
+            return None
+        hashed_password = await PasswordUtils.hash_password_async(user_data.password)
+        return await run_db(db, UserCRUD.register_user, user_data, hashed_password)
+
+    async def authenticate_user(self, db, username: str, password: str):
+        user = await self.get_user_by_username(db, username)
+        if not user:
+            return None
+        valid, new_hash = await PasswordUtils.verify_and_update_async(password, user.password_hash)
+        if not valid:
+            return None
+        if new_hash:
+            await run_db(db, UserCRUD.set_password_hash, user, new_hash)
+        return user
+
+    async def change_password(self, db, user_id: int, old_password: str, new_password: str):
+        user = await self.get_user_by_id(db, user_id)
+        if not user:
+            return {"error": "用户不存在"}
+        if not await PasswordUtils.verify_password_async(old_password, user.password_hash):
+            return {"error": "旧密码错误"}
+        password_hash = await PasswordUtils.hash_password_async(new_password)
+        if not await run_db(db, UserCRUD.set_password_hash, user, password_hash):
+            return {"error": "密码修改失败"}
+        print(f"✅ 用户 {user.username} 密码修改成功")
+        return {"message": "密码修改成功"}
+
+
+AsyncUserCRUD = _AsyncUserCRUD(UserCRUD)
+AsyncVotingSessionCRUD = AsyncCRUD(VotingSessionCRUD)
+AsyncVoteCRUD = AsyncCRUD(VoteCRUD)
+AsyncSubjectCRUD = AsyncCRUD(SubjectCRUD)
+AsyncVersionCRUD = AsyncCRUD(VersionCRUD)
+AsyncLeaderboardCRUD = AsyncCRUD(LeaderboardCRUD)
+
 #get_db() 函数
 #     ↓ (生产)
 #Session 对象
@@ -378,4 +1400,43 @@ class VoteCRUD:
 #业务逻辑处理
 
 #get_db()函数专门用来管理session
-#CRUD使用get_db()创建的seesion进行业务逻辑操作
\ No newline at end of file
+#CRUD使用get_db()创建的seesion进行业务逻辑操作
+
+
+if __name__ == "__main__":
+    # 重建/校验投票计数表：python crud.py [--verify] [--session ID]
+    # 从原始选票计算会话统计：python crud.py --stats --session ID
+    import argparse
+    import json
+    from database import SessionLocal, create_tables
+
+    parser = argparse.ArgumentParser(description="根据原始选票重建投票计数表")
+    parser.add_argument("--session", type=int, default=None, help="只处理指定会话")
+    parser.add_argument("--verify", action="store_true", help="只校验，不写入")
+    parser.add_argument("--stats", action="store_true", help="从原始选票计算会话统计并输出 JSON（需要 --session）")
+    args = parser.parse_args()
+    if args.stats and args.session is None:
+        parser.error("--stats 需要 --session")
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        if args.stats:
+            print(json.dumps(VoteCRUD.calculate_session_stats_from_ballots(db, args.session),
+                             ensure_ascii=False, indent=2))
+        else:
+            result = VoteCRUD.rebuild_vote_tallies(db, args.session, verify_only=args.verify)
+            if "error" in result:
+                print(f"❌ {result['error']}")
+            else:
+                for item in result["mismatches"]:
+                    print(f"会话{item['session_id']} 动漫{item['anime_id']} {item['vote_level']}: "
+                          f"计数表={item['stored']} 实际={item['expected']}")
+                print(f"✅ 不一致条目 {len(result['mismatches'])} 个，"
+                      f"{'已重建' if result['rebuilt'] else '未写入'}")
+            if not args.verify:
+                # 排行榜由公开会话的计数表汇总而来，计数表重建后一并重算
+                count = LeaderboardCRUD.rebuild_leaderboard(db)
+                print(f"✅ 全站排行榜已重算，共 {count} 个动漫" if count is not None else "❌ 重算排行榜失败")
+    finally:
+        db.close()
\ No newline at end of file
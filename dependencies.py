@@ -1,11 +1,17 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
-from database import get_db,User
+from database import get_db,User,release_db
 from security import PasswordUtils
-from crud import UserCRUD
+from crud import AsyncUserCRUD, UserCRUD
+from cache import TTLCache
+from metrics import register_cache
+from invalidation import invalidation_bus
+import os
+import time
 
 security = HTTPBearer()
+
 # HTTPBearer 来自 fastapi.security.http 模块（如果你使用的是FastAPI框架）或者类似的安全工具。它用于在API请求中检查Authorization头，确保其包含一个Bearer Token。
 
 # 当你在代码中写下 security = HTTPBearer()，你创建了一个安全依赖项，它可以用在FastAPI的路由中来自动验证请求的授权头。
@@ -14,6 +20,34 @@ security = HTTPBearer()
 
 # 如果令牌存在且格式正确，那么该令牌会被提取出来，并可以在视图函数中作为参数使用。
 
+# 令牌缓存：token -> (username, user_id)，省去每次请求的 JWT 解码；条目不会比令牌的 exp 活得更久
+token_cache = TTLCache(
+    maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("TOKEN_CACHE_TTL", "300"))
+)
+# 用户缓存：user_id -> 用户行数据，省去每次请求按ID查用户；TTL 较短
+user_cache = TTLCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "30"))
+)
+register_cache("token", token_cache)
+register_cache("user", user_cache)
+
+def invalidate_user(user_id: int):
+    """用户角色、资料变化或被删除后，清除该用户的令牌缓存和用户缓存"""
+    user_cache.pop(user_id)
+    token_cache.discard_if(lambda principal: principal[1] == user_id)
+
+def _on_user_invalidated(key):
+    """失效总线上的用户事件（可能来自其他 worker），key 为 None 时清空全部"""
+    if key is None:
+        user_cache.clear()
+        token_cache.clear()
+    else:
+        invalidate_user(int(key))
+
+invalidation_bus.subscribe(invalidation_bus.USER, _on_user_invalidated)
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     # credentials: 变量名，用于接收认证信息
@@ -25,36 +59,63 @@ async def get_current_user(
 ):
     """获取当前用户依赖项"""
     token = credentials.credentials
-    payload = PasswordUtils.verify_token(token)
+    principal = token_cache.get(token)
     
-    if payload is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="无效的令牌",
-            headers={"WWW-Authenticate": "Bearer"}
-        )
-    # status_code: 使用HTTP状态码401表示未授权。
-    # detail: 错误详情，这里用中文表示"无效的令牌"。
-    # headers: 设置了一个WWW-Authenticate头部，值为"Bearer"，这告诉客户端应该使用Bearer令牌认证方式。
+    if principal is None:
+        payload = PasswordUtils.verify_token(token)
+        
+        if payload is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="无效的令牌",
+                headers={"WWW-Authenticate": "Bearer"}
+            )
+        # status_code: 使用HTTP状态码401表示未授权。
+        # detail: 错误详情，这里用中文表示"无效的令牌"。
+        # headers: 设置了一个WWW-Authenticate头部，值为"Bearer"，这告诉客户端应该使用Bearer令牌认证方式。
+        
+        username: str = payload.get("sub")
+        user_id: int = payload.get("user_id")
+        
+        if username is None or user_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="无效的令牌数据"
+            )
+        
+        principal = (username, user_id)
+        # 缓存时间不超过令牌剩余有效期
+        ttl = min(token_cache.ttl, payload.get("exp", 0) - time.time())
+        if ttl > 0:
+            token_cache.set(token, principal, ttl=ttl)
     
-    username: str = payload.get("sub")
-    user_id: int = payload.get("user_id")
+    username, user_id = principal
     
-    if username is None or user_id is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="无效的令牌数据"
-        )
+    cached_user = user_cache.get(user_id)
+    if cached_user is not None:
+        return await AsyncUserCRUD.attach_cached_user(db, cached_user)
     
-    user = UserCRUD.get_user_by_id(db, user_id)
+    user = await AsyncUserCRUD.get_user_by_id(db, user_id)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="用户不存在"
         )
+    user_cache.set(user_id, UserCRUD.to_cache(user))
     
     return user
 
+async def get_streaming_user(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    流式响应用的当前用户：鉴权后立即归还请求会话的数据库连接
+    yield 依赖要等响应流结束才清理，否则每个长连接都会一直占着连接池中的一个连接
+    """
+    await release_db(db)
+    return current_user
+
 # 添加管理员权限
 async def get_current_admin(current_user:User =Depends(get_current_user)):
     """检查当前用户是否为管理员"""
@@ -0,0 +1,63 @@
+import hashlib
+import os
+
+from fastapi import Request, Response
+
+from cache import TTLCache
+from metrics import register_cache
+from serialization import JSON, encode, negotiate
+
+# 按 ETag 缓存序列化后的响应体；版本号变化后旧条目不再被访问，由 LRU 淘汰
+ETAG_CACHE_SIZE = int(os.getenv("ETAG_CACHE_SIZE", "1024"))
+ETAG_CACHE_TTL = int(os.getenv("ETAG_CACHE_TTL", "300"))
+
+response_cache = TTLCache(maxsize=ETAG_CACHE_SIZE, ttl=ETAG_CACHE_TTL)
+register_cache("etag_response", response_cache)
+
+
+def make_etag(request: Request, versions: tuple, media_type: str = JSON) -> str:
+    """
+    由请求路径、查询参数、数据版本号和响应格式生成强 ETag：版本号不变，响应体就不变
+    同一数据的 JSON 和 msgpack 表示使用不同的 ETag
+    """
+    query = "&".join(sorted(f"{key}={value}" for key, value in request.query_params.multi_items()))
+    raw = f"{request.url.path}?{query}|{','.join(map(str, versions))}|{media_type}"
+    return '"' + hashlib.blake2b(raw.encode(), digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str, exists: bool = False) -> bool:
+    """
+    检查 If-None-Match 是否包含当前 ETag
+    "*" 表示"资源存在即可"，只有 exists=True（已确认资源存在）时才算命中；
+    ETag 只由版本号生成，不存在的会话也有 ETag
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return exists
+    # 忽略弱校验前缀 W/，按弱比较处理 If-None-Match
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+async def conditional_json(request: Request, versions: tuple, build):
+    """
+    带 ETag 的 JSON 响应（Accept 要求 application/msgpack 时返回 msgpack）
+    - If-None-Match 命中时直接返回 304，不查询、不序列化
+    - 否则优先使用同一 ETag 缓存的响应体，没有时才调用 build() 生成并序列化
+    - If-None-Match: * 要等拿到响应体（缓存命中或 build() 成功，资源不存在时 build() 抛出 404）之后才返回 304
+    versions 必须在 build() 之前读取，这样缓存的响应体不会比 ETag 代表的版本更旧
+    """
+    media_type = negotiate(request)
+    etag = make_etag(request, versions, media_type)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    body = response_cache.get(etag)
+    if body is None:
+        body = encode(await build(), media_type)
+        response_cache.set(etag, body)
+    if etag_matches(request, etag, exists=True):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
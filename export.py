@@ -0,0 +1,108 @@
+import csv
+import io
+import os
+import zlib
+
+import msgpack
+import orjson
+
+from database import SessionLocal, VOTE_LEVELS
+from crud import VoteCRUD
+
+# 每次从数据库取出的选票数，同时也是每个输出块包含的选票数
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+CSV_COLUMNS = ["vote_id", "user_id", "anime_id", "vote_level", "score", "created_at"]
+
+
+def _csv_chunks(ballots):
+    """每张选票的每个动漫输出一行 CSV"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    rows = 0
+    for vote_id, user_id, voted_anime, created_at in ballots:
+        created = created_at.isoformat() if created_at else ""
+        for item in voted_anime or []:
+            level = item.get("vote_level")
+            writer.writerow([
+                vote_id, user_id, item.get("anime_id"), level,
+                VOTE_LEVELS.get(level, {}).get("score", ""), created
+            ])
+        rows += 1
+        if rows % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _ballot_records(ballots):
+    for vote_id, user_id, voted_anime, created_at in ballots:
+        yield {
+            "vote_id": vote_id,
+            "user_id": user_id,
+            "voted_anime": voted_anime,
+            "created_at": created_at.isoformat() if created_at else None
+        }
+
+
+def _ndjson_chunks(ballots):
+    """每张选票输出一行 JSON"""
+    lines = []
+    for record in _ballot_records(ballots):
+        lines.append(orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE))
+        if len(lines) >= EXPORT_CHUNK_SIZE:
+            yield b"".join(lines)
+            lines = []
+    if lines:
+        yield b"".join(lines)
+
+
+def _msgpack_chunks(ballots):
+    """每张选票一个 msgpack 对象，依次拼接（客户端用 msgpack.Unpacker 逐个读取）"""
+    packer = msgpack.Packer(use_bin_type=True, autoreset=False)
+    rows = 0
+    for record in _ballot_records(ballots):
+        packer.pack(record)
+        rows += 1
+        if rows % EXPORT_CHUNK_SIZE == 0:
+            yield packer.bytes()
+            packer.reset()
+    if rows % EXPORT_CHUNK_SIZE:
+        yield packer.bytes()
+
+
+def _gzip_chunks(chunks):
+    """边生成边压缩成 gzip 格式"""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# 导出格式 -> (生成器, 媒体类型)
+EXPORT_FORMATS = {
+    "csv": (_csv_chunks, "text/csv"),
+    "ndjson": (_ndjson_chunks, "application/x-ndjson"),
+    "msgpack": (_msgpack_chunks, "application/msgpack"),
+}
+
+
+def stream_session_ballots(session_id: int, fmt: str = "csv", compress: bool = False):
+    """
+    流式导出会话的全部选票（同步生成器，由 StreamingResponse 放到线程池中迭代）
+    使用独立的数据库会话并按块读取，内存占用与选票总数无关
+    """
+    db = SessionLocal()
+    try:
+        ballots = VoteCRUD.iter_session_ballots(db, session_id, EXPORT_CHUNK_SIZE)
+        chunks = EXPORT_FORMATS[fmt][0](ballots)
+        if compress:
+            chunks = _gzip_chunks(chunks)
+        yield from chunks
+    finally:
+        db.close()
@@ -0,0 +1,222 @@
+"""
+跨 worker 的缓存失效总线
+
+多个 uvicorn worker 各自持有进程内缓存（用户、令牌、会话可投的动漫），一个 worker 处理的写操作
+要让其他 worker 的缓存也失效：
+- 写操作在自己的事务中调用 invalidation_bus.publish(db, entity, key)，向 __invalidations__ 追加一行，
+  与数据一起提交或回滚；同时立即在本进程内分发一次，本进程不必等轮询
+- 每个 worker 的后台任务每 INVALIDATION_POLL_MS 毫秒读取 id 大于已处理位置的新事件，
+  调用该 entity 的订阅函数清除本进程的条目。事件 id 单调递增，是总线的版本号
+- id 在插入时分配、提交顺序却可能不同（PostgreSQL 上并发事务的 id 较小的可能后提交）：
+  读到的新事件之间缺少的 id 记为"缺口"，之后每次轮询连同缺口一起查询，直到它们出现，
+  或超过 INVALIDATION_GAP_SECONDS 仍未出现（视为事务已回滚）。SQLite 的写事务串行，不会有缺口
+- SQLite 上先读 PRAGMA data_version：只有其他连接提交过事务时它才会变化，没有写入时轮询不查表
+- 提交后最迟一个轮询间隔（加一次查询的耗时）所有 worker 都已清除对应条目，这就是缓存旧数据的上限
+- 事件保留 INVALIDATION_RETENTION_SECONDS 秒后清理；某个 worker 超过这个时间没有读到事件
+  （可能漏掉了已清理的事件）时，清空全部订阅的缓存，订阅函数收到 key=None
+投票结果的 ETag 响应缓存和实时推送按数据库中的版本号（crud.VersionCRUD）判断新旧，本身就是跨进程一致的，
+不经过这条总线
+"""
+import asyncio
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, delete, func, or_, select
+from sqlalchemy.pool import StaticPool
+
+from database import SQLALCHEMY_DATABASE_URL, Invalidation, engine_options
+from metrics import cache_invalidations
+
+# 读取失效事件的间隔（毫秒），即其他 worker 的写操作之后缓存最多旧多久
+INVALIDATION_POLL_MS = int(os.getenv("INVALIDATION_POLL_MS", "250"))
+# 失效事件保留多久（秒）
+INVALIDATION_RETENTION_SECONDS = int(os.getenv("INVALIDATION_RETENTION_SECONDS", "3600"))
+# 每隔多久（秒）清理一次过期的失效事件
+INVALIDATION_PRUNE_SECONDS = int(os.getenv("INVALIDATION_PRUNE_SECONDS", "60"))
+# 缺少的 id 最多等多久（秒）：应长于最长的写事务
+INVALIDATION_GAP_SECONDS = int(os.getenv("INVALIDATION_GAP_SECONDS", "300"))
+# 最多同时跟踪多少个缺口，超过后清空全部订阅的缓存、不再逐个等待
+INVALIDATION_MAX_GAPS = int(os.getenv("INVALIDATION_MAX_GAPS", "1000"))
+
+
+class InvalidationBus:
+    """按 entity 分发的缓存失效事件；key 是实体的ID（字符串），None 表示清空该 entity 的全部缓存"""
+    USER = "user"                    # 用户角色、密码、用户名变化或被删除
+    SESSION_ANIME = "session_anime"  # 会话中的动漫增删
+
+    def __init__(self, url: str = SQLALCHEMY_DATABASE_URL, poll_ms: int = INVALIDATION_POLL_MS):
+        self.url = url
+        self.interval = poll_ms / 1000
+        self._handlers = defaultdict(list)
+        self._engine = None
+        # 读取在单独的线程中进行，请求把默认线程池占满时也能按时轮询
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="invalidation")
+        self._task = None
+        self._data_version = None
+        self._last_read = None
+        self._last_prune = 0.0
+        self.last_id = None
+        self._gaps = {}  # 尚未出现的 id -> 发现缺口的时间
+        # id 顺序是否就是提交顺序：SQLite 的写事务串行，是；其他数据库要跟踪缺口
+        self._commit_ordered = None
+        self.received = Counter()
+        self.full_clears = 0
+
+    def subscribe(self, entity: str, handler):
+        """登记 entity 的失效处理函数 handler(key)"""
+        self._handlers[entity].append(handler)
+
+    def publish(self, db, entity: str, *keys):
+        """在 db 的当前事务中追加失效事件（不提交），并立即清除本进程中的条目"""
+        if not keys:
+            return
+        db.add_all([Invalidation(entity=entity, key=str(key)) for key in keys])
+        for key in keys:
+            self._dispatch(entity, str(key))
+
+    def _dispatch(self, entity: str, key):
+        for handler in self._handlers.get(entity, ()):
+            handler(key)
+
+    def _connect(self):
+        if self._engine is None:
+            # 独立的单连接引擎：不占用请求的连接池；PRAGMA data_version 要一直在同一个连接上读取
+            self._engine = create_engine(
+                self.url, poolclass=StaticPool,
+                connect_args=engine_options(self.url).get("connect_args", {})
+            )
+        return self._engine.connect()
+
+    def _read(self) -> list:
+        """读取新的失效事件，返回 [(entity, key)]；漏掉过事件时返回每个 entity 的 (entity, None)"""
+        table = Invalidation.__table__
+        now = time.monotonic()
+        with self._connect() as connection:
+            if self._commit_ordered is None:
+                self._commit_ordered = connection.dialect.name == "sqlite"
+            if connection.dialect.name == "sqlite":
+                data_version = connection.exec_driver_sql("PRAGMA data_version").scalar()
+                unchanged = data_version == self._data_version
+                self._data_version = data_version
+                if unchanged and self.last_id is not None:
+                    self._last_read = now
+                    return []
+
+            if self.last_id is None:
+                # 启动时从最新的事件开始：本进程的缓存还是空的
+                self._restart(connection, now)
+                events = []
+            elif now - self._last_read >= INVALIDATION_RETENTION_SECONDS:
+                self._restart(connection, now)
+                events = self._clear_all()
+            else:
+                condition = table.c.id > self.last_id
+                if self._gaps:
+                    condition = or_(condition, table.c.id.in_(list(self._gaps)))
+                rows = connection.execute(
+                    select(table.c.id, table.c.entity, table.c.key).where(condition).order_by(table.c.id)
+                ).all()
+                events = [(row.entity, row.key) for row in rows]
+                if self._commit_ordered:
+                    self.last_id = max((row.id for row in rows), default=self.last_id)
+                else:
+                    self._track_gaps([row.id for row in rows], now)
+                if len(self._gaps) > INVALIDATION_MAX_GAPS:
+                    self._gaps.clear()
+                    events = self._clear_all()
+            self._last_read = now
+
+            if now - self._last_prune >= INVALIDATION_PRUNE_SECONDS:
+                self._last_prune = now
+                try:
+                    connection.execute(delete(table).where(
+                        table.c.created_at < datetime.now(timezone.utc) - timedelta(seconds=INVALIDATION_RETENTION_SECONDS)
+                    ))
+                    connection.commit()
+                except Exception as e:
+                    connection.rollback()
+                    print(f"错误：清理缓存失效事件失败：{e}")
+        return events
+
+    def _restart(self, connection, now: float):
+        """
+        从当前最新的事件开始读取；id 不按提交顺序时，最近一段 id 中缺少的可能是还没提交的事务，记为缺口
+        早于 INVALIDATION_GAP_SECONDS 的事件之前分配的 id 不再等待（与缺口过期的规则一致，也跳过已清理的事件）
+        """
+        table = Invalidation.__table__
+        self.last_id = connection.execute(select(func.max(table.c.id))).scalar() or 0
+        self._gaps = {}
+        if self._commit_ordered:
+            return
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=INVALIDATION_GAP_SECONDS)
+        floor = connection.execute(select(func.max(table.c.id)).where(table.c.created_at < cutoff)).scalar()
+        if floor is None:
+            floor = (connection.execute(select(func.min(table.c.id))).scalar() or 1) - 1
+        floor = max(floor, self.last_id - INVALIDATION_MAX_GAPS)
+        present = set(connection.execute(select(table.c.id).where(table.c.id > floor)).scalars())
+        self._gaps = {missing: now for missing in range(floor + 1, self.last_id) if missing not in present}
+
+    def _track_gaps(self, ids: list, now: float):
+        """更新已处理位置和缺口：出现的 id 移出缺口，新事件之间缺少的 id 加入缺口，过期的缺口丢弃"""
+        for event_id in ids:
+            self._gaps.pop(event_id, None)
+        new_ids = {event_id for event_id in ids if event_id > self.last_id}
+        if new_ids:
+            newest = max(new_ids)
+            for missing in range(self.last_id + 1, newest):
+                if missing not in new_ids:
+                    self._gaps[missing] = now
+            self.last_id = newest
+        expired = [event_id for event_id, since in self._gaps.items() if now - since >= INVALIDATION_GAP_SECONDS]
+        for event_id in expired:
+            del self._gaps[event_id]
+
+    def _clear_all(self) -> list:
+        """可能漏掉了事件：让每个 entity 的订阅函数清空全部缓存"""
+        self.full_clears += 1
+        return [(entity, None) for entity in self._handlers]
+
+    async def poll(self):
+        """读取并分发一次新的失效事件，返回事件数"""
+        events = await asyncio.get_running_loop().run_in_executor(self._executor, self._read)
+        for entity, key in events:
+            self.received[entity] += 1
+            cache_invalidations.inc(entity)
+            self._dispatch(entity, key)
+        return len(events)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                print(f"错误：读取缓存失效事件失败：{e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.last_id is None:
+            # 开始处理请求之前同步记下当前位置：此后提交的事件都不会漏掉
+            self._read()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        """已处理到的事件 id、各 entity 收到的事件数和整体清空次数"""
+        return {
+            "last_id": self.last_id,
+            "pending_gaps": len(self._gaps),
+            "poll_ms": round(self.interval * 1000),
+            "received": dict(self.received),
+            "full_clears": self.full_clears
+        }
+
+
+invalidation_bus = InvalidationBus()
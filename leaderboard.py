@@ -0,0 +1,38 @@
+"""
+排行榜分数的后台重算：投票只按存下的全站平均分更新各动漫的分数，
+这里每 LEADERBOARD_REFRESH_SECONDS 秒检查一次全站平均分，漂移超过 LEADERBOARD_PRIOR_DRIFT 时重算全部分数
+多个 worker 各自检查；重算幂等，同时重算也只是多写一次
+"""
+import asyncio
+
+from crud import LeaderboardCRUD
+from database import run_db_task
+
+
+class LeaderboardRefresher:
+    def __init__(self, interval: float = LeaderboardCRUD.REFRESH_SECONDS):
+        self.interval = interval
+        self._task = None
+        self.refreshes = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            # 启动时各动漫的分数已是最新（由投票增量维护），先等一个间隔
+            await asyncio.sleep(self.interval)
+            try:
+                if await run_db_task(LeaderboardCRUD.refresh_scores):
+                    self.refreshes += 1
+            except Exception as e:
+                print(f"错误：重算排行榜分数失败：{e}")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+leaderboard_refresher = LeaderboardRefresher()
@@ -0,0 +1,191 @@
+import asyncio
+import os
+
+from crud import VoteCRUD, VersionCRUD
+from database import run_db_task
+from query_trace import untraced
+from serialization import dumps_json
+
+# 每个会话的推送间隔（毫秒）：同一间隔内的多次投票合并成一条消息
+LIVE_TICK_MS = int(os.getenv("LIVE_TICK_MS", "500"))
+# 每个订阅者最多积压的消息数，超过后丢弃积压、改发最新快照
+LIVE_SUBSCRIBER_QUEUE = int(os.getenv("LIVE_SUBSCRIBER_QUEUE", "16"))
+# 没有新消息时发送 SSE 注释保持连接的间隔（秒）
+LIVE_KEEPALIVE_SECONDS = float(os.getenv("LIVE_KEEPALIVE_SECONDS", "15"))
+
+
+def _poll_session(db, session_id: int, last_version: int):
+    """读取会话版本号，有变化时才重新计算统计结果；返回 (版本号, 统计结果或 None)"""
+    (version,) = VersionCRUD.get_versions(db, VersionCRUD.session_key(session_id))
+    if version == last_version:
+        return version, None
+    return version, VoteCRUD.calculate_session_stats(db, session_id)
+
+
+def format_event(event: str, data: dict) -> str:
+    """序列化成一条 SSE 消息"""
+    return f"event: {event}\ndata: {dumps_json(data).decode()}\n\n"
+
+
+class Subscriber:
+    """一个订阅连接：有界队列，慢消费者只会收到最新快照"""
+
+    def __init__(self, publisher):
+        self.publisher = publisher
+        self.queue = asyncio.Queue(maxsize=LIVE_SUBSCRIBER_QUEUE)
+        self.dropped = 0
+
+    def push(self, message: str, snapshot):
+        """投递一条增量消息；队列已满时清空积压，改为投递 snapshot() 生成的完整快照"""
+        if not self.queue.full():
+            self.queue.put_nowait(message)
+            return
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(snapshot())
+
+
+class SessionPublisher:
+    """
+    单个会话的推送任务：每个间隔读取一次版本号，有变化时计算一次统计结果、序列化一次，
+    再把同一条消息分发给所有订阅者。无论多少客户端订阅，数据库查询次数都不变
+    """
+
+    def __init__(self, session_id: int, tick: float):
+        self.session_id = session_id
+        self.tick = tick
+        self.subscribers = set()
+        self.version = None
+        self.stats = None
+        self.computations = 0
+        self.messages = 0
+        self._snapshot = None
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def snapshot(self) -> str:
+        """当前完整结果的快照消息（同一版本只序列化一次）"""
+        if self._snapshot is None:
+            self._snapshot = format_event("snapshot", {
+                "session_id": self.session_id,
+                "version": self.version,
+                "stats": self.stats
+            })
+        return self._snapshot
+
+    async def add(self, subscriber: Subscriber):
+        # 大量客户端同时订阅时只查询一次初始结果
+        async with self._lock:
+            if self.stats is None:
+                await self._refresh()
+        self.subscribers.add(subscriber)
+        subscriber.push(self.snapshot(), self.snapshot)
+        if self._task is None or self._task.done():
+            # 第一个订阅请求启动的推送任务会比这个请求活得更久
+            self._task = asyncio.create_task(untraced(self._run()))
+
+    def discard(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    async def _refresh(self):
+        """重新读取统计结果，返回变化的动漫（首次读取时返回 None）"""
+        version, stats = await run_db_task(_poll_session, self.session_id, self.version)
+        if stats is None or "error" in stats:
+            return None
+        previous = self.stats
+        self.version, self.stats = version, stats
+        self._snapshot = None
+        self.computations += 1
+        if previous is None:
+            return None
+        old, new = previous["anime_stats"], stats["anime_stats"]
+        changed = {anime_id: item for anime_id, item in new.items() if old.get(anime_id) != item}
+        # 票数减为 0 的动漫不再出现在统计结果中，用 null 通知前端移除
+        changed.update({anime_id: None for anime_id in old if anime_id not in new})
+        return changed
+
+    async def _run(self):
+        while self.subscribers:
+            await asyncio.sleep(self.tick)
+            try:
+                changed = await self._refresh()
+            except Exception as e:
+                print(f"错误：刷新会话 {self.session_id} 的实时结果失败：{e}")
+                continue
+            if not changed:
+                continue
+            message = format_event("delta", {
+                "session_id": self.session_id,
+                "version": self.version,
+                "total_voters": self.stats["total_voters"],
+                "anime": changed
+            })
+            self.messages += 1
+            for subscriber in list(self.subscribers):
+                subscriber.push(message, self.snapshot)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class LiveHub:
+    """按会话管理推送任务：第一个订阅者到来时启动，最后一个离开后停止"""
+
+    def __init__(self, tick_ms: int = LIVE_TICK_MS):
+        self.tick = tick_ms / 1000
+        self.publishers = {}
+
+    async def subscribe(self, session_id: int) -> Subscriber:
+        publisher = self.publishers.get(session_id)
+        if publisher is None:
+            publisher = self.publishers[session_id] = SessionPublisher(session_id, self.tick)
+        subscriber = Subscriber(publisher)
+        await publisher.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        publisher = subscriber.publisher
+        publisher.discard(subscriber)
+        if not publisher.subscribers:
+            publisher.stop()
+            if self.publishers.get(publisher.session_id) is publisher:
+                del self.publishers[publisher.session_id]
+
+    async def events(self, session_id: int):
+        """SSE 消息流：先发送完整快照，之后只发送变化的动漫"""
+        subscriber = await self.subscribe(session_id)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber.queue.get(), LIVE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stop(self):
+        for publisher in self.publishers.values():
+            publisher.stop()
+        self.publishers.clear()
+
+    def stats(self):
+        """每个会话的订阅数、统计计算次数和推送消息数"""
+        return {
+            "tick_ms": int(self.tick * 1000),
+            "sessions": {
+                session_id: {
+                    "subscribers": len(publisher.subscribers),
+                    "version": publisher.version,
+                    "computations": publisher.computations,
+                    "messages": publisher.messages,
+                    "dropped": sum(subscriber.dropped for subscriber in publisher.subscribers)
+                }
+                for session_id, publisher in self.publishers.items()
+            }
+        }
+
+
+live_hub = LiveHub()
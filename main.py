@@ -1,4 +1,4 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 from database import create_tables
@@ -6,7 +6,14 @@ from auth import router as auth_router
 from protected_voting import router as voting_router  
 from admin_api import router as admin_router
 from user_profile import router as user_router
-from search import router as search_router
+from search import router as search_router, close_http_session
+from vote_writer import vote_buffer
+from live import live_hub
+from query_trace import QueryTraceMiddleware
+from metrics import MetricsMiddleware, collect_snapshots, merge_snapshots, render, snapshot_writer
+from serialization import FastJSONResponse
+from invalidation import invalidation_bus
+from leaderboard import leaderboard_refresher
 
 # 创建数据库表
 create_tables()
@@ -15,7 +22,9 @@ create_tables()
 app = FastAPI(
     title="动漫投票系统",
     description="一个基于FastAPI和html的动漫投票系统",
-    version="1.0.0"
+    version="1.0.0",
+    # 返回 dict 的接口用 orjson 序列化
+    default_response_class=FastJSONResponse
 )
 
 # 添加CORS中间件
@@ -26,6 +35,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 把每条 SQL 归到当前请求：慢查询日志、N+1 检测、调试响应头
+app.add_middleware(QueryTraceMiddleware)
+# 按路由记录请求数、状态码和耗时，最外层添加，耗时包含其他中间件
+app.add_middleware(MetricsMiddleware)
 
 # 注册路由
 app.include_router(auth_router)
@@ -34,6 +47,28 @@ app.include_router(admin_router)
 app.include_router(user_router)
 app.include_router(search_router)
 
+@app.on_event("startup")
+async def startup():
+    # 多 worker 部署时定期写出本进程的指标快照（见 metrics.py）
+    snapshot_writer.start()
+    # 读取其他 worker 发布的缓存失效事件（见 invalidation.py）
+    invalidation_bus.start()
+    # 全站平均分漂移后重算排行榜分数（见 leaderboard.py）
+    leaderboard_refresher.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    # 关闭与 Bangumi 共享的 HTTP 连接池
+    await close_http_session()
+    # 写完缓冲中剩余的选票
+    await vote_buffer.stop()
+    # 停止实时结果推送任务
+    live_hub.stop()
+    # 写出最终的指标快照
+    snapshot_writer.stop()
+    invalidation_bus.stop()
+    leaderboard_refresher.stop()
+
 @app.get("/")
 async def root():
     return {"message": "欢迎使用动漫投票系统 API"}
@@ -42,5 +77,13 @@ async def root():
 async def health_check():
     return {"status": "healthy", "message": "服务运行正常"}
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus 文本格式的指标；设置了 METRICS_DIR 时合并所有 worker"""
+    return Response(
+        content=render(merge_snapshots(collect_snapshots())),
+        media_type="text/plain; version=0.0.4"
+    )
+
 
 
@@ -0,0 +1,356 @@
+"""
+Prometheus 文本格式的运行指标
+
+所有指标都只在本进程内累加，更新发生在事件循环线程上（中间件和路由函数），不需要加锁。
+多个 uvicorn worker 时，一次抓取只会落到其中一个 worker 上，因此需要汇总：
+    METRICS_DIR=/run/anime-voting-metrics uvicorn main:app --workers 4
+设置 METRICS_DIR 后，每个 worker 每隔 METRICS_FLUSH_SECONDS 秒把自己的指标快照写到
+METRICS_DIR/metrics-<pid>.json；/metrics 读取目录下所有快照后合并输出：
+计数器和直方图求和（已退出的 worker 也计入，保证计数单调），仪表只合并仍在运行的 worker。
+目录在每次部署启动前应清空。
+"""
+import asyncio
+import bisect
+import glob
+import json
+import os
+import time
+
+# 多 worker 汇总目录，为空时 /metrics 只输出本进程的指标
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+# 每个 worker 写出指标快照的间隔（秒）
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+# 请求耗时直方图的桶上界（秒）
+LATENCY_BUCKETS = tuple(float(bound) for bound in os.getenv(
+    "METRICS_LATENCY_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10"
+).split(","))
+
+# 没有匹配到任何路由的请求（404 等）统一记在这个标签下，避免路径参数撑爆标签数
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class Metric:
+    """一个指标族：名称、说明、标签名，以及 标签值元组 -> 值"""
+    type = None
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def samples(self):
+        return [[list(labels), value] for labels, value in self.values.items()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def set(self, *labels, value: float):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    """累计直方图；每组标签的值为 [各桶计数（不累计，最后一个是 +Inf）, 总和, 次数]"""
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        item = self.values.get(labels)
+        if item is None:
+            item = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        item[0][bisect.bisect_left(self.buckets, value)] += 1
+        item[1] += value
+        item[2] += 1
+
+
+class Registry:
+    """
+    指标注册表
+    - 直接更新的指标在 register 时登记
+    - 缓存等已有自己统计的对象通过 collector 在生成快照时读取，不在热路径上多做一次累加
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def snapshot(self) -> dict:
+        """本进程所有指标的可 JSON 序列化快照"""
+        for collect in self.collectors:
+            collect()
+        return {
+            "pid": os.getpid(),
+            "metrics": {
+                metric.name: {
+                    "type": metric.type,
+                    "help": metric.help,
+                    "labelnames": list(metric.labelnames),
+                    "buckets": list(getattr(metric, "buckets", ())),
+                    "samples": metric.samples()
+                }
+                for metric in self.metrics
+            }
+        }
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP 请求数", ("method", "route", "status"))
+http_latency = registry.histogram(
+    "http_request_duration_seconds", "HTTP 请求耗时（到响应发送完毕，SSE 为连接时长）", ("method", "route"))
+http_in_progress = registry.gauge(
+    "http_requests_in_progress", "正在处理的 HTTP 请求数", ("method",))
+
+votes_cast = registry.counter(
+    "anime_voting_votes_cast_total", "成功写入的选票数", ("mode",))
+sessions_created = registry.counter(
+    "anime_voting_sessions_created_total", "创建的投票会话数")
+bangumi_requests = registry.counter(
+    "anime_voting_bangumi_requests_total", "对 Bangumi API 发出的请求数", ("endpoint", "outcome"))
+sql_queries = registry.counter(
+    "anime_voting_sql_queries_total", "请求中执行的 SQL 语句数", ("method", "route"))
+sql_duration = registry.counter(
+    "anime_voting_sql_duration_seconds_total", "请求中执行 SQL 语句的总耗时", ("method", "route"))
+sql_repeated = registry.counter(
+    "anime_voting_sql_repeated_statements_total", "请求中疑似 N+1 的语句数（同一语句重复执行达到阈值）", ("method", "route"))
+cache_lookups = registry.counter(
+    "anime_voting_cache_lookups_total", "进程内缓存的查询次数", ("cache", "result"))
+cache_entries = registry.gauge(
+    "anime_voting_cache_entries", "进程内缓存当前的条目数", ("cache",))
+admission_rejected = registry.counter(
+    "anime_voting_admission_rejected_total", "准入控制拒绝的请求数（503）", ("route_class", "reason"))
+admission_queue_depth = registry.gauge(
+    "anime_voting_admission_queue_depth", "准入控制中排队等待的请求数", ("route_class",))
+admission_active = registry.gauge(
+    "anime_voting_admission_active", "准入控制中正在处理的请求数", ("route_class",))
+rate_limited = registry.counter(
+    "anime_voting_rate_limited_total", "被令牌桶限流拒绝的请求数（429）", ("limiter",))
+rate_limit_keys = registry.gauge(
+    "anime_voting_rate_limit_keys", "令牌桶当前保存的键数", ("limiter",))
+cache_invalidations = registry.counter(
+    "anime_voting_cache_invalidations_total", "从失效总线收到的缓存失效事件数（key 为 * 表示整体清空）", ("entity",))
+
+
+def register_cache(name: str, cache):
+    """登记一个 TTLCache，抓取时读取它的命中/未命中次数和条目数"""
+    def collect():
+        cache_lookups.values[(name, "hit")] = cache.hits
+        cache_lookups.values[(name, "stale")] = cache.stale_hits
+        cache_lookups.values[(name, "miss")] = cache.misses
+        cache_entries.set(name, value=len(cache))
+
+    registry.collectors.append(collect)
+
+
+class MetricsMiddleware:
+    """
+    记录每个请求的路由、状态码和耗时的 ASGI 中间件
+    路由标签使用路由模板（如 /api/voting/sessions/{session_id}），而不是实际路径
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_progress.inc(method)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_progress.dec(method)
+            route = scope.get("route")
+            route = route.path if route is not None else UNMATCHED_ROUTE
+            http_requests.inc(method, route, str(status))
+            http_latency.observe(time.perf_counter() - start, method, route)
+
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"metrics-{pid}.json")
+
+
+def write_snapshot():
+    """把本进程的指标快照写入 METRICS_DIR（先写临时文件再改名，读取方不会读到半个文件）"""
+    path = _snapshot_path(os.getpid())
+    with open(path + ".tmp", "w") as f:
+        json.dump(registry.snapshot(), f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merge_snapshots(snapshots: list) -> dict:
+    """合并多个 worker 的快照：计数器和直方图求和，仪表只合并仍在运行的 worker"""
+    merged = {}
+    for snapshot in snapshots:
+        alive = snapshot["pid"] == os.getpid() or _pid_alive(snapshot["pid"])
+        for name, family in snapshot["metrics"].items():
+            if family["type"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(name, {**family, "samples": {}})
+            for labels, value in family["samples"]:
+                key = tuple(labels)
+                current = target["samples"].get(key)
+                if current is None:
+                    target["samples"][key] = value
+                elif family["type"] == "histogram":
+                    target["samples"][key] = [
+                        [a + b for a, b in zip(current[0], value[0])],
+                        current[1] + value[1],
+                        current[2] + value[2]
+                    ]
+                else:
+                    target["samples"][key] = current + value
+    return merged
+
+
+def collect_snapshots() -> list:
+    """本进程的最新快照，加上 METRICS_DIR 中其他 worker 最近一次写出的快照"""
+    own = registry.snapshot()
+    if not METRICS_DIR:
+        return [own]
+    snapshots = [own]
+    for path in glob.glob(os.path.join(METRICS_DIR, "metrics-*.json")):
+        if path == _snapshot_path(own["pid"]):
+            continue
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            # 正在被替换或已损坏的快照跳过，下次抓取再读
+            continue
+    return snapshots
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(merged: dict) -> str:
+    """输出 Prometheus 文本格式（0.0.4）"""
+    lines = []
+    for name, family in merged.items():
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        labelnames = family["labelnames"]
+        for labels, value in sorted(family["samples"].items()):
+            if family["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket in zip(family["buckets"] + ["+Inf"], counts):
+                cumulative += bucket
+                le = 'le="' + (bound if bound == "+Inf" else _format_value(bound)) + '"'
+                lines.append(f"{name}_bucket{_format_labels(labelnames, labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labelnames, labels)} {count}")
+
+    # 命中率由合并后的查询次数计算，多 worker 时才是整体的命中率
+    lookups = merged.get(cache_lookups.name, {}).get("samples", {})
+    caches = sorted({labels[0] for labels in lookups})
+    if caches:
+        lines.append("# HELP anime_voting_cache_hit_ratio 进程内缓存命中率（含过期后返回的旧数据）")
+        lines.append("# TYPE anime_voting_cache_hit_ratio gauge")
+        for cache in caches:
+            hits = lookups.get((cache, "hit"), 0) + lookups.get((cache, "stale"), 0)
+            total = hits + lookups.get((cache, "miss"), 0)
+            lines.append(f'anime_voting_cache_hit_ratio{{cache="{cache}"}} {round(hits / total, 4) if total else 0}')
+    return "\n".join(lines) + "\n"
+
+
+class SnapshotWriter:
+    """设置了 METRICS_DIR 时，定期把本进程的快照写入目录"""
+
+    def __init__(self, interval: float = METRICS_FLUSH_SECONDS):
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if METRICS_DIR and (self._task is None or self._task.done()):
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                write_snapshot()
+            except OSError as e:
+                print(f"错误：写入指标快照失败：{e}")
+            await asyncio.sleep(self.interval)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if METRICS_DIR:
+            # 退出前写出最终的计数，已退出 worker 的计数器仍会计入汇总
+            try:
+                write_snapshot()
+            except OSError as e:
+                print(f"错误：写入指标快照失败：{e}")
+
+
+snapshot_writer = SnapshotWriter()
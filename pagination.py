@@ -0,0 +1,117 @@
+import base64
+import json
+import os
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException, Query, status
+from sqlalchemy import and_, or_
+
+# 每页默认条数与上限
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "20"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "100"))
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """把 (created_at, id) 编码成不透明的游标字符串"""
+    raw = json.dumps([created_at.isoformat() if created_at else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """解析游标，格式错误时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return (datetime.fromisoformat(created_at) if created_at else None, int(row_id))
+    except Exception as e:
+        raise ValueError("无效的分页游标") from e
+
+
+def encode_position_cursor(position: int, row_id: int) -> str:
+    """把 (position, id) 编码成游标字符串，用于按添加顺序排列的列表"""
+    raw = json.dumps([position, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_position_cursor(cursor: str):
+    """解析 encode_position_cursor 生成的游标，格式错误时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return int(position), int(row_id)
+    except Exception as e:
+        raise ValueError("无效的分页游标") from e
+
+
+class PageParams:
+    """
+    分页查询参数（作为路由依赖使用）
+    limit：每页条数；cursor：上一页返回的 next_cursor；order：按创建时间排序的方向
+    """
+
+    def __init__(
+        self,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="每页条数"),
+        cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+        order: str = Query("desc", pattern="^(asc|desc)$", description="按创建时间排序的方向")
+    ):
+        self.limit = limit
+        self.order = order
+        try:
+            self.cursor = decode_cursor(cursor) if cursor else None
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="无效的分页游标"
+            )
+
+
+def keyset_page(query, model, limit: int, cursor=None, order: str = "desc"):
+    """
+    按 (created_at, id) 做游标分页，返回 (当前页数据, 下一页游标)
+    不使用 OFFSET，翻到多深都只扫描一页的数据（需要 (过滤列, created_at, id) 索引）
+    """
+    created_at, row_id = model.created_at, model.id
+    if cursor is not None:
+        cursor_created_at, cursor_id = cursor
+        if order == "asc":
+            query = query.filter(or_(
+                created_at > cursor_created_at,
+                and_(created_at == cursor_created_at, row_id > cursor_id)
+            ))
+        else:
+            query = query.filter(or_(
+                created_at < cursor_created_at,
+                and_(created_at == cursor_created_at, row_id < cursor_id)
+            ))
+
+    if order == "asc":
+        query = query.order_by(created_at.asc(), row_id.asc())
+    else:
+        query = query.order_by(created_at.desc(), row_id.desc())
+
+    # 多取一条，用来判断是否还有下一页
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return rows[:limit], next_cursor
+
+
+def position_page(query, model, limit: int, cursor=None):
+    """按 (position, id) 升序做游标分页，返回 (当前页数据, 下一页游标)"""
+    position, row_id = model.position, model.id
+    if cursor is not None:
+        cursor_position, cursor_id = cursor
+        query = query.filter(or_(
+            position > cursor_position,
+            and_(position == cursor_position, row_id > cursor_id)
+        ))
+    rows = query.order_by(position.asc(), row_id.asc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_position_cursor(last.position, last.id)
+    return rows[:limit], next_cursor
@@ -1,14 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
-from database import get_db, User,SessionCreate,AddAnime,CastVote
-from dependencies import get_current_user,require_ownership
-from crud import VotingSessionCRUD, VoteCRUD
-from fastapi.responses import JSONResponse
+from database import get_db, run_db_task, User,SessionCreate,AddAnime,SessionAnimeUpdate,CastVote,BulkVotes
+from dependencies import get_current_user,get_streaming_user,require_ownership
+from crud import AsyncVotingSessionCRUD, AsyncVoteCRUD, AsyncVersionCRUD, AsyncLeaderboardCRUD, LeaderboardCRUD, VotingSessionCRUD, VoteCRUD, VersionCRUD
+from fastapi.responses import JSONResponse, StreamingResponse
+from subjects import get_subjects, schedule_refresh
+from pagination import PageParams, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_position_cursor
+from export import EXPORT_FORMATS, stream_session_ballots
+from vote_writer import VOTE_WRITE_BUFFER, VoteBufferFull, vote_buffer
+from etag import conditional_json
+from serialization import MSGPACK, negotiate
+from live import live_hub
+from metrics import votes_cast, sessions_created
+from admission import admission_stats, limit_vote, vote_gate
+import os
 
 router = APIRouter(prefix="/api/voting", tags=["投票功能"])
 
+# 单次批量导入的选票数上限
+MAX_BULK_BALLOTS = int(os.getenv("MAX_BULK_BALLOTS", "100000"))
+# 单次批量添加/移除的动漫数上限
+MAX_BULK_ANIME = int(os.getenv("MAX_BULK_ANIME", "1000"))
+
 @router.post("/sessions")
 async def create_voting_session(
     # title: str,
@@ -21,7 +36,7 @@ async def create_voting_session(
     db: Session = Depends(get_db)
 ):
     """创建投票会话（需要登录）"""
-    session = VotingSessionCRUD.create_session(
+    session = await AsyncVotingSessionCRUD.create_session(
         db=db,
         title=sessiondata.title,
         master_id=current_user.id,
@@ -36,7 +51,8 @@ async def create_voting_session(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="创建会话失败"
         )
-    
+
+    sessions_created.inc()
     return {
         "message": "投票会话创建成功",
         "session_id": session.id,
@@ -52,8 +68,7 @@ async def add_anime_to_session(
 ):
     """向投票会话添加动漫（需要登录）"""
     # 首先检查会话是否存在且用户有权操作
-    from database import VotingSession
-    session = db.query(VotingSession).filter(VotingSession.id == data.session_id).first()
+    session = await AsyncVotingSessionCRUD.get_session_by_id(db, data.session_id)
     
     if not session:
         raise HTTPException(
@@ -70,7 +85,7 @@ async def add_anime_to_session(
     
      
     # 传递仅包含 bangumi_id 的数据
-    result = VotingSessionCRUD.add_anime_to_session(
+    result = await AsyncVotingSessionCRUD.add_anime_to_session(
         db, 
         data.session_id, 
         {"bangumi_id": data.bangumi_id}
@@ -83,84 +98,198 @@ async def add_anime_to_session(
             detail=error_msg
         )
     
+    # 预先在后台拉取条目信息，第一次查看详情时就不用再等 Bangumi
+    schedule_refresh([data.bangumi_id])
+    
     return {
         "message": "动漫添加成功",
         "session_id": data.session_id,
         "bangumi_id": data.bangumi_id
     }
 
+@router.post("/sessions/{session_id}/anime/bulk")
+async def update_session_anime(
+    session_id: int,
+    data: SessionAnimeUpdate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """批量添加/移除会话中的动漫（仅会话创建者或管理员），在一个事务中完成"""
+    if len(data.add) + len(data.remove) > MAX_BULK_ANIME:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"单次最多添加或移除{MAX_BULK_ANIME}个动漫"
+        )
+    
+    session = await AsyncVotingSessionCRUD.get_session_by_id(db, session_id)
+    
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="投票会话不存在"
+        )
+    
+    if session.master_id != current_user.id and current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="无权修改此会话的动漫"
+        )
+    
+    result = await AsyncVotingSessionCRUD.update_session_anime(db, session_id, add=data.add, remove=data.remove)
+    
+    if "error" in result:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=result["error"]
+        )
+    
+    schedule_refresh(result["added"])
+    
+    return {"session_id": session_id, **result}
+
 @router.get("/sessions/public")
 async def get_voting_sessions(
+    request: Request,
     public_only: bool = True,
+    keyword: Optional[str] = Query(None, description="按标题筛选"),
+    page: PageParams = Depends(),
     db: Session = Depends(get_db)
 ):
-    """获取投票会话列表（公开访问）"""
-    from database import VotingSession
-    
-    query = db.query(VotingSession)
+    """获取投票会话列表（公开访问，游标分页，支持 If-None-Match）"""
+    versions = await AsyncVersionCRUD.get_versions(db, VersionCRUD.LISTING)
     
-    if public_only:
-        query = query.filter(VotingSession.is_public == True)
-    
-    sessions = query.all()
+    async def build():
+        sessions, next_cursor = await AsyncVotingSessionCRUD.list_sessions(
+            db, public_only,
+            limit=page.limit,
+            cursor=page.cursor,
+            order=page.order,
+            keyword=keyword
+        )
+        
+        return {
+            "sessions": [
+                {
+                    "id": session.id,
+                    "title": session.title,
+                    "description": session.description,
+                    "is_public": session.is_public,
+                    "anime_count": session.anime_count,
+                    "created_at": session.created_at.isoformat() if session.created_at else None
+                }
+                for session in sessions
+            ],
+            "next_cursor": next_cursor
+        }
     
-    return {
-        "sessions": [
-            {
-                "id": session.id,
-                "title": session.title,
-                "description": session.description,
-                "is_public": session.is_public,
-                "anime_count": len(session.anime_list) if session.anime_list else 0,
-                "created_at": session.created_at.isoformat() if session.created_at else None
-            }
-            for session in sessions
-        ]
-    }
+    return await conditional_json(request, versions, build)
 
 @router.get("/sessions/{session_id}")
 async def get_session_detail(
+    request: Request,
     session_id: int,
+    enrich: bool = Query(False, description="是否附带动漫标题、封面和评分"),
+    anime_limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="每页返回的动漫数"),
+    anime_cursor: Optional[str] = Query(None, description="上一页返回的 next_anime_cursor"),
     db: Session = Depends(get_db)
 ):
-    """获取投票会话详情（公开访问）"""
-    from database import VotingSession
-    
-    session = db.query(VotingSession).filter(VotingSession.id == session_id).first()
-    
-    if not session:
+    """获取投票会话详情（公开访问，动漫按添加顺序游标分页，支持 If-None-Match）"""
+    try:
+        cursor = decode_position_cursor(anime_cursor) if anime_cursor else None
+    except ValueError:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="投票会话不存在"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="无效的分页游标"
         )
+    names = [VersionCRUD.session_key(session_id)] + ([VersionCRUD.SUBJECTS] if enrich else [])
+    versions = await AsyncVersionCRUD.get_versions(db, *names)
     
-    if not session.is_public:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="此会话不公开"
+    async def build():
+        session = await AsyncVotingSessionCRUD.get_session_by_id(db, session_id)
+        
+        if not session:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="投票会话不存在"
+            )
+        
+        if not session.is_public:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="此会话不公开"
+            )
+        
+        bangumi_ids, next_anime_cursor = await AsyncVotingSessionCRUD.get_session_anime(
+            db, session_id, limit=anime_limit, cursor=cursor
         )
-    
-    return {
-        "session": {
+        detail = {
             "id": session.id,
             "title": session.title,
             "description": session.description,
             "is_public": session.is_public,
             "allow_multiple_votes": session.allow_multiple_votes,
             "max_votes_per_user": session.max_votes_per_user,
-            "bangumi_ids": session.anime_list or [],  # 明确返回的是ID列表
+            "anime_count": session.anime_count,
+            "bangumi_ids": bangumi_ids,  # 当前页的动漫ID
+            "next_anime_cursor": next_anime_cursor,
             "created_at": session.created_at.isoformat() if session.created_at else None
         }
-    }
+        
+        if enrich:
+            # 从本地条目缓存附带动漫信息，前端无需再逐个请求 Bangumi
+            subjects = await get_subjects(db, detail["bangumi_ids"])
+            detail["anime"] = [
+                subjects.get(bangumi_id, {"bangumi_id": bangumi_id})
+                for bangumi_id in detail["bangumi_ids"]
+            ]
+        
+        return {"session": detail}
+    
+    return await conditional_json(request, versions, build)
 
-@router.post("/sessions/{session_id}/vote")
+@router.post("/sessions/{session_id}/vote", dependencies=[Depends(vote_gate), Depends(limit_vote)])
 async def cast_vote(
     data:CastVote,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """进行投票（需要登录）"""
-    result = VoteCRUD.cast_vote(
+    if VOTE_WRITE_BUFFER:
+        # 写缓冲模式：先在请求内校验，再交给唯一的写入任务合并提交
+        session = await AsyncVotingSessionCRUD.get_session_by_id(db, data.session_id)
+        if not session:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="投票会话不存在"
+            )
+        allowed = await AsyncVotingSessionCRUD.get_allowed_anime(db, data.session_id)
+        error = VoteCRUD._validate_ballot(session, data.voted_anime, allowed)
+        if error:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=error
+            )
+        try:
+            result = await vote_buffer.submit(data.session_id, current_user.id, data.voted_anime)
+        except VoteBufferFull:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="投票人数过多，请稍后重试",
+                headers={"Retry-After": "1"}
+            )
+        if result["status"] == "error":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=result["error"]
+            )
+        votes_cast.inc("buffered")
+        return {
+            "message": "投票成功",
+            "vote_id": result["vote_id"],
+            "voted_anime_count": len(data.voted_anime)
+        }
+
+    result = await AsyncVoteCRUD.cast_vote(
         db=db,
         session_id=data.session_id,
         user_id=current_user.id,
@@ -172,8 +301,14 @@ async def cast_vote(
                     content={"error": "账号或密码错误"}, 
                     status_code=400
                 )
-        
     
+    if isinstance(result, dict) and "error" in result:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=result["error"]
+        )
+    
+    votes_cast.inc("direct")
     return {
         "message": "投票成功",
         "vote_id": result.id if hasattr(result, 'id') else None,
@@ -181,36 +316,229 @@ async def cast_vote(
         "voted_anime_count": len(data.voted_anime)
     }
 
+@router.get("/write-buffer")
+async def get_write_buffer_stats(current_user: User = Depends(get_current_user)):
+    """投票写缓冲的批次大小与排队延迟统计"""
+    return vote_buffer.stats()
+
+@router.get("/admission")
+async def get_admission_stats(current_user: User = Depends(get_current_user)):
+    """投票、登录的并发名额、排队深度、拒绝次数，以及限流令牌桶的状态"""
+    return admission_stats()
+
+@router.post("/sessions/{session_id}/votes/bulk", dependencies=[Depends(vote_gate)])
+async def bulk_import_votes(
+    session_id: int,
+    data: BulkVotes,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """批量导入选票（仅会话创建者或管理员），返回每一行的处理结果"""
+    if len(data.ballots) > MAX_BULK_BALLOTS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"单次最多导入{MAX_BULK_BALLOTS}张选票"
+        )
+    
+    session = await AsyncVotingSessionCRUD.get_session_by_id(db, session_id)
+    
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="投票会话不存在"
+        )
+    
+    if session.master_id != current_user.id and current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="无权向此会话导入选票"
+        )
+    
+    result = await AsyncVoteCRUD.bulk_cast_votes(
+        db, session_id,
+        [ballot.model_dump() for ballot in data.ballots]
+    )
+    
+    if "error" in result:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=result["error"]
+        )
+    
+    votes_cast.inc("bulk", amount=result["created"] + result["updated"])
+    return {"session_id": session_id, **result}
+
 @router.get("/sessions/{session_id}/results")
 async def get_voting_results(
+    request: Request,
     session_id: int,
+    top_n: Optional[int] = Query(None, ge=1, le=1000, description="只返回排名前N的动漫"),
+    min_votes: int = Query(0, ge=0, description="最少票数，低于此票数的动漫不返回"),
+    sort_by: Optional[str] = Query(None, pattern="^(total_votes|total_score|average_score)$", description="排序字段，默认按动漫ID"),
+    order: str = Query("desc", pattern="^(asc|desc)$", description="排序方向"),
+    enrich: bool = Query(False, description="是否附带动漫标题、封面和评分"),
+    detailed: bool = Query(False, description="是否附带每个动漫的中位数、标准差和百分位"),
+    db: Session = Depends(get_db)
+):
+    """获取投票结果（公开访问，支持 If-None-Match，票数不变时返回 304）"""
+    names = [VersionCRUD.session_key(session_id)] + ([VersionCRUD.SUBJECTS] if enrich else [])
+    versions = await AsyncVersionCRUD.get_versions(db, *names)
+    
+    async def build():
+        stats = await AsyncVoteCRUD.calculate_session_stats(
+            db, session_id,
+            top_n=top_n,
+            min_votes=min_votes,
+            sort_by=sort_by,
+            order=order,
+            detailed=detailed
+        )
+        
+        if "error" in stats:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=stats["error"]
+            )
+        
+        result = {
+            "session_id": session_id,
+            "stats": stats
+        }
+        
+        if enrich:
+            result["anime"] = await get_subjects(db, list(stats["anime_stats"]))
+        
+        return result
+    
+    return await conditional_json(request, versions, build)
+
+@router.get("/leaderboard")
+async def get_leaderboard(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="返回条数"),
+    offset: int = Query(0, ge=0, description="从第几名之后开始"),
+    enrich: bool = Query(False, description="是否附带动漫标题、封面和评分"),
     db: Session = Depends(get_db)
 ):
-    """获取投票结果（公开访问）"""
-    stats = VoteCRUD.calculate_session_stats(db, session_id)
+    """全站动漫排行榜（所有公开会话，按贝叶斯平均分排序，公开访问）"""
+    names = [VersionCRUD.LEADERBOARD] + ([VersionCRUD.SUBJECTS] if enrich else [])
+    versions = await AsyncVersionCRUD.get_versions(db, *names) + (LeaderboardCRUD.etag_epoch(),)
     
-    if "error" in stats:
+    async def build():
+        result = await AsyncLeaderboardCRUD.get_leaderboard(db, limit=limit, offset=offset)
+        if enrich:
+            result["anime"] = await get_subjects(db, [entry["anime_id"] for entry in result["entries"]])
+        return result
+    
+    return await conditional_json(request, versions, build)
+
+@router.get("/leaderboard/{anime_id}")
+async def get_anime_rank(
+    request: Request,
+    anime_id: int,
+    db: Session = Depends(get_db)
+):
+    """查询单个动漫在全站排行榜中的名次（公开访问）"""
+    versions = await AsyncVersionCRUD.get_versions(db, VersionCRUD.LEADERBOARD) + (LeaderboardCRUD.etag_epoch(),)
+    
+    async def build():
+        result = await AsyncLeaderboardCRUD.get_anime_rank(db, anime_id)
+        if "error" in result:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=result["error"]
+            )
+        return result
+    
+    return await conditional_json(request, versions, build)
+
+@router.get("/sessions/{session_id}/live")
+async def subscribe_live_results(session_id: int):
+    """
+    实时投票结果（Server-Sent Events，公开访问）
+    连接后先收到 snapshot 事件（完整结果），之后每个推送间隔最多一条 delta 事件（只含变化的动漫）
+    不依赖 get_db：请求会话要到连接断开才关闭，会让每个订阅者一直占用一个数据库连接
+    """
+    session = await run_db_task(VotingSessionCRUD.get_session_by_id, session_id)
+    
+    if not session:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=stats["error"]
+            detail="投票会话不存在"
         )
     
-    return {
-        "session_id": session_id,
-        "stats": stats
-    }
+    return StreamingResponse(
+        live_hub.events(session_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/live/stats")
+async def get_live_stats(current_user: User = Depends(get_current_user)):
+    """实时推送的订阅数与推送统计"""
+    return live_hub.stats()
+
+@router.get("/sessions/{session_id}/export")
+async def export_session_votes(
+    request: Request,
+    session_id: int,
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson|msgpack)$",
+                                  description="导出格式：csv、ndjson 或 msgpack；不指定时 Accept 要求 msgpack 则为 msgpack，否则为 csv"),
+    gzip: bool = Query(False, description="是否 gzip 压缩"),
+    current_user: User = Depends(get_streaming_user)
+):
+    """流式导出会话的原始选票（仅会话创建者或管理员）；查询使用短期会话，导出期间不占用请求的数据库连接"""
+    session = await run_db_task(VotingSessionCRUD.get_session_by_id, session_id)
+    
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="投票会话不存在"
+        )
+    
+    if session.master_id != current_user.id and current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="无权导出此会话的选票"
+        )
+    
+    if format is None:
+        format = "msgpack" if negotiate(request) == MSGPACK else "csv"
+    
+    # CSV 每个动漫一行，NDJSON / msgpack 每张选票一行
+    row_count = await run_db_task(VoteCRUD.count_session_votes, session_id, per_item=(format == "csv"))
+    
+    filename = f"session_{session_id}_votes.{format}"
+    media_type = EXPORT_FORMATS[format][1]
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    
+    return StreamingResponse(
+        stream_session_ballots(session_id, format, compress=gzip),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Total-Count": str(row_count),
+            "Vary": "Accept"
+        }
+    )
 
 @router.get("/my-sessions")
 async def get_my_sessions(
+    keyword: Optional[str] = Query(None, description="按标题筛选"),
+    page: PageParams = Depends(),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """获取当前用户创建的投票会话（需要登录）"""
-    from database import VotingSession
-    
-    sessions = db.query(VotingSession).filter(
-        VotingSession.master_id == current_user.id
-    ).all()
+    """获取当前用户创建的投票会话（需要登录，游标分页）"""
+    sessions, next_cursor = await AsyncVotingSessionCRUD.get_sessions_by_master(
+        db, current_user.id,
+        limit=page.limit,
+        cursor=page.cursor,
+        order=page.order,
+        keyword=keyword
+    )
     
     return {
         "sessions": [
@@ -219,10 +547,11 @@ async def get_my_sessions(
                 "title": session.title,
                 "description": session.description,
                 "is_public": session.is_public,
-                "anime_count": len(session.anime_list) if session.anime_list else 0,
+                "anime_count": session.anime_count,
                 "total_votes": len(session.votes) if hasattr(session, 'votes') else 0,
                 "created_at": session.created_at.isoformat() if session.created_at else None
             }
             for session in sessions
-        ]
+        ],
+        "next_cursor": next_cursor
     }
\ No newline at end of file
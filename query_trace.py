@@ -0,0 +1,157 @@
+"""
+SQL 语句追踪：把每条语句及其耗时归到当前请求上
+
+- 引擎事件 before/after_cursor_execute 计时；请求通过 contextvar 关联，
+  线程池（run_in_threadpool）和 AsyncSession.run_sync 都会沿用请求的上下文
+- 超过 SQL_SLOW_QUERY_MS 的语句连同绑定参数一起打印（请求之外的后台任务也会打印）
+- 同一请求中相同形状（同一条 SQL 文本）的语句执行次数达到 SQL_N_PLUS_ONE_THRESHOLD 时视为 N+1，打印警告
+- SQL_DEBUG_HEADERS=1 时在响应头中返回本请求的语句数、耗时和疑似 N+1 的语句数
+- asyncio.create_task 会复制当前上下文：请求中启动的后台任务要用 untraced() 包装，
+  否则任务的语句会一直记到早已结束的请求上
+测试和压测脚本可以用 capture() 统计一段代码执行的语句：
+    with capture() as trace:
+        ...
+    assert trace.count <= 3 and not trace.repeated()
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from metrics import UNMATCHED_ROUTE, sql_queries, sql_duration, sql_repeated
+
+# 慢查询阈值（毫秒），0 表示不记录
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "200"))
+# 同一请求中相同语句执行多少次视为 N+1，0 表示不检测
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+# 是否在响应头中返回语句统计（调试用）
+SQL_DEBUG_HEADERS = os.getenv("SQL_DEBUG_HEADERS", "0") == "1"
+# 慢查询日志中参数的最大长度
+_MAX_PARAMS_LENGTH = 500
+
+_current = ContextVar("query_trace", default=None)
+
+
+class QueryTrace:
+    """一个请求（或一段代码）执行的语句：语句 -> [次数, 总耗时]"""
+
+    def __init__(self):
+        self.statements = {}
+        self.count = 0
+        self.duration = 0.0
+
+    def record(self, statement: str, duration: float):
+        item = self.statements.get(statement)
+        if item is None:
+            item = self.statements[statement] = [0, 0.0]
+        item[0] += 1
+        item[1] += duration
+        self.count += 1
+        self.duration += duration
+
+    def repeated(self, threshold: int = SQL_N_PLUS_ONE_THRESHOLD):
+        """执行次数达到阈值的语句：[(语句, 次数)]，按次数从多到少"""
+        if threshold <= 0:
+            return []
+        return sorted(
+            ((statement, count) for statement, (count, _) in self.statements.items() if count >= threshold),
+            key=lambda item: -item[1]
+        )
+
+
+def _shorten(statement: str) -> str:
+    return " ".join(statement.split())[:300]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_start"].pop()
+    trace = _current.get()
+    if trace is not None:
+        trace.record(statement, duration)
+    if SQL_SLOW_QUERY_MS and duration * 1000 >= SQL_SLOW_QUERY_MS:
+        params = repr(parameters)
+        if len(params) > _MAX_PARAMS_LENGTH:
+            params = params[:_MAX_PARAMS_LENGTH] + "..."
+        print(f"慢查询 {duration * 1000:.1f}ms：{_shorten(statement)} 参数：{params}")
+
+
+def _handle_error(exception_context):
+    # 出错的语句不会触发 after_cursor_execute，丢掉它的开始时间
+    starts = exception_context.connection.info.get("query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+
+def instrument(db_engine):
+    """给同步引擎（异步引擎传入 engine.sync_engine）挂上计时事件"""
+    event.listen(db_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(db_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(db_engine, "handle_error", _handle_error)
+
+
+@contextmanager
+def capture():
+    """统计 with 块中执行的语句，返回 QueryTrace"""
+    trace = QueryTrace()
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def untraced(coro):
+    """包装在请求中启动的后台任务：asyncio.create_task(untraced(task())) 的语句不归到当前请求"""
+    async def run():
+        _current.set(None)
+        return await coro
+    return run()
+
+
+class QueryTraceMiddleware:
+    """为每个 HTTP 请求建立 QueryTrace；请求结束后检查 N+1，并按路由累加语句数指标"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if SQL_DEBUG_HEADERS and message["type"] == "http.response.start":
+                # 流式响应只统计到开始发送响应为止
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-sql-queries", str(trace.count).encode()),
+                    (b"x-sql-time-ms", f"{trace.duration * 1000:.1f}".encode()),
+                    (b"x-sql-repeated", str(len(trace.repeated())).encode()),
+                ]
+            await send(message)
+
+        with capture() as trace:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                _report(scope, trace)
+
+
+def _report(scope, trace: QueryTrace):
+    """请求结束：打印疑似 N+1 的语句，并把语句数记入 /metrics"""
+    method = scope["method"]
+    route = scope.get("route")
+    route = route.path if route is not None else UNMATCHED_ROUTE
+    repeated = trace.repeated()
+    for statement, count in repeated:
+        print(f"警告：{method} {route} 中同一语句执行了 {count} 次（疑似 N+1）：{_shorten(statement)}")
+    if trace.count:
+        sql_queries.inc(method, route, amount=trace.count)
+        sql_duration.inc(method, route, amount=trace.duration)
+    if repeated:
+        sql_repeated.inc(method, route, amount=len(repeated))
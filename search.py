@@ -1,19 +1,64 @@
 from fastapi import APIRouter, Query
 import aiohttp
+import asyncio
+import os
 from typing import List, Dict,Any
 
+from cache import TTLCache
+from metrics import bangumi_requests, register_cache
+from query_trace import untraced
+
 router = APIRouter(prefix="/search", tags=["动漫搜索"])
 
-@router.get("/anime", response_model=Dict[str, Any])
-async def search_anime(
-    keyword: str = Query(..., description="搜索关键词（动漫名称）"),
-    limit: int = Query(10, ge=1, le=50, description="返回结果数量限制")
-):
+# 搜索结果缓存：同一关键词在整个季度里会被反复搜索
+# 过期后的 SEARCH_CACHE_STALE 秒内先返回旧结果，同时在后台刷新
+search_cache = TTLCache(
+    maxsize=int(os.getenv("SEARCH_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", "3600")),
+    stale_ttl=float(os.getenv("SEARCH_CACHE_STALE", "600"))
+)
+register_cache("search", search_cache)
+# 正在后台刷新的缓存键 -> 刷新任务，避免同一关键词重复刷新（同时持有任务引用）
+_refreshing = {}
+
+# Bangumi API 公共配置
+# 可以指向本地的模拟服务做压测（见 benchmarks/bangumi_stub.py）
+BANGUMI_API = os.getenv("BANGUMI_API", "https://api.bgm.tv/v0")
+BANGUMI_HEADERS = {
+    "User-Agent": "anime_voting/1.0",
+    "Content-Type": "application/json"
+}
+
+# 共享的 aiohttp 会话：复用连接池，避免每次请求都重新建立 TLS 连接
+_http_session = None
+
+def get_http_session() -> aiohttp.ClientSession:
+    """获取共享的 aiohttp 会话（需在事件循环中调用）"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            headers=BANGUMI_HEADERS,
+            timeout=aiohttp.ClientTimeout(total=10)
+        )
+    return _http_session
+
+async def close_http_session():
+    """关闭共享的 aiohttp 会话（应用关闭时调用）"""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+def _cache_key(keyword: str, limit: int):
+    """规范化缓存键：忽略首尾空白、大小写和多余空格"""
+    return (" ".join(keyword.split()).lower(), limit)
+
+async def fetch_anime_list(keyword: str, limit: int):
     """
-    通过关键词搜索动漫(调用Bangumi API)
-    用于帮助管理者查找动漫对应的bangumi_id
+    调用Bangumi搜索API，返回筛选后的动漫列表
+    请求失败时返回 {"error": ...}
     """
-    url = "https://api.bgm.tv/v0/search/subjects"
+    url = f"{BANGUMI_API}/search/subjects"
     
     # 请求参数：搜索关键词、类型为2（动画）、返回数量
     payload = {
@@ -22,42 +67,75 @@ async def search_anime(
         "limit": limit
     }
     
-    # 请求头，模拟合法客户端
-    headers = {
-        "User-Agent": "anime_voting/1.0",
-        "Content-Type": "application/json"
-    }
+    # 异步请求Bangumi搜索API（请求头见 BANGUMI_HEADERS，模拟合法客户端）
+    async with get_http_session().post(url, json=payload) as response:
+        if response.status != 200:
+            bangumi_requests.inc("search", "error")
+            return {"error": f"搜索失败，状态码: {response.status}"}
+        
+        bangumi_requests.inc("search", "ok")
+        result = await response.json()
+        raw_data = result.get("data", [])
+        
+        # 二次筛选：确保只返回类型为2（动画）的结果
+        # 因为Bangumi API的type参数是"或"关系，可能返回其他类型
+        return [
+            {
+                "bangumi_id": item.get("id"),
+                "title": item.get("name"),
+                "title_cn": item.get("name_cn"),
+                "image": (item.get("images") or {}).get("large"),
+                "score": item.get("score"),
+                "type": item.get("type")
+            }
+            for item in raw_data
+            if item.get("type") == 2  # 严格筛选动画类型
+        ]
+
+async def _refresh(key, keyword: str, limit: int):
+    """后台刷新过期的搜索结果"""
+    try:
+        anime_list = await fetch_anime_list(keyword, limit)
+        if not isinstance(anime_list, dict):
+            search_cache.set(key, anime_list)
+    except Exception as e:
+        print(f"刷新搜索缓存失败：{e}")
+    finally:
+        _refreshing.pop(key, None)
+
+@router.get("/anime", response_model=Dict[str, Any])
+async def search_anime(
+    keyword: str = Query(..., description="搜索关键词（动漫名称）"),
+    limit: int = Query(10, ge=1, le=50, description="返回结果数量限制")
+):
+    """
+    通过关键词搜索动漫(调用Bangumi API)
+    用于帮助管理者查找动漫对应的bangumi_id
+    """
+    key = _cache_key(keyword, limit)
     
     try:
-        # 异步请求Bangumi搜索API
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=headers) as response:
-                if response.status != 200:
-                    return {"error": f"搜索失败，状态码: {response.status}", "keyword": keyword}
-                
-                result = await response.json()
-                raw_data = result.get("data", [])
-                
-                # 二次筛选：确保只返回类型为2（动画）的结果
-                # 因为Bangumi API的type参数是"或"关系，可能返回其他类型
-                anime_list = [
-                    {
-                        "bangumi_id": item.get("id"),
-                        "title": item.get("name"),
-                        "title_cn": item.get("name_cn"),
-                        "image": item.get("images", {}).get("large"),
-                        "score": item.get("score"),
-                        "type": item.get("type")
-                    }
-                    for item in raw_data
-                    if item.get("type") == 2  # 严格筛选动画类型
-                ]
-                
-                return {
-                    "keyword": keyword,
-                    "count": len(anime_list),
-                    "results": anime_list
-                }
+        entry = search_cache.get_entry(key)
+        if entry is not None:
+            anime_list, fresh = entry
+            if not fresh and key not in _refreshing:
+                _refreshing[key] = asyncio.create_task(untraced(_refresh(key, keyword, limit)))
+        else:
+            anime_list = await fetch_anime_list(keyword, limit)
+            if isinstance(anime_list, dict):
+                return {"error": anime_list["error"], "keyword": keyword}
+            search_cache.set(key, anime_list)
+        
+        return {
+            "keyword": keyword,
+            "count": len(anime_list),
+            "results": anime_list
+        }
                 
     except Exception as e:
-        return {"error": f"搜索过程出错: {str(e)}", "keyword": keyword}
\ No newline at end of file
+        return {"error": f"搜索过程出错: {str(e)}", "keyword": keyword}
+
+@router.get("/cache/stats")
+async def get_search_cache_stats():
+    """查看搜索缓存的命中情况"""
+    return search_cache.stats()
@@ -3,10 +3,19 @@ from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta,timezone
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
 
+# bcrypt 成本因子（2^rounds 次迭代）。调整后，旧参数的哈希会在用户下次登录时自动重新计算
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# 计算哈希的工作线程数（bcrypt 计算时会释放 GIL，线程池即可利用多核）
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# 排队中的哈希任务上限，超过后直接拒绝，避免登录高峰把请求越积越多
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "64"))
+
 # 密码加密上下文
-pwd_context = CryptContext(schemes=["bcrypt"],deprecated="auto")# 定义一个类
+pwd_context = CryptContext(schemes=["bcrypt"],deprecated="auto",bcrypt__rounds=BCRYPT_ROUNDS)# 定义一个类
                 # CryptContext
                     # 来自 passlib 库的类，用于管理密码哈希
                     # 提供统一的接口来处理密码的加密和验证
@@ -37,6 +46,27 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 300
     # 设置访问令牌的有效时间（30分钟）
     # 过期后用户需要重新登录或刷新令牌
 
+class PasswordHashBusy(Exception):
+    """密码哈希队列已满"""
+
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+# 已提交但尚未完成的哈希任务数（只在事件循环线程中修改）
+_hash_pending = 0
+
+
+async def _run_hash(fn, *args):
+    """在哈希线程池中执行 fn，队列已满时抛出 PasswordHashBusy"""
+    global _hash_pending
+    if _hash_pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_LIMIT:
+        raise PasswordHashBusy()
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+    finally:
+        _hash_pending -= 1
+
+
 class PasswordUtils:
     """密码工具类"""
     
@@ -49,6 +79,31 @@ class PasswordUtils:
     def verify_password(plain_password: str, hashed_password: str) -> bool:
         """验证密码"""
         return pwd_context.verify(plain_password,hashed_password)
+
+    @staticmethod
+    def verify_and_update(plain_password: str, hashed_password: str):
+        """验证密码；哈希参数已过时时同时返回新哈希，返回 (是否通过, 新哈希或None)"""
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+
+    @staticmethod
+    async def hash_password_async(password: str) -> str:
+        """在哈希线程池中加密密码，不阻塞事件循环"""
+        return await _run_hash(pwd_context.hash, password)
+
+    @staticmethod
+    async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+        """在哈希线程池中验证密码"""
+        return await _run_hash(pwd_context.verify, plain_password, hashed_password)
+
+    @staticmethod
+    async def verify_and_update_async(plain_password: str, hashed_password: str):
+        """在哈希线程池中验证密码，必要时返回新哈希"""
+        return await _run_hash(pwd_context.verify_and_update, plain_password, hashed_password)
+
+    @staticmethod
+    def hash_queue_depth() -> int:
+        """当前排队和执行中的哈希任务数"""
+        return _hash_pending
     
     @staticmethod
     def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):# data: dict - 要编码到令牌中的数据
@@ -0,0 +1,110 @@
+"""
+响应序列化：orjson 生成 JSON，按 Accept 头可改为 msgpack
+
+- 默认响应类 FastJSONResponse（main.py 中设置）用 orjson 代替标准库 json
+- 结果、会话详情等接口通过 etag.conditional_json 按 Accept 选择 JSON 或 msgpack，
+  序列化后的字节按 ETag 缓存，命中时不再编码
+- 已经是 bytes 的内容直接作为响应体：
+      return FastJSONResponse(body)      # body 是序列化好的 JSON
+      return encoded_response(request, content)   # 按 Accept 序列化 content
+"""
+from datetime import date, datetime, time
+from typing import Any
+
+import msgpack
+import numpy as np
+import orjson
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+# 客户端可能使用的 msgpack 媒体类型
+_MSGPACK_TYPES = {"application/msgpack", "application/x-msgpack", "application/vnd.msgpack"}
+_JSON_TYPES = {"application/json", "application/*", "*/*"}
+
+# 统计结果的 anime_stats 以动漫ID（整数）为键
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _json_default(obj):
+    """orjson 不认识的类型（pydantic 模型、ORM 对象、Decimal、set 等）交给 jsonable_encoder"""
+    return jsonable_encoder(obj)
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    return jsonable_encoder(obj)
+
+
+def dumps_json(content: Any) -> bytes:
+    return orjson.dumps(content, default=_json_default, option=ORJSON_OPTIONS)
+
+
+def dumps_msgpack(content: Any) -> bytes:
+    return msgpack.packb(content, default=_msgpack_default, use_bin_type=True)
+
+
+def encode(content: Any, media_type: str) -> bytes:
+    """按媒体类型（JSON 或 MSGPACK）序列化"""
+    return dumps_msgpack(content) if media_type == MSGPACK else dumps_json(content)
+
+
+def negotiate(request: Request) -> str:
+    """按 Accept 头选择 JSON 或 MSGPACK：msgpack 的 q 值严格高于 JSON 时才返回 MSGPACK"""
+    header = request.headers.get("accept")
+    if not header or "msgpack" not in header:
+        return JSON
+    best, best_q = JSON, 0.0
+    for part in header.split(","):
+        media_type, _, params = part.partition(";")
+        media_type = media_type.strip().lower()
+        if media_type in _MSGPACK_TYPES:
+            candidate = MSGPACK
+        elif media_type in _JSON_TYPES:
+            candidate = JSON
+        else:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > best_q:
+            best, best_q = candidate, q
+    return best
+
+
+class FastJSONResponse(JSONResponse):
+    """用 orjson 序列化的 JSON 响应；content 为 bytes 时视为已序列化，原样返回"""
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps_json(content)
+
+
+class MsgpackResponse(Response):
+    """msgpack 响应；content 为 bytes 时视为已序列化，原样返回"""
+    media_type = MSGPACK
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps_msgpack(content)
+
+
+def encoded_response(request: Request, content: Any, headers: dict = None) -> Response:
+    """按 Accept 序列化 content 并返回响应，跳过 FastAPI 的 jsonable_encoder"""
+    media_type = negotiate(request)
+    response_class = MsgpackResponse if media_type == MSGPACK else FastJSONResponse
+    return response_class(encode(content, media_type), headers={**(headers or {}), "Vary": "Accept"})
@@ -0,0 +1,170 @@
+import os
+
+import numpy as np
+
+from database import VOTE_LEVELS
+
+# 从原始选票计算统计时，每次从数据库取回的选票张数
+STATS_CHUNK_SIZE = int(os.getenv("STATS_CHUNK_SIZE", "5000"))
+# 详细统计中输出的百分位（最近秩法：第 ceil(p% × 票数) 票的分数）
+STATS_PERCENTILES = tuple(int(p) for p in os.getenv("STATS_PERCENTILES", "25,75,90").split(","))
+
+# 等级按分数从低到高排列，列号即等级编号
+LEVELS = tuple(sorted(VOTE_LEVELS, key=lambda level: VOTE_LEVELS[level]["score"]))
+LEVEL_INDEX = {level: index for index, level in enumerate(LEVELS)}
+SCORES = np.array([VOTE_LEVELS[level]["score"] for level in LEVELS], dtype=np.float64)
+
+
+def describe(counts: np.ndarray):
+    """
+    对每一行的等级分布（票数矩阵，行数 × 等级数）计算中位数、标准差和百分位
+    分数是离散的，直接在累计票数上按秩查找，不需要展开成逐票的数组
+    返回 (中位数, 标准差, {p: 百分位}) 三组按行对齐的数组
+    """
+    totals = counts.sum(axis=1)
+    safe = np.maximum(totals, 1)
+    mean = counts @ SCORES / safe
+    variance = counts @ (SCORES ** 2) / safe - mean ** 2
+    std = np.sqrt(np.clip(variance, 0, None))
+    cumulative = counts.cumsum(axis=1)
+
+    def percentile(p):
+        rank = np.maximum(np.ceil(totals * p / 100), 1)
+        # 累计票数第一次达到目标秩的那一列
+        column = np.minimum((cumulative < rank[:, None]).sum(axis=1), len(LEVELS) - 1)
+        return np.where(totals > 0, SCORES[column], 0)
+
+    return percentile(50), np.where(totals > 0, std, 0), {p: percentile(p) for p in STATS_PERCENTILES}
+
+
+def top_k(keys: np.ndarray, anime_ids: np.ndarray, k: int = None):
+    """
+    按 keys 升序（相同时按动漫ID升序）取前 k 个的下标
+    先用 partition 找出第 k 名的值，只对不差于它的候选排序，结果与数据库 ORDER BY ... LIMIT 一致
+    """
+    candidates = np.arange(len(keys))
+    if k is not None and k < len(keys):
+        kth = np.partition(keys, k - 1)[k - 1]
+        candidates = np.flatnonzero(keys <= kth)
+    ordered = candidates[np.lexsort((anime_ids[candidates], keys[candidates]))]
+    return ordered[:k] if k is not None else ordered
+
+
+class StatsAccumulator:
+    """
+    按块累加选票的统计器：动漫ID映射为连续的行号，等级映射为列号，
+    每块用一次 bincount 累加进 (动漫数 × 等级数) 的票数矩阵，内存只与动漫数有关
+    """
+
+    def __init__(self):
+        self.rows = {}  # 动漫ID -> 行号
+        self.counts = np.zeros((0, len(LEVELS)), dtype=np.int64)
+        self.ballots = 0
+
+    def _row_numbers(self, anime_ids: np.ndarray) -> np.ndarray:
+        """把动漫ID映射为行号，只对本块中不重复的ID查字典，新出现的动漫追加到矩阵末尾"""
+        unique, inverse = np.unique(anime_ids, return_inverse=True)
+        rows = np.fromiter(
+            (self.rows.setdefault(int(anime_id), len(self.rows)) for anime_id in unique),
+            dtype=np.int64, count=len(unique)
+        )
+        if len(self.rows) > len(self.counts):
+            grown = np.zeros((len(self.rows) - len(self.counts), len(LEVELS)), dtype=np.int64)
+            self.counts = np.vstack([self.counts, grown])
+        return rows[inverse.reshape(-1)]
+
+    def add_votes(self, anime_ids, level_codes, weights=None):
+        """累加一批 (动漫ID, 等级编号[, 票数])，等级编号为 -1 的条目（未知等级）会被忽略"""
+        anime_ids = np.asarray(anime_ids, dtype=np.int64)
+        level_codes = np.asarray(level_codes, dtype=np.int64)
+        known = level_codes >= 0
+        if not known.all():
+            anime_ids, level_codes = anime_ids[known], level_codes[known]
+            weights = None if weights is None else np.asarray(weights)[known]
+        if not len(anime_ids):
+            return
+        cells = self._row_numbers(anime_ids) * len(LEVELS) + level_codes
+        added = np.bincount(cells, weights=weights, minlength=self.counts.size)
+        self.counts += added.reshape(self.counts.shape).astype(np.int64)
+
+    def add_ballots(self, ballots):
+        """累加一块原始选票（每张是 voted_anime 列表）"""
+        anime_ids, levels = [], []
+        for voted_anime in ballots:
+            self.ballots += 1
+            for item in voted_anime or ():
+                anime_ids.append(item["anime_id"])
+                levels.append(item["vote_level"])
+        try:
+            anime_ids = np.array(anime_ids, dtype=np.int64)
+        except (TypeError, ValueError):
+            # 旧数据中的动漫ID可能是字符串
+            anime_ids = np.fromiter(map(int, anime_ids), dtype=np.int64, count=len(anime_ids))
+        self.add_votes(anime_ids, [LEVEL_INDEX.get(level, -1) for level in levels])
+
+    def stats(self, top_n: int = None, min_votes: int = 0, sort_by: str = None,
+              order: str = "desc", detailed: bool = True):
+        """
+        生成与 VoteCRUD.calculate_session_stats 相同结构的结果
+        detailed=True 时每个动漫和整体额外给出 median_score / std_score / percentiles
+        """
+        anime_ids = np.fromiter(self.rows, dtype=np.int64, count=len(self.rows))
+        counts = self.counts
+        totals = counts.sum(axis=1)
+        score_sums = counts @ SCORES
+        averages = score_sums / np.maximum(totals, 1)
+
+        selected = np.flatnonzero((totals > 0) & (totals >= min_votes))
+        if sort_by:
+            keys = {"total_votes": totals, "total_score": score_sums, "average_score": averages}[sort_by][selected]
+            ranked = top_k(keys if order == "asc" else -keys, anime_ids[selected], top_n)
+        else:
+            ranked = top_k(anime_ids[selected], anime_ids[selected], top_n)
+        selected = selected[ranked]
+        if detailed:
+            medians, stds, percentiles = describe(counts[selected])
+
+        anime_stats = {}
+        for position, row in enumerate(selected.tolist()):
+            entry = {
+                "total_votes": int(totals[row]),
+                "total_score": int(score_sums[row]),
+                "vote_distribution": dict(zip(LEVELS, counts[row].tolist())),
+                "average_score": round(float(averages[row]), 2)
+            }
+            if detailed:
+                entry.update(detail(medians[position], stds[position],
+                                    {p: values[position] for p, values in percentiles.items()}))
+            anime_stats[int(anime_ids[row])] = entry
+
+        overall = counts.sum(axis=0)
+        overall_votes = int(overall.sum())
+        overall_stats = {
+            "total_votes": overall_votes,
+            "average_score": round(float(overall @ SCORES) / overall_votes, 2) if overall_votes else 0,
+            "vote_distribution": dict(zip(LEVELS, overall.tolist()))
+        }
+        if detailed:
+            medians, stds, percentiles = describe(overall[None, :])
+            overall_stats.update(detail(medians[0], stds[0], {p: values[0] for p, values in percentiles.items()}))
+        return {"total_voters": self.ballots, "anime_stats": anime_stats, "overall_stats": overall_stats}
+
+
+def detail(median, std, percentiles: dict):
+    """详细统计字段"""
+    return {
+        "median_score": float(median),
+        "std_score": round(float(std), 2),
+        "percentiles": {f"p{p}": float(value) for p, value in percentiles.items()}
+    }
+
+
+def describe_distributions(distributions: list):
+    """对若干个 {等级: 票数} 分布计算详细统计字段，返回与输入对齐的列表"""
+    counts = np.array([[distribution.get(level, 0) for level in LEVELS] for distribution in distributions],
+                      dtype=np.int64).reshape(-1, len(LEVELS))
+    medians, stds, percentiles = describe(counts)
+    return [
+        detail(medians[i], stds[i], {p: values[i] for p, values in percentiles.items()})
+        for i in range(len(distributions))
+    ]
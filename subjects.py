@@ -0,0 +1,136 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+
+from cache import TTLCache
+from crud import AsyncSubjectCRUD, SubjectCRUD
+from database import run_db_task
+from search import BANGUMI_API, get_http_session
+from metrics import bangumi_requests, register_cache
+from query_trace import untraced
+
+# 同时向 Bangumi 发起的条目请求数上限
+SUBJECT_FETCH_CONCURRENCY = int(os.getenv("SUBJECT_FETCH_CONCURRENCY", "8"))
+# 条目信息超过该时长视为过期，在后台刷新
+SUBJECT_TTL = timedelta(hours=float(os.getenv("SUBJECT_TTL_HOURS", "72")))
+# 拉取失败的条目（不存在、Bangumi 出错或超时）在这段时间（秒）内不再请求
+SUBJECT_FAILURE_TTL = float(os.getenv("SUBJECT_FAILURE_TTL_SECONDS", "60"))
+
+_semaphore = None
+# 正在拉取的条目 -> 任务，多个请求同时需要同一条目时只请求一次
+_inflight = {}
+# 后台刷新任务（持有引用，防止被回收）
+_background = set()
+# 最近拉取失败的条目
+_failures = TTLCache(maxsize=10000, ttl=SUBJECT_FAILURE_TTL)
+register_cache("subject_failures", _failures)
+
+
+def _get_semaphore():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(SUBJECT_FETCH_CONCURRENCY)
+    return _semaphore
+
+
+def subject_to_dict(subject):
+    """AnimeSubject -> 接口返回的字典"""
+    return {
+        "bangumi_id": subject.bangumi_id,
+        "title": subject.title,
+        "title_cn": subject.title_cn,
+        "image": subject.image,
+        "score": subject.score
+    }
+
+
+def _is_stale(subject):
+    fetched_at = subject.fetched_at
+    if fetched_at is None:
+        return True
+    if fetched_at.tzinfo is None:
+        # SQLite 不保存时区，写入时使用的是 UTC
+        fetched_at = fetched_at.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - fetched_at > SUBJECT_TTL
+
+
+async def _fetch_one(bangumi_id: int):
+    """请求单个条目，失败时记入 _failures 并返回 None"""
+    item = await _request_one(bangumi_id)
+    if item is None:
+        _failures.set(bangumi_id, True)
+    return item
+
+
+async def _request_one(bangumi_id: int):
+    async with _get_semaphore():
+        try:
+            async with get_http_session().get(f"{BANGUMI_API}/subjects/{bangumi_id}") as response:
+                if response.status != 200:
+                    bangumi_requests.inc("subject", "error")
+                    return None
+                item = await response.json()
+        except Exception as e:
+            bangumi_requests.inc("subject", "error")
+            print(f"获取条目 {bangumi_id} 失败：{e}")
+            return None
+    bangumi_requests.inc("subject", "ok")
+    return {
+        "bangumi_id": bangumi_id,
+        "title": item.get("name"),
+        "title_cn": item.get("name_cn"),
+        "image": (item.get("images") or {}).get("large"),
+        "score": (item.get("rating") or {}).get("score")
+    }
+
+
+async def fetch_subjects(bangumi_ids):
+    """并发（有上限）拉取一批条目，返回成功获取的条目字典列表；最近失败过的条目跳过"""
+    tasks = []
+    for bangumi_id in dict.fromkeys(bangumi_ids):
+        if _failures.get(bangumi_id) is not None:
+            continue
+        task = _inflight.get(bangumi_id)
+        if task is None:
+            task = asyncio.ensure_future(_fetch_one(bangumi_id))
+            _inflight[bangumi_id] = task
+            task.add_done_callback(lambda _, key=bangumi_id: _inflight.pop(key, None))
+        tasks.append(task)
+    results = await asyncio.gather(*tasks)
+    return [item for item in results if item is not None]
+
+
+async def refresh_subjects(bangumi_ids):
+    """拉取条目并写入本地缓存表（使用独立的数据库会话，可在后台运行）"""
+    subjects = await fetch_subjects(bangumi_ids)
+    if subjects:
+        await run_db_task(SubjectCRUD.upsert_subjects, subjects)
+    return subjects
+
+
+def schedule_refresh(bangumi_ids):
+    """在后台刷新条目信息，不等待结果；正在拉取或最近失败过的条目跳过"""
+    bangumi_ids = [
+        bangumi_id for bangumi_id in bangumi_ids
+        if bangumi_id not in _inflight and _failures.get(bangumi_id) is None
+    ]
+    if not bangumi_ids:
+        return
+    task = asyncio.create_task(untraced(refresh_subjects(bangumi_ids)))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def get_subjects(db, bangumi_ids):
+    """
+    获取一批条目信息，返回 {bangumi_id: 条目字典}，只读本地缓存表，不在请求中等待 Bangumi
+    - 本地缺失的条目不出现在结果中，在后台拉取；写入后 SUBJECTS 版本变化，之后的请求即可带上
+    - 已过期的条目先返回旧数据，同时在后台刷新
+    """
+    bangumi_ids = list(bangumi_ids)
+    cached = await AsyncSubjectCRUD.get_subjects(db, bangumi_ids)
+    result = {bangumi_id: subject_to_dict(subject) for bangumi_id, subject in cached.items()}
+
+    missing = [bangumi_id for bangumi_id in bangumi_ids if bangumi_id not in cached]
+    schedule_refresh(missing + [bangumi_id for bangumi_id, subject in cached.items() if _is_stale(subject)])
+    return result
@@ -0,0 +1,164 @@
+import asyncio
+import os
+import time
+
+from crud import VoteCRUD
+from database import run_db_task
+from query_trace import untraced
+
+# 是否启用投票写缓冲（合并提交）模式
+VOTE_WRITE_BUFFER = os.getenv("VOTE_WRITE_BUFFER", "0") == "1"
+# 每批最多写入的选票数
+VOTE_BUFFER_MAX_BATCH = int(os.getenv("VOTE_BUFFER_MAX_BATCH", "500"))
+# 第一张选票入队后最多等待多少毫秒就提交
+VOTE_BUFFER_MAX_DELAY_MS = float(os.getenv("VOTE_BUFFER_MAX_DELAY_MS", "20"))
+# 队列上限，满了之后直接拒绝（背压）
+VOTE_BUFFER_MAX_QUEUE = int(os.getenv("VOTE_BUFFER_MAX_QUEUE", "10000"))
+
+
+class VoteBufferFull(Exception):
+    """写缓冲队列已满"""
+
+
+class VoteWriteBuffer:
+    """
+    投票写缓冲：请求把已校验的选票放入队列，由唯一的写入任务按批提交
+    - 每 max_delay_ms 毫秒或攒够 max_batch 张选票提交一次，一个批次一个事务、一次 fsync
+    - submit 在所属批次提交成功后才返回，响应时数据已经落盘
+    - 只有一个写入者，不会再出现 SQLite 的 "database is locked"
+    """
+
+    def __init__(self, max_batch: int = VOTE_BUFFER_MAX_BATCH,
+                 max_delay_ms: float = VOTE_BUFFER_MAX_DELAY_MS,
+                 max_queue: int = VOTE_BUFFER_MAX_QUEUE):
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.max_queue = max_queue
+        self._queue = None
+        self._task = None
+        # 统计信息
+        self.batches = 0
+        self.ballots = 0
+        self.max_batch_size = 0
+        self.rejected = 0
+        self.failed_batches = 0
+        self.restarts = 0
+        self.queue_latency_total = 0.0
+        self.queue_latency_max = 0.0
+
+    def _ensure_started(self):
+        if self._task is not None and not self._task.done():
+            return
+        if self._task is not None:
+            # 写入任务意外退出：沿用原来的队列，已在排队的请求由新任务写入，不会一直等待
+            reason = "被取消" if self._task.cancelled() else repr(self._task.exception())
+            print(f"错误：投票写入任务已退出（{reason}），重新启动")
+            self.restarts += 1
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(untraced(self._run()))
+
+    async def submit(self, session_id: int, user_id: int, voted_anime: list):
+        """提交一张已校验的选票，等待所在批次提交后返回写入结果（status 与 vote_id，失败时为 error）"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((session_id, user_id, voted_anime, time.perf_counter(), future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise VoteBufferFull()
+        return await future
+
+    async def _next_batch(self):
+        """
+        取一批选票：至少一张，最多 max_batch 张，或等到 max_delay 到期
+        返回 (选票列表, 是否收到停止信号)
+        """
+        first = await self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _run(self):
+        while True:
+            batch, stopping = await self._next_batch()
+            if batch:
+                try:
+                    await self._write(batch)
+                except Exception as e:
+                    # 已取出的选票不能留下没有结果的请求
+                    print(f"错误：批量写入选票失败：{e}")
+                    self.failed_batches += 1
+                    for *_, future in batch:
+                        if not future.done():
+                            future.set_result({"status": "error", "error": "投票失败"})
+            if stopping:
+                return
+
+    async def _write(self, batch):
+        """在一个事务中写入一批选票，并唤醒等待的请求"""
+        try:
+            results = await run_db_task(
+                VoteCRUD.write_ballot_batch,
+                [(session_id, user_id, voted_anime) for session_id, user_id, voted_anime, _, _ in batch]
+            )
+        except Exception as e:
+            print(f"错误：批量写入选票失败：{e}")
+            self.failed_batches += 1
+            results = [{"status": "error", "error": "投票失败"}] * len(batch)
+
+        now = time.perf_counter()
+        self.batches += 1
+        self.ballots += len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+        for (_, _, _, enqueued_at, future), result in zip(batch, results):
+            latency = now - enqueued_at
+            self.queue_latency_total += latency
+            self.queue_latency_max = max(self.queue_latency_max, latency)
+            if not future.done():
+                future.set_result(result)
+
+    async def stop(self):
+        """写完队列中已有的选票后停止写入任务"""
+        if self._task is None:
+            return
+        # 写入任务意外退出时先重新启动，把队列中剩下的选票写完
+        self._ensure_started()
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        # 队列已经写空；之后可能在另一个事件循环中重新启动，届时新建队列
+        self._queue = None
+
+    def stats(self):
+        """批次大小与排队延迟统计"""
+        return {
+            "enabled": VOTE_WRITE_BUFFER,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_limit": self.max_queue,
+            "batches": self.batches,
+            "ballots": self.ballots,
+            "avg_batch_size": round(self.ballots / self.batches, 2) if self.batches else 0,
+            "max_batch_size": self.max_batch_size,
+            "avg_queue_latency_ms": round(self.queue_latency_total / self.ballots * 1000, 2) if self.ballots else 0,
+            "max_queue_latency_ms": round(self.queue_latency_max * 1000, 2),
+            "rejected": self.rejected,
+            "failed_batches": self.failed_batches,
+            "restarts": self.restarts
+        }
+
+
+vote_buffer = VoteWriteBuffer()